@@ -2,8 +2,30 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime
+import gzip
+import io
 import json
+import logging
+import os
+import pickle
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import deque
+import weakref
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from openpyxl import Workbook
+from pandas.io.parsers import TextParser
 from streamlit_gsheets import GSheetsConnection
+from google.auth.exceptions import GoogleAuthError
+from gspread.exceptions import APIError
+
+# Registro del servidor para lo que no se muestra en la interfaz
+registro = logging.getLogger("sill")
 
 # Nombres de las hojas en Google Sheets
 SHEET_CLIENTES = "clientes"
@@ -157,6 +179,1036 @@ def get_gsheets_connection():
     """Obtiene la conexión a Google Sheets con Service Account"""
     return st.connection("gsheets", type=GSheetsConnection)
 
+@st.cache_resource
+def get_spreadsheet():
+    """Obtiene el spreadsheet de gspread para operaciones por filas o rangos"""
+    conn = get_gsheets_connection()
+    return conn.client._open_spreadsheet(spreadsheet=SPREADSHEET_URL)
+
+@st.cache_resource
+def _ids_hojas():
+    """Mapa nombre de hoja → sheetId, consultado una sola vez por proceso"""
+    return {hoja.title: hoja.id for hoja in get_spreadsheet().worksheets()}
+
+# ============= ESPEJO LOCAL DE LAS HOJAS =============
+# Base SQLite local con una copia de cada hoja. leer_hoja lee desde aquí y el
+# almacenamiento configurado (Google Sheets por defecto) es el origen de sincronización.
+# Ubicación por defecto; la opción ruta_espejo la cambia (ver _ruta_espejo)
+BD_LOCAL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sill_local.db")
+# Segundos que una hoja del espejo se considera vigente antes de volver a sincronizar
+ESPEJO_TTL = 300
+# Fracción máxima de celdas modificadas para enviar un parche en lugar de reescribir la hoja
+PARCHE_MAX_FRACCION = 0.3
+# Probabilidad de releer una hoja después de escribirla para verificar la escritura
+VERIFICACION_MUESTREO = 0.05
+# Historiales que solo crecen por el final: al vencer se descargan solo las filas nuevas
+HOJAS_SOLO_AGREGAR = [SHEET_SERVICIOS, SHEET_MOVIMIENTOS, SHEET_ALINEACIONES]
+# Segundos máximos entre lecturas completas de esas hojas (recogen lo editado directamente en Google Sheets)
+LECTURA_COMPLETA_TTL = 3600
+
+def _registrar_adaptadores_sqlite():
+    """Tipos de numpy/pandas que sqlite3 no sabe guardar directamente"""
+    sqlite3.register_adapter(np.int64, int)
+    sqlite3.register_adapter(np.int32, int)
+    sqlite3.register_adapter(np.float32, float)
+    sqlite3.register_adapter(np.bool_, bool)
+    sqlite3.register_adapter(pd.Timestamp, str)
+
+def _ruta_espejo():
+    """
+    Archivo de la base del espejo (opción ruta_espejo). Las instantáneas solo valen para la versión
+    del espejo con que se guardaron y el diario guarda aquí las escrituras pendientes: con
+    ruta_instantanea en un volumen persistente, el espejo debe ir en el mismo volumen
+    """
+    return _config("ruta_espejo", BD_LOCAL_PATH)
+
+@st.cache_resource
+def get_espejo_local():
+    """Abre la base local del espejo (compartida por todas las sesiones) y su lock"""
+    _registrar_adaptadores_sqlite()
+    ruta = _ruta_espejo()
+    os.makedirs(os.path.dirname(os.path.abspath(ruta)), exist_ok=True)
+    conexion = sqlite3.connect(ruta, check_same_thread=False)
+    conexion.execute("CREATE TABLE IF NOT EXISTS _sincronizacion (hoja TEXT PRIMARY KEY, sincronizado REAL, version INTEGER DEFAULT 0)")
+    conexion.execute("CREATE TABLE IF NOT EXISTS _diario (id INTEGER PRIMARY KEY AUTOINCREMENT, creado REAL, hojas TEXT, "
+                     "lote BLOB, intentos INTEGER DEFAULT 0, ultimo_error TEXT)")
+    conexion.execute("CREATE TABLE IF NOT EXISTS _diario_apartado (id INTEGER PRIMARY KEY, creado REAL, hojas TEXT, "
+                     "lote BLOB, intentos INTEGER, ultimo_error TEXT, apartado REAL)")
+    sin_secuencias = conexion.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = '_secuencias'").fetchone() is None
+    conexion.execute("CREATE TABLE IF NOT EXISTS _secuencias (prefijo TEXT PRIMARY KEY, ultimo INTEGER)")
+    conexion.execute("CREATE TABLE IF NOT EXISTS _huecos (hoja TEXT PRIMARY KEY)")
+    if sin_secuencias:
+        _secuencias_sembrar(conexion)
+    sin_km = conexion.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = '_km_llantas'").fetchone() is None
+    conexion.execute("CREATE TABLE IF NOT EXISTS _km_llantas (hoja TEXT, id_llanta TEXT, vida INTEGER, km_min REAL, km_max REAL, "
+                     "servicios INTEGER, timestamp TEXT, profundidad_1 REAL, profundidad_2 REAL, profundidad_3 REAL, "
+                     "PRIMARY KEY (hoja, id_llanta, vida))")
+    conexion.execute("CREATE INDEX IF NOT EXISTS _km_llantas_llanta ON _km_llantas (id_llanta)")
+    if sin_km:
+        _km_sembrar(conexion)
+    # Bases creadas antes de que existiera la columna de versión
+    columnas = [fila[1] for fila in conexion.execute("PRAGMA table_info(_sincronizacion)")]
+    if 'version' not in columnas:
+        conexion.execute("ALTER TABLE _sincronizacion ADD COLUMN version INTEGER DEFAULT 0")
+    conexion.commit()
+    return conexion, threading.RLock()
+
+# Caché del proceso con la última versión normalizada de cada hoja: {hoja: (versión, DataFrame)}.
+# Toda escritura pasa por el espejo y sube la versión, así una lectura nunca devuelve una versión
+# vieja y, si nada cambió, no vuelve a leer SQLite ni la red. Se modifica bajo el lock del espejo.
+@st.cache_resource
+def _cache_hojas():
+    return {}
+
+# Versiones anteriores de cada hoja que se conservan para fusionar escrituras concurrentes
+VERSIONES_RETENIDAS = 8
+
+@st.cache_resource
+def _versiones_retenidas():
+    """Últimas VERSIONES_RETENIDAS versiones normalizadas de cada hoja: {hoja: {versión: DataFrame}}"""
+    return {}
+
+def _cache_poner(nombre_hoja, version, df):
+    """Guarda df (ya normalizado) como la versión actual de la hoja en la caché y entre las retenidas"""
+    _cache_hojas()[nombre_hoja] = (version, df)
+    versiones = _versiones_retenidas().setdefault(nombre_hoja, {})
+    versiones[version] = df
+    for vieja in sorted(versiones)[:-VERSIONES_RETENIDAS]:
+        del versiones[vieja]
+
+def _cache_obtener(nombre_hoja, version):
+    """DataFrame de la caché si corresponde a esa versión, si no None. No devuelve copia"""
+    entrada = _cache_hojas().get(nombre_hoja)
+    return entrada[1] if entrada is not None and entrada[0] == version else None
+
+def _cache_guardar(nombre_hoja, version, df):
+    """Normaliza una copia de df y la guarda como la versión indicada de la hoja"""
+    df = _normalizar_hoja(nombre_hoja, df.copy()) if df is not None and not df.empty else pd.DataFrame()
+    _cache_poner(nombre_hoja, version, df)
+    return df
+
+def _espejo_leer(nombre_hoja):
+    """Lee una hoja del espejo local. Retorna (DataFrame, momento de sincronización) o (None, None)"""
+    conexion, lock = get_espejo_local()
+    tabla = f"hoja_{nombre_hoja}"
+    with lock:
+        fila = conexion.execute("SELECT sincronizado FROM _sincronizacion WHERE hoja = ?", (nombre_hoja,)).fetchone()
+        if fila is None:
+            return None, None
+        existe = conexion.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (tabla,)).fetchone()
+        df = pd.read_sql_query(f'SELECT * FROM "{tabla}"', conexion) if existe else pd.DataFrame()
+    return df, fila[0]
+
+def _espejo_estado(nombre_hoja):
+    """(momento de sincronización, versión) de una hoja en el espejo, o (None, None) si no está"""
+    conexion, lock = get_espejo_local()
+    with lock:
+        fila = conexion.execute("SELECT sincronizado, version FROM _sincronizacion WHERE hoja = ?", (nombre_hoja,)).fetchone()
+    return (fila[0], fila[1]) if fila is not None else (None, None)
+
+def _huecos_anotar(nombre_hoja, hay_huecos):
+    """
+    Anota si la última lectura de la hoja en Google Sheets descartó filas en blanco intermedias.
+    En ese caso la fila i del espejo ya no es la fila i + 2 de la hoja y los parches deben ubicar
+    sus filas (AlmacenamientoSheets._posiciones); una reescritura completa quita los huecos.
+    """
+    conexion, lock = get_espejo_local()
+    with lock:
+        if hay_huecos:
+            conexion.execute("INSERT OR IGNORE INTO _huecos (hoja) VALUES (?)", (nombre_hoja,))
+        else:
+            conexion.execute("DELETE FROM _huecos WHERE hoja = ?", (nombre_hoja,))
+        conexion.commit()
+
+def _huecos_tiene(nombre_hoja):
+    """True si la hoja tenía filas en blanco intermedias en su última lectura"""
+    conexion, lock = get_espejo_local()
+    with lock:
+        return conexion.execute("SELECT 1 FROM _huecos WHERE hoja = ?", (nombre_hoja,)).fetchone() is not None
+
+def _hay_huecos(df):
+    """True si al leer df se descartaron filas en blanco antes de su última fila (el índice conserva la posición de cada fila)"""
+    return len(df) > 0 and df.index[-1] != len(df) - 1
+
+def _espejo_vigente(nombre_hoja, anticipacion=0):
+    """True si la hoja está en el espejo y le quedan más de `anticipacion` segundos antes de cumplir ESPEJO_TTL"""
+    sincronizado, _ = _espejo_estado(nombre_hoja)
+    return sincronizado is not None and time.time() - sincronizado <= ESPEJO_TTL - anticipacion
+
+def _espejo_nueva_version(conexion, nombre_hoja, sincronizado):
+    """Incrementa la versión de una hoja en el espejo. Si sincronizado=True también marca la hora de sincronización"""
+    conexion.execute(
+        "INSERT INTO _sincronizacion (hoja, sincronizado, version) VALUES (?, ?, 1) "
+        "ON CONFLICT(hoja) DO UPDATE SET version = COALESCE(version, 0) + 1"
+        + (", sincronizado = excluded.sincronizado" if sincronizado else ""),
+        (nombre_hoja, time.time())
+    )
+    return conexion.execute("SELECT version FROM _sincronizacion WHERE hoja = ?", (nombre_hoja,)).fetchone()[0]
+
+def _sqlite_columnas(df):
+    return ", ".join('"' + str(c).replace('"', '""') + '"' for c in df.columns)
+
+def _sqlite_insertar(conexion, tabla, df):
+    """Inserta las filas de df en una tabla SQLite (creándola si no existe) sin hacer commit"""
+    columnas = _sqlite_columnas(df)
+    marcas = ", ".join("?" * len(df.columns))
+    filas = df.astype(object).where(df.notna(), None).values.tolist()
+    conexion.execute(f'CREATE TABLE IF NOT EXISTS "{tabla}" ({columnas})')
+    conexion.executemany(f'INSERT INTO "{tabla}" ({columnas}) VALUES ({marcas})', filas)
+
+def _sqlite_reemplazar(conexion, tabla, df):
+    """Reemplaza el contenido de una tabla SQLite por df sin hacer commit (a diferencia de DataFrame.to_sql)"""
+    conexion.execute(f'DROP TABLE IF EXISTS "{tabla}"')
+    if len(df.columns) > 0:
+        _sqlite_insertar(conexion, tabla, df)
+
+def _espejo_aplicar(lote, sincronizadas=(), en_diario=False):
+    """
+    Aplica un lote de cambios (mismo formato que Almacenamiento.aplicar) al espejo en una sola
+    transacción y actualiza la caché. Las hojas en `sincronizadas` quedan marcadas como idénticas
+    al almacenamiento. Con en_diario=True el lote queda en la misma transacción en el diario
+    para enviarlo en segundo plano. Retorna {hoja: nueva versión}.
+    """
+    conexion, lock = get_espejo_local()
+    with lock:
+        try:
+            versiones = {}
+            for cambio in lote:
+                nombre_hoja = cambio['hoja']
+                if cambio['agregar'] is not None:
+                    _sqlite_insertar(conexion, f"hoja_{nombre_hoja}", cambio['agregar'])
+                else:
+                    _sqlite_reemplazar(conexion, f"hoja_{nombre_hoja}", cambio['df'])
+                _secuencias_actualizar(conexion, nombre_hoja, cambio['agregar'] if cambio['agregar'] is not None else cambio['df'])
+                _km_actualizar(conexion, nombre_hoja, cambio)
+                versiones[nombre_hoja] = _espejo_nueva_version(conexion, nombre_hoja, nombre_hoja in sincronizadas)
+            if en_diario:
+                _diario_registrar(conexion, lote)
+            conexion.commit()
+        except Exception:
+            conexion.rollback()
+            raise
+
+        for cambio in lote:
+            nombre_hoja = cambio['hoja']
+            version = versiones[nombre_hoja]
+            if cambio['agregar'] is None:
+                _cache_guardar(nombre_hoja, version, cambio['df'])
+                continue
+            # Extender la versión anterior en caché en lugar de releer la hoja
+            df_anterior = _cache_obtener(nombre_hoja, version - 1)
+            if df_anterior is not None:
+                df_nuevas = _normalizar_hoja(nombre_hoja, cambio['agregar'].copy())
+                _cache_poner(nombre_hoja, version, _concatenar_hoja(nombre_hoja, df_anterior, df_nuevas))
+    if en_diario:
+        _evento_diario().set()
+    return versiones
+
+def _espejo_guardar(nombre_hoja, df, sincronizado=True, version_esperada=None):
+    """
+    Reemplaza el contenido de una hoja en el espejo local. Retorna la nueva versión de la hoja.
+    Con version_esperada (0 = hoja ausente) no hace nada y retorna None si la hoja cambió mientras
+    se descargaba df, para no pisar una escritura más reciente con una copia vieja.
+    """
+    conexion, lock = get_espejo_local()
+    with lock:
+        if version_esperada is not None and (_espejo_estado(nombre_hoja)[1] or 0) != version_esperada:
+            return None
+        lote = [{'hoja': nombre_hoja, 'anterior': None, 'df': df, 'agregar': None}]
+        return _espejo_aplicar(lote, sincronizadas=[nombre_hoja] if sincronizado else [])[nombre_hoja]
+
+def _espejo_agregar(nombre_hoja, df_nuevas, sincronizado=False, version_esperada=None):
+    """
+    Agrega filas al final de una hoja del espejo local sin reescribirla. Retorna la nueva versión.
+    sincronizado y version_esperada funcionan igual que en _espejo_guardar.
+    """
+    conexion, lock = get_espejo_local()
+    with lock:
+        if version_esperada is not None and (_espejo_estado(nombre_hoja)[1] or 0) != version_esperada:
+            return None
+        lote = [{'hoja': nombre_hoja, 'anterior': None, 'df': None, 'agregar': df_nuevas}]
+        return _espejo_aplicar(lote, sincronizadas=[nombre_hoja] if sincronizado else [])[nombre_hoja]
+
+@st.cache_resource
+def _lecturas_completas():
+    """Momento de la última lectura completa de cada hoja en este proceso: {hoja: time.time()}"""
+    return {}
+
+def _pedido_cola(nombre_hoja):
+    """
+    Si la hoja se puede actualizar leyendo solo su final, retorna (fila, columnas, clave, id_ultima, sobrantes):
+    la fila de la hoja (con encabezado en la fila 1) desde donde leer, las columnas del espejo, la
+    columna clave, su valor en la última fila del espejo que lo tiene y cuántas filas sin clave la
+    siguen. Si no, None (lectura completa). Las lecturas descartan las filas en blanco de la hoja, así
+    que contando las filas del espejo esa última fila queda en `fila` o más abajo: _espejo_completar la
+    busca por su clave.
+    """
+    if _hoja_base(nombre_hoja) not in HOJAS_SOLO_AGREGAR:
+        return None
+    if time.time() - _lecturas_completas().get(nombre_hoja, 0) > LECTURA_COMPLETA_TTL:
+        return None
+    conexion, lock = get_espejo_local()
+    tabla = f"hoja_{nombre_hoja}"
+    with lock:
+        if not conexion.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (tabla,)).fetchone():
+            return None
+        columnas = [descripcion[0] for descripcion in conexion.execute(f'SELECT * FROM "{tabla}" LIMIT 0').description]
+        clave = CLAVES_HOJAS.get(_hoja_base(nombre_hoja))
+        if clave not in columnas:
+            clave = columnas[0]
+        columna = '"' + clave.replace('"', '""') + '"'
+        ultima = conexion.execute(f'SELECT rowid, {columna} FROM "{tabla}" '
+                                  f"WHERE COALESCE(TRIM({columna}), '') != '' ORDER BY rowid DESC LIMIT 1").fetchone()
+        if ultima is None:
+            return None
+        cantidad = conexion.execute(f'SELECT COUNT(*) FROM "{tabla}" WHERE rowid <= ?', (ultima[0],)).fetchone()[0]
+        sobrantes = conexion.execute(f'SELECT COUNT(*) FROM "{tabla}" WHERE rowid > ?', (ultima[0],)).fetchone()[0]
+    return cantidad + 1, columnas, clave, _texto_normalizado(pd.Series([ultima[1]], dtype=object)).iloc[0], sobrantes
+
+def _espejo_completar(nombre_hoja, pedido, df_cola, version_esperada):
+    """
+    Agrega al espejo las filas leídas desde la última fila conocida (pedido de _pedido_cola).
+    Retorna False si la hoja no coincide con el espejo (se borraron o movieron filas, cambiaron
+    las columnas) y hace falta una lectura completa.
+    """
+    fila, columnas, clave, id_ultima, sobrantes = pedido
+    if df_cola.empty or list(df_cola.columns) != columnas:
+        registro.warning("%s: la cola leída desde la fila %s no coincide con las columnas del espejo; lectura completa",
+                         nombre_hoja, fila)
+        return False
+    # La última aparición: antes de ella solo puede haber filas que el espejo ya tiene
+    posiciones = np.flatnonzero(_texto_normalizado(df_cola[clave].astype(object)).values == id_ultima)
+    if not len(posiciones):
+        registro.warning("%s: %s no está desde la fila %s (se borraron o movieron filas); lectura completa",
+                         nombre_hoja, id_ultima, fila)
+        return False
+    _espejo_agregar(nombre_hoja, df_cola.iloc[posiciones[-1] + 1 + sobrantes:], sincronizado=True,
+                    version_esperada=version_esperada)
+    return True
+
+# ============= SECUENCIAS DE IDS =============
+# Consecutivos de los IDs por prefijo (ej: TR01_S → TR01_S0001, TR01_S0002, ...) en la tabla
+# _secuencias del espejo. Cada cambio que pasa por _espejo_aplicar (escrituras, filas agregadas
+# y sincronizaciones, que traen lo editado directamente en Google Sheets) sube en la misma
+# transacción el consecutivo de los prefijos que aparecen en sus filas, así la tabla nunca queda
+# por detrás de la hoja. Asignar un ID es un solo incremento atómico, sin recorrer la hoja: dos
+# sesiones del proceso nunca reciben el mismo número y un ID borrado no se vuelve a usar.
+# Columna de IDs consecutivos de cada hoja (las particiones usan la de su hoja)
+COLUMNAS_SECUENCIA = {
+    SHEET_VEHICULOS: 'id_vehiculo',
+    SHEET_LLANTAS: 'id_llanta',
+    SHEET_SERVICIOS: 'id_servicio',
+    SHEET_MOVIMIENTOS: 'id_movimiento',
+    SHEET_ALINEACIONES: 'id_alineacion',
+}
+
+def _maximos_secuencia(nombre_hoja, df):
+    """{prefijo: mayor consecutivo} de los IDs de df (ej: TR01_S0012 → TR01_S: 12)"""
+    columna = COLUMNAS_SECUENCIA.get(_hoja_base(nombre_hoja))
+    if columna is None or df is None or columna not in df.columns:
+        return {}
+    partes = _texto_normalizado(df[columna].astype(object)).str.extract(r'^(.+?_[A-Z]+)(\d+)').dropna()
+    numeros = pd.to_numeric(partes[1], errors='coerce')
+    return {prefijo: int(maximo) for prefijo, maximo in numeros.groupby(partes[0]).max().dropna().items()}
+
+def _secuencias_actualizar(conexion, nombre_hoja, df):
+    """Sube los consecutivos a los IDs de df (dentro de la transacción del llamador)"""
+    conexion.executemany(
+        "INSERT INTO _secuencias (prefijo, ultimo) VALUES (?, ?) "
+        "ON CONFLICT(prefijo) DO UPDATE SET ultimo = MAX(ultimo, excluded.ultimo)",
+        list(_maximos_secuencia(nombre_hoja, df).items())
+    )
+
+def _secuencias_sembrar(conexion):
+    """Llena la tabla de secuencias con las hojas que ya están en el espejo (bases anteriores a la tabla)"""
+    tablas = [fila[0] for fila in conexion.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'hoja_%'")]
+    for tabla in tablas:
+        nombre_hoja = tabla[len("hoja_"):]
+        columna = COLUMNAS_SECUENCIA.get(_hoja_base(nombre_hoja))
+        columnas = [fila[1] for fila in conexion.execute(f'PRAGMA table_info("{tabla}")')]
+        if columna in columnas:
+            _secuencias_actualizar(conexion, nombre_hoja, pd.read_sql_query(f'SELECT "{columna}" FROM "{tabla}"', conexion))
+
+def asignar_consecutivos(nombre_hoja, prefijo, cantidad):
+    """
+    Reserva en una sola operación `cantidad` consecutivos seguidos de un prefijo de IDs de la hoja
+    y retorna la lista de números. Si la hoja (o alguna de sus particiones) aún no está en el
+    espejo la lee primero, para que la secuencia parta de sus IDs.
+    """
+    if cantidad <= 0:
+        return []
+    if any(_espejo_estado(fisica)[0] is None for fisica in _hojas_fisicas(nombre_hoja)):
+        leer_hoja(nombre_hoja)
+    conexion, lock = get_espejo_local()
+    with lock:
+        try:
+            conexion.execute("INSERT INTO _secuencias (prefijo, ultimo) VALUES (?, ?) "
+                             "ON CONFLICT(prefijo) DO UPDATE SET ultimo = ultimo + excluded.ultimo", (prefijo, cantidad))
+            ultimo = conexion.execute("SELECT ultimo FROM _secuencias WHERE prefijo = ?", (prefijo,)).fetchone()[0]
+            conexion.commit()
+        except Exception:
+            conexion.rollback()
+            raise
+    return list(range(ultimo - cantidad + 1, ultimo + 1))
+
+def asignar_consecutivo(nombre_hoja, prefijo):
+    """Reserva el siguiente consecutivo de un prefijo de IDs de la hoja y lo retorna"""
+    return asignar_consecutivos(nombre_hoja, prefijo, 1)[0]
+
+# ============= KILÓMETROS POR LLANTA Y VIDA =============
+# Resumen de los servicios por (hoja física, id_llanta, vida) en la tabla _km_llantas del espejo:
+# km mínimo y máximo, cantidad de servicios y las profundidades del último. Se mantiene en la
+# misma transacción que cada cambio de _espejo_aplicar, igual que las secuencias: las filas
+# agregadas suman al resumen sin leer el historial y una hoja reescrita (edición, borrado o
+# sincronización completa) solo recalcula los resúmenes de esa hoja física. Los costos/km se
+# derivan de aquí, así registrar un servicio no se vuelve más lento a medida que crece el historial.
+# Vida con la que se resumen los servicios sin vida (cuentan para el km acumulado de la llanta)
+VIDA_SIN_DATO = -1
+COLUMNAS_KM = ['id_llanta', 'vida', 'km_min', 'km_max', 'servicios', 'timestamp',
+               'profundidad_1', 'profundidad_2', 'profundidad_3']
+
+def _resumen_km(df):
+    """Resumen por (id_llanta, vida) de filas de servicios (serializadas o normalizadas), con las columnas COLUMNAS_KM"""
+    if df is None or df.empty or 'id_llanta' not in df.columns:
+        return pd.DataFrame(columns=COLUMNAS_KM)
+
+    def numeros(col):
+        if col not in df.columns:
+            return np.full(len(df), np.nan)
+        return pd.to_numeric(df[col], errors='coerce').astype('float64').values
+
+    timestamp = (_serializar_columna(df['timestamp'], ESQUEMAS[SHEET_SERVICIOS]['timestamp'])
+                 if 'timestamp' in df.columns else pd.Series('', index=df.index))
+    filas = pd.DataFrame({
+        'id_llanta': _texto_normalizado(df['id_llanta'].astype(object)).values,
+        'vida': pd.Series(numeros('vida')).fillna(VIDA_SIN_DATO).astype(int).values,
+        'kilometraje': numeros('kilometraje'),
+        'timestamp': timestamp.astype(object).where(timestamp.notna(), '').astype(str).values,
+        'profundidad_1': numeros('profundidad_1'),
+        'profundidad_2': numeros('profundidad_2'),
+        'profundidad_3': numeros('profundidad_3'),
+    })
+    claves = ['id_llanta', 'vida']
+    resumen = filas.groupby(claves).agg(km_min=('kilometraje', 'min'), km_max=('kilometraje', 'max'),
+                                        servicios=('kilometraje', 'size'))
+    # Último servicio de cada grupo en el orden de la hoja (como servicios_llanta.iloc[-1])
+    ultimas = filas.drop_duplicates(claves, keep='last').set_index(claves)
+    resumen = resumen.join(ultimas[['timestamp', 'profundidad_1', 'profundidad_2', 'profundidad_3']])
+    return resumen.reset_index()[COLUMNAS_KM]
+
+def _km_actualizar(conexion, nombre_hoja, cambio):
+    """Actualiza _km_llantas con un cambio de _espejo_aplicar (dentro de la transacción del llamador)"""
+    if _hoja_base(nombre_hoja) != SHEET_SERVICIOS:
+        return
+    if cambio['agregar'] is None:
+        conexion.execute("DELETE FROM _km_llantas WHERE hoja = ?", (nombre_hoja,))
+    resumen = _resumen_km(cambio['agregar'] if cambio['agregar'] is not None else cambio['df'])
+    filas = resumen.astype(object).where(resumen.notna(), None).values.tolist()
+    # Las filas agregadas van después de las que ya estaban: su último servicio pasa a ser el del grupo
+    conexion.executemany(
+        f"INSERT INTO _km_llantas (hoja, {', '.join(COLUMNAS_KM)}) VALUES (?, {', '.join('?' * len(COLUMNAS_KM))}) "
+        "ON CONFLICT(hoja, id_llanta, vida) DO UPDATE SET "
+        "km_min = MIN(COALESCE(km_min, excluded.km_min), COALESCE(excluded.km_min, km_min)), "
+        "km_max = MAX(COALESCE(km_max, excluded.km_max), COALESCE(excluded.km_max, km_max)), "
+        "servicios = servicios + excluded.servicios, timestamp = excluded.timestamp, "
+        "profundidad_1 = excluded.profundidad_1, profundidad_2 = excluded.profundidad_2, profundidad_3 = excluded.profundidad_3",
+        [[nombre_hoja] + fila for fila in filas]
+    )
+
+def _km_sembrar(conexion):
+    """Llena _km_llantas con los servicios que ya están en el espejo (bases anteriores a la tabla)"""
+    tablas = [fila[0] for fila in conexion.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'hoja_%'")]
+    for tabla in tablas:
+        nombre_hoja = tabla[len("hoja_"):]
+        if _hoja_base(nombre_hoja) == SHEET_SERVICIOS:
+            df = pd.read_sql_query(f'SELECT * FROM "{tabla}"', conexion)
+            _km_actualizar(conexion, nombre_hoja, {'df': df, 'agregar': None})
+
+def resumen_km_llantas(ids_llanta=None):
+    """
+    Resumen por (id_llanta, vida) de todo el historial de servicios (todas las particiones) para
+    las llantas indicadas (todas si ids_llanta es None), con las columnas COLUMNAS_KM.
+    Se arma desde _km_llantas sin leer el historial; dentro de una UnidadDeTrabajo incluye los
+    servicios pendientes de confirmar.
+    """
+    fisicas = _hojas_fisicas(SHEET_SERVICIOS)
+    # Sincronizar primero si alguna partición falta en el espejo o está vencida
+    if any(not _espejo_vigente(fisica) for fisica in fisicas):
+        leer_hoja(SHEET_SERVICIOS)
+
+    unidad = _unidad_actual()
+    pendientes = {fisica: unidad.cambios[fisica] for fisica in fisicas
+                  if unidad is not None and unidad.tiene_cambios(fisica)}
+    # Las hojas que la unidad reescribe se resumen desde su contenido pendiente
+    confirmadas = [fisica for fisica in fisicas if fisica not in pendientes or pendientes[fisica]['df'] is None]
+    consulta = f"SELECT hoja, {', '.join(COLUMNAS_KM)} FROM _km_llantas WHERE hoja IN ({', '.join('?' * len(confirmadas))})"
+    parametros = list(confirmadas)
+    if ids_llanta is not None and len(ids_llanta) <= 500:
+        consulta += f" AND id_llanta IN ({', '.join('?' * len(ids_llanta))})"
+        parametros += [str(id_llanta) for id_llanta in ids_llanta]
+    conexion, lock = get_espejo_local()
+    with lock:
+        partes = [pd.read_sql_query(consulta + " ORDER BY hoja", conexion, params=parametros)]
+    for fisica, cambio in pendientes.items():
+        partes.append(_resumen_km(cambio['df'] if cambio['df'] is not None else cambio['agregar']).assign(hoja=fisica))
+    partes = [parte for parte in partes if not parte.empty]
+    if not partes:
+        return pd.DataFrame(columns=COLUMNAS_KM)
+    resumenes = pd.concat(partes, ignore_index=True)
+    if ids_llanta is not None:
+        resumenes = resumenes[resumenes['id_llanta'].isin([str(id_llanta) for id_llanta in ids_llanta])]
+
+    # Combinar las hojas físicas: el último servicio es el de timestamp más reciente
+    claves = ['id_llanta', 'vida']
+    resumen = resumenes.groupby(claves).agg(km_min=('km_min', 'min'), km_max=('km_max', 'max'),
+                                            servicios=('servicios', 'sum'))
+    ultimas = (resumenes.sort_values('timestamp', kind='stable', na_position='first')
+               .drop_duplicates(claves, keep='last').set_index(claves))
+    resumen = resumen.join(ultimas[['timestamp', 'profundidad_1', 'profundidad_2', 'profundidad_3']])
+    return resumen.reset_index()[COLUMNAS_KM]
+
+# ============= DIARIO DE ESCRITURAS =============
+# Con un almacenamiento remoto (Google Sheets) las escrituras no esperan a la red: se aplican
+# al espejo y se anotan en la tabla _diario en la misma transacción, y un hilo del proceso las
+# envía en orden. Si un envío falla por cuota o por la red se reintenta con espera exponencial sin
+# saltarlo, para que las escrituras lleguen en el mismo orden en que se hicieron. Un lote que falla
+# por otra causa (o que agota DIARIO_MAX_INTENTOS) se aparta en _diario_apartado para que el
+# administrador lo revise, y sus hojas se vuelven a leer completas de Google Sheets: así un lote
+# inválido no bloquea el resto del diario ni la sincronización de esas hojas. El diario vive en la
+# base del espejo, así lo pendiente sobrevive a un reinicio de la aplicación.
+# Espera (segundos) antes del primer reintento; se duplica en cada falla hasta DIARIO_ESPERA_MAX
+DIARIO_ESPERA_BASE = 2
+DIARIO_ESPERA_MAX = 300
+# Reintentos de un lote con errores transitorios antes de apartarlo
+DIARIO_MAX_INTENTOS = 12
+
+@st.cache_resource
+def _evento_diario():
+    """Evento que despierta al hilo del diario cuando hay una escritura nueva"""
+    return threading.Event()
+
+# Máximo de avisos del hilo del diario que se guardan para mostrar al administrador
+DIARIO_MAX_AVISOS = 20
+
+@st.cache_resource
+def avisos_diario():
+    """
+    Avisos del hilo del diario (verificaciones fallidas) para mostrar en la interfaz:
+    el hilo no tiene contexto de Streamlit y no puede usar st.warning. deque de (momento, mensaje).
+    """
+    return deque(maxlen=DIARIO_MAX_AVISOS)
+
+@st.cache_resource
+def _lock_diario():
+    """Un solo envío del diario a la vez, para respetar el orden"""
+    return threading.Lock()
+
+def _cambio_para_diario(cambio):
+    """
+    Lo que el diario guarda de un cambio: las filas agregadas, el parche respecto de 'anterior'
+    o, si conviene reescribir la hoja, solo la hoja nueva. Nunca las dos versiones completas.
+    """
+    anterior = cambio['anterior']
+    parche = None
+    # Con huecos en la hoja, la hoja nueva permite reescribirla si sus filas no se pueden ubicar
+    if cambio['agregar'] is None and anterior is not None and len(anterior.columns) and not _huecos_tiene(cambio['hoja']):
+        parche = _parche(anterior, cambio['df'])
+    if parche is None:
+        return {**cambio, 'anterior': None}
+    return {'hoja': cambio['hoja'], 'anterior': None, 'df': None, 'agregar': None, 'parche': parche}
+
+def _diario_registrar(conexion, lote):
+    """Anota un lote en el diario (dentro de la transacción del llamador)"""
+    hojas = ",".join(cambio['hoja'] for cambio in lote)
+    conexion.execute("INSERT INTO _diario (creado, hojas, lote) VALUES (?, ?, ?)",
+                     (time.time(), hojas, pickle.dumps([_cambio_para_diario(cambio) for cambio in lote])))
+
+def _diario_pendiente(nombre_hoja):
+    """True si la hoja tiene escrituras del diario sin enviar"""
+    conexion, lock = get_espejo_local()
+    with lock:
+        fila = conexion.execute("SELECT 1 FROM _diario WHERE ',' || hojas || ',' LIKE ? LIMIT 1",
+                                (f"%,{nombre_hoja},%",)).fetchone()
+    return fila is not None
+
+def estado_diario():
+    """(cantidad de lotes pendientes, último error de envío o None)"""
+    conexion, lock = get_espejo_local()
+    with lock:
+        pendientes = conexion.execute("SELECT COUNT(*) FROM _diario").fetchone()[0]
+        fila = conexion.execute("SELECT ultimo_error FROM _diario ORDER BY id LIMIT 1").fetchone()
+    return pendientes, fila[0] if fila else None
+
+def _es_error_transitorio(error):
+    """True si un envío fallido vale la pena reintentarlo: cuota, red o error del servidor (5xx)"""
+    if _es_error_cuota(error) or isinstance(error, OSError):
+        return True
+    codigo = getattr(getattr(error, 'response', None), 'status_code', None)
+    if isinstance(codigo, int) and codigo >= 500:
+        return True
+    return type(error).__name__ == 'TransportError'
+
+def _diario_apartar(conexion, id_entrada, hojas, error):
+    """
+    Mueve un lote del diario a _diario_apartado y marca sus hojas para releerlas completas:
+    lo que el lote aplicó al espejo no llegó a Google Sheets. Toma el lock del espejo el llamador.
+    """
+    conexion.execute("INSERT INTO _diario_apartado (id, creado, hojas, lote, intentos, ultimo_error, apartado) "
+                     "SELECT id, creado, hojas, lote, intentos + 1, ?, ? FROM _diario WHERE id = ?",
+                     (str(error), time.time(), id_entrada))
+    conexion.execute("DELETE FROM _diario WHERE id = ?", (id_entrada,))
+    for nombre_hoja in hojas:
+        conexion.execute("UPDATE _sincronizacion SET sincronizado = 0 WHERE hoja = ?", (nombre_hoja,))
+        _lecturas_completas().pop(nombre_hoja, None)
+
+def lotes_apartados():
+    """Lotes del diario que no se pudieron enviar: DataFrame con id, creado, hojas, intentos, ultimo_error"""
+    conexion, lock = get_espejo_local()
+    with lock:
+        return pd.read_sql_query("SELECT id, creado, hojas, intentos, ultimo_error FROM _diario_apartado ORDER BY id", conexion)
+
+def descartar_lote_apartado(id_entrada):
+    """Borra un lote apartado después de revisarlo"""
+    conexion, lock = get_espejo_local()
+    with lock:
+        conexion.execute("DELETE FROM _diario_apartado WHERE id = ?", (id_entrada,))
+        conexion.commit()
+
+def _diario_enviar(almacenamiento, lote):
+    """Envía a un almacenamiento un lote del diario con cambios solo de sus hojas"""
+    cambio = lote[0]
+    # Un cambio suelto usa las operaciones de siempre (parche/reescritura o append de filas)
+    if len(lote) == 1 and cambio['agregar'] is not None:
+        almacenamiento.agregar(cambio['hoja'], cambio['agregar'])
+    elif len(lote) == 1 and cambio.get('parche') is None:
+        almacenamiento.escribir(cambio['hoja'], cambio['df'], cambio['anterior'])
+    else:
+        almacenamiento.aplicar(lote)
+
+def vaciar_diario():
+    """
+    Envía en orden los lotes pendientes del diario. Se detiene en el primero que falla por un error
+    transitorio; los que fallan por otra causa o agotan los reintentos se apartan y se sigue.
+    Retorna None si el diario quedó vacío, o los segundos a esperar antes de reintentar.
+    """
+    conexion, lock = get_espejo_local()
+    with _lock_diario():
+        while True:
+            with lock:
+                fila = conexion.execute("SELECT id, lote, intentos FROM _diario ORDER BY id LIMIT 1").fetchone()
+            if fila is None:
+                return None
+            id_entrada, lote, intentos = fila[0], pickle.loads(fila[1]), fila[2]
+            try:
+                # Cada almacenamiento recibe solo los cambios de sus hojas
+                grupos = {}
+                for cambio in lote:
+                    grupos.setdefault(get_almacenamiento(cambio['hoja']), []).append(cambio)
+                for almacenamiento, cambios in grupos.items():
+                    _diario_enviar(almacenamiento, cambios)
+                    # Lo ya enviado sale de la entrada: un reintento no lo vuelve a enviar
+                    lote = [cambio for cambio in lote if all(cambio is not enviado for enviado in cambios)]
+                    if lote:
+                        with lock:
+                            conexion.execute("UPDATE _diario SET hojas = ?, lote = ? WHERE id = ?",
+                                             (",".join(c['hoja'] for c in lote), pickle.dumps(lote), id_entrada))
+                            conexion.commit()
+            except Exception as e:
+                apartar = not _es_error_transitorio(e) or intentos + 1 >= DIARIO_MAX_INTENTOS
+                with lock:
+                    if apartar:
+                        _diario_apartar(conexion, id_entrada, {c['hoja'] for c in lote}, e)
+                    else:
+                        conexion.execute("UPDATE _diario SET intentos = intentos + 1, ultimo_error = ? WHERE id = ?",
+                                         (str(e), id_entrada))
+                    conexion.commit()
+                if apartar:
+                    continue
+                return min(DIARIO_ESPERA_MAX, DIARIO_ESPERA_BASE * 2 ** intentos)
+            with lock:
+                conexion.execute("DELETE FROM _diario WHERE id = ?", (id_entrada,))
+                conexion.commit()
+            # Verificación por muestreo de lo enviado, cuando ya no queda nada más pendiente de esa hoja
+            if random.random() < VERIFICACION_MUESTREO:
+                for nombre_hoja in {c['hoja'] for cambios in grupos.values() for c in cambios}:
+                    if not _diario_pendiente(nombre_hoja) and not _verificar_escritura(nombre_hoja):
+                        avisos_diario().append((time.time(), _mensaje_verificacion(nombre_hoja)))
+
+@st.cache_resource
+def iniciar_diario():
+    """Arranca una sola vez por proceso el hilo que envía el diario"""
+    def enviar():
+        while True:
+            _evento_diario().wait(timeout=REFRESCO_INTERVALO)
+            _evento_diario().clear()
+            try:
+                espera = vaciar_diario()
+            except Exception:
+                espera = DIARIO_ESPERA_BASE
+            if espera:
+                time.sleep(espera)
+
+    hilo = threading.Thread(target=enviar, name="sill-diario", daemon=True)
+    hilo.start()
+    return hilo
+
+def _sincronizar_hoja(nombre_hoja, completa=False):
+    """
+    Descarga una hoja de su almacenamiento (sin caché) y actualiza el espejo local.
+    En HOJAS_SOLO_AGREGAR descarga solo las filas nuevas, salvo con completa=True.
+    """
+    if _diario_pendiente(nombre_hoja):
+        # Hay escrituras sin enviar: la copia local es la más reciente
+        df, _ = _espejo_leer(nombre_hoja)
+        return df
+    version_previa = _espejo_estado(nombre_hoja)[1] or 0
+    almacenamiento = get_almacenamiento(nombre_hoja)
+    pedido = None if completa else _pedido_cola(nombre_hoja)
+    if pedido is not None:
+        df_cola = almacenamiento.leer_colas({nombre_hoja: pedido[:2]})[nombre_hoja]
+        if _espejo_completar(nombre_hoja, pedido, df_cola, version_previa):
+            df, _ = _espejo_leer(nombre_hoja)
+            return df
+    df = almacenamiento.leer(nombre_hoja)
+    _lecturas_completas()[nombre_hoja] = time.time()
+    _espejo_guardar(nombre_hoja, df, version_esperada=version_previa)
+    return df
+
+# Fallas esperables de una precarga: API de Google (cuota, permisos, hoja inexistente), autenticación,
+# red y hojas que no se pueden interpretar o guardar en el espejo (columnas que no coinciden)
+ERRORES_PRECARGA = (APIError, GoogleAuthError, OSError, ValueError, KeyError, sqlite3.Error)
+
+def precargar_hojas(nombres_hojas, anticipacion=0, desde=None, hasta=None):
+    """
+    Sincroniza de una vez todas las hojas vencidas (o a menos de `anticipacion` segundos de vencer)
+    que va a usar una página. En Google Sheets es un solo values.batchGet en lugar de una petición por hoja.
+    De las hojas particionadas solo precarga los años entre desde y hasta (date o None).
+    """
+    fisicas = [fisica for nombre in nombres_hojas for fisica in _hojas_fisicas(nombre, desde, hasta)]
+    vencidas = [nombre for nombre in dict.fromkeys(fisicas)
+                if not _espejo_vigente(nombre, anticipacion) and not _diario_pendiente(nombre)]
+    por_almacenamiento = {}
+    for nombre_hoja in vencidas:
+        por_almacenamiento.setdefault(get_almacenamiento(nombre_hoja), []).append(nombre_hoja)
+    for almacenamiento, hojas in por_almacenamiento.items():
+        try:
+            versiones = {nombre: _espejo_estado(nombre)[1] or 0 for nombre in hojas}
+            # Historiales: una sola petición con las colas de todos; los que no coinciden se leen completos
+            pedidos = {nombre: _pedido_cola(nombre) for nombre in hojas}
+            pedidos = {nombre: pedido for nombre, pedido in pedidos.items() if pedido is not None}
+            if pedidos:
+                colas = almacenamiento.leer_colas({nombre: pedido[:2] for nombre, pedido in pedidos.items()})
+                hojas = [nombre for nombre in hojas if nombre not in pedidos
+                         or not _espejo_completar(nombre, pedidos[nombre], colas[nombre], versiones[nombre])]
+            if not hojas:
+                continue
+            for nombre_hoja, df in almacenamiento.leer_varias(hojas).items():
+                _lecturas_completas()[nombre_hoja] = time.time()
+                _espejo_guardar(nombre_hoja, df, version_esperada=versiones[nombre_hoja])
+        except ERRORES_PRECARGA as e:
+            # leer_hoja volverá a intentar cada hoja por separado
+            registro.warning("No se pudieron precargar %s; se leerán una por una: %s", ", ".join(hojas), e)
+
+# ============= REFRESCO EN SEGUNDO PLANO =============
+# Un hilo del proceso vuelve a descargar las hojas más usadas antes de que venzan en el
+# espejo, así ninguna sesión tiene que esperar la descarga completa al cruzar ESPEJO_TTL.
+HOJAS_CALIENTES = [SHEET_LLANTAS, SHEET_SERVICIOS, SHEET_VEHICULOS, SHEET_MOVIMIENTOS]
+# Segundos antes del vencimiento en que el hilo descarga de nuevo una hoja
+REFRESCO_ANTICIPACION = 60
+# Segundos entre revisiones del hilo
+REFRESCO_INTERVALO = 15
+
+@st.cache_resource
+def iniciar_refresco():
+    """Arranca una sola vez por proceso el hilo que refresca HOJAS_CALIENTES"""
+    def refrescar():
+        while True:
+            try:
+                precargar_hojas(HOJAS_CALIENTES, anticipacion=REFRESCO_ANTICIPACION)
+                guardar_instantanea()
+            except Exception:
+                # Si el hilo falla, leer_hoja sincroniza al vencer como siempre
+                pass
+            time.sleep(REFRESCO_INTERVALO)
+
+    hilo = threading.Thread(target=refrescar, name="sill-refresco", daemon=True)
+    hilo.start()
+    return hilo
+
+# ============= INSTANTÁNEA PARA EL ARRANQUE =============
+# Tras un reinicio o un nuevo despliegue, el primer usuario esperaba a que cada hoja vencida se
+# descargara y a que todas se volvieran a normalizar desde SQLite. El hilo de refresco guarda
+# cada hoja de la caché, ya normalizada y tipada, en un archivo Feather comprimido con zstd.
+# Al arrancar, leer_hoja carga esos archivos directo a la caché y sirve las hojas vencidas desde
+# la copia local mientras el hilo de reconciliación las pone al día con el almacenamiento.
+RUTA_INSTANTANEA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sill_instantanea")
+# Subir cuando cambie la normalización de las hojas, para descartar las instantáneas anteriores
+INSTANTANEA_FORMATO = 1
+
+def _ruta_instantanea():
+    """
+    Carpeta de las instantáneas (opción ruta_instantanea, por ejemplo un volumen que sobreviva al
+    despliegue). Debe configurarse junto con ruta_espejo en el mismo volumen: tras un despliegue con
+    el espejo vacío, ninguna instantánea coincide con su versión y todas se descartan
+    """
+    return _config("ruta_instantanea", RUTA_INSTANTANEA)
+
+def _huella_instantanea(nombre_hoja, version, sincronizado):
+    """Versión del espejo y del esquema a la que corresponde la instantánea de una hoja"""
+    return {'version': version, 'sincronizado': sincronizado, 'formato': INSTANTANEA_FORMATO,
+            'esquema': repr(ESQUEMAS.get(_hoja_base(nombre_hoja), {}))}
+
+@st.cache_resource
+def _indice_instantanea():
+    """Huella de cada instantánea guardada: {hoja: huella}. Se lee del disco una vez por proceso"""
+    try:
+        with open(os.path.join(_ruta_instantanea(), "indice.json"), encoding="utf-8") as archivo:
+            return json.load(archivo)
+    except (OSError, ValueError):
+        return {}
+
+def _instantanea_leer(nombre_hoja, version, sincronizado):
+    """DataFrame normalizado de la instantánea si corresponde a esa versión del espejo, si no None"""
+    if _indice_instantanea().get(nombre_hoja) != _huella_instantanea(nombre_hoja, version, sincronizado):
+        return None
+    try:
+        return pd.read_feather(os.path.join(_ruta_instantanea(), f"{nombre_hoja}.feather"))
+    except Exception:
+        # Archivo dañado o borrado: se normaliza desde el espejo
+        return None
+
+def guardar_instantanea():
+    """
+    Guarda en disco las hojas de la caché del proceso cuya versión actual aún no tiene instantánea.
+    Las hojas con columnas que Feather no puede guardar (tipos mezclados) se omiten.
+    """
+    indice = _indice_instantanea()
+    conexion, lock = get_espejo_local()
+    pendientes = {}
+    with lock:
+        for nombre_hoja, (version, df) in list(_cache_hojas().items()):
+            sincronizado, version_espejo = _espejo_estado(nombre_hoja)
+            huella = _huella_instantanea(nombre_hoja, version, sincronizado)
+            if version == version_espejo and indice.get(nombre_hoja) != huella:
+                pendientes[nombre_hoja] = (huella, df)
+    if not pendientes:
+        return
+
+    ruta = _ruta_instantanea()
+    os.makedirs(ruta, exist_ok=True)
+    for nombre_hoja, (huella, df) in pendientes.items():
+        archivo = os.path.join(ruta, f"{nombre_hoja}.feather")
+        try:
+            # Archivo temporal + os.replace: un reinicio a mitad de escritura no deja un archivo a medias
+            df.reset_index(drop=True).to_feather(archivo + ".tmp", compression='zstd')
+            os.replace(archivo + ".tmp", archivo)
+        except (ValueError, TypeError):
+            continue
+        indice[nombre_hoja] = huella
+    with open(os.path.join(ruta, "indice.json.tmp"), "w", encoding="utf-8") as archivo:
+        json.dump(indice, archivo)
+    os.replace(os.path.join(ruta, "indice.json.tmp"), os.path.join(ruta, "indice.json"))
+
+@st.cache_resource
+def _hojas_por_reconciliar():
+    """Hojas vencidas al arrancar el proceso que aún no se han vuelto a sincronizar"""
+    return set()
+
+@st.cache_resource
+def iniciar_reconciliacion():
+    """
+    Una vez por proceso: anota las hojas del espejo vencidas y arranca el hilo que las sincroniza.
+    Mientras tanto leer_hoja las sirve desde la copia local en lugar de esperar la descarga.
+    """
+    conexion, lock = get_espejo_local()
+    with lock:
+        filas = conexion.execute("SELECT hoja, sincronizado FROM _sincronizacion").fetchall()
+    pendientes = _hojas_por_reconciliar()
+    pendientes.update(hoja for hoja, sincronizado in filas
+                      if sincronizado is not None and time.time() - sincronizado > ESPEJO_TTL)
+
+    def reconciliar():
+        try:
+            # anticipacion=ESPEJO_TTL: todas las hojas anotadas cuentan como vencidas
+            precargar_hojas(sorted(pendientes), anticipacion=ESPEJO_TTL)
+        finally:
+            # Lo que no se pudo sincronizar vuelve al camino normal de leer_hoja
+            pendientes.clear()
+
+    hilo = threading.Thread(target=reconciliar, name="sill-reconciliacion", daemon=True)
+    hilo.start()
+    return hilo
+
+# ============= ESQUEMA DE LAS HOJAS =============
+# Tipo declarado de cada columna. Al leer, la columna se convierte una sola vez a un dtype
+# compacto; al escribir, vuelve al formato de texto que usa la hoja ('Sí'/'No', fechas con su formato).
+#   si_no     → boolean ('Sí'/'No')         entero  → Int32
+#   decimal   → float32 (km, profundidades)  dinero  → float64 (precios y costos: float32 redondea pesos)
+#   categoria → category con los valores permitidos más los que aparezcan en la hoja
+#   fecha     → datetime64 con el formato de la hoja
+# Una columna solo se convierte si todos sus valores se pueden convertir sin perder nada; si no,
+# se deja como viene. Las columnas que no están aquí (textos, IDs, NITs) se normalizan como antes.
+# fecha_creacion/fecha_modificacion se dejan como texto: el código las asigna como strings.
+FORMATO_FECHA = "%d/%m/%Y"
+FORMATO_FECHA_HORA = "%Y-%m-%d %H:%M:%S"
+DISPONIBILIDADES = ['llanta_nueva', 'al_piso', 'recambio', 'reencauche', 'FVU']
+SERVICIOS_REALIZADOS = ['rotacion', 'balanceo', 'reparacion', 'despinche', 'regrabacion', 'torqueo', 'inspeccion']
+
+ESQUEMAS = {
+    SHEET_USUARIOS: {
+        'nivel': ('entero',),
+    },
+    SHEET_VEHICULOS: {
+        'estado': ('categoria', ['no_asignado', 'activo', 'fuera_de_servicio']),
+        'calculo_kms': ('categoria', ['odometro', 'promedio', 'tabla']),
+        'kilometraje_inicial': ('decimal',),
+    },
+    SHEET_LLANTAS: {
+        'vida_actual': ('entero',),
+        'disponibilidad': ('categoria', DISPONIBILIDADES),
+        'kilometros_totales': ('decimal',),
+        'km_ultimo_montaje': ('decimal',),
+        'total_regrabaciones': ('entero',),
+        'estado_reencauche': ('categoria', ['condicionada_planta', 'aprobado']),
+        'precio_vida1': ('dinero',), 'precio_vida2': ('dinero',), 'precio_vida3': ('dinero',), 'precio_vida4': ('dinero',),
+        'costo_km_vida1': ('dinero',), 'costo_km_vida2': ('dinero',), 'costo_km_vida3': ('dinero',), 'costo_km_vida4': ('dinero',),
+    },
+    SHEET_SERVICIOS: {
+        'fecha': ('fecha', FORMATO_FECHA),
+        'vida': ('entero',),
+        'tipo_servicio': ('categoria', ['montaje', 'desmontaje', 'rotacion']),
+        'disponibilidad': ('categoria', DISPONIBILIDADES),
+        'kilometraje': ('decimal',),
+        'profundidad_1': ('decimal',), 'profundidad_2': ('decimal',), 'profundidad_3': ('decimal',),
+        **{col: ('si_no',) for col in SERVICIOS_REALIZADOS},
+        'timestamp': ('fecha', FORMATO_FECHA_HORA),
+    },
+    SHEET_MOVIMIENTOS: {
+        'fecha': ('fecha', FORMATO_FECHA_HORA),
+        'tipo': ('categoria', ['montaje', 'desmontaje', 'aprobacion_reencauche', 'rotacion', 'otro']),
+        'vida': ('entero',),
+        'kilometraje': ('decimal',),
+        'precio_reencauche': ('dinero',),
+    },
+    SHEET_ALINEACIONES: {
+        'fecha': ('fecha', FORMATO_FECHA),
+        'kilometraje': ('decimal',),
+        'timestamp': ('fecha', FORMATO_FECHA_HORA),
+    },
+}
+
+_TEXTOS_SI = {'sí', 'si', 'true', 'verdadero', '1'}
+_TEXTOS_NO = {'no', 'false', 'falso', '0'}
+
+def _faltantes(serie):
+    """Máscara de celdas vacías (NaN, None o texto vacío)"""
+    return serie.isna() | (serie.astype(str).str.strip() == '')
+
+def _convertir_columna(serie, tipo):
+    """Convierte una columna a su dtype declarado. Retorna None si algún valor no se puede convertir sin pérdida"""
+    clase = tipo[0]
+    vacias = _faltantes(serie)
+    if clase == 'si_no':
+        if pd.api.types.is_bool_dtype(serie):
+            return serie.astype('boolean')
+        texto = serie.astype(str).str.strip().str.lower()
+        si, no = texto.isin(_TEXTOS_SI), texto.isin(_TEXTOS_NO)
+        if not (si | no | vacias).all():
+            return None
+        return pd.Series(pd.array(np.where(vacias, None, si), dtype='boolean'), index=serie.index)
+    if clase in ('entero', 'decimal', 'dinero'):
+        numeros = pd.to_numeric(serie.where(~vacias), errors='coerce').astype('float64')
+        if numeros.isna().sum() != vacias.sum():
+            return None
+        if clase == 'entero':
+            valores = numeros.dropna()
+            if not ((valores % 1 == 0) & (valores.abs() < 2 ** 31)).all():
+                return None
+            return numeros.astype('Int32')
+        if clase == 'decimal':
+            compacto = numeros.astype('float32')
+            # float32 guarda exactos los km y profundidades normales; si no, se deja en float64
+            if not (pd.to_numeric(compacto.astype(str), errors='coerce').astype('float64').fillna(0) == numeros.fillna(0)).all():
+                return numeros
+            return compacto
+        return numeros
+    if clase == 'categoria':
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            serie = serie.astype(object)
+        texto = serie.astype(str).str.strip().where(~vacias, '')
+        # '' se admite porque el código limpia estas columnas asignando texto vacío
+        categorias = list(dict.fromkeys([''] + list(tipo[1]) + sorted(set(texto) - set(tipo[1]) - {''})))
+        return texto.astype(pd.CategoricalDtype(categorias))
+    if clase == 'fecha':
+        if pd.api.types.is_datetime64_any_dtype(serie):
+            return serie
+        texto = serie.map(lambda v: v.strftime(tipo[1]) if isinstance(v, (pd.Timestamp, datetime)) else v)
+        fechas = pd.to_datetime(texto.where(~vacias), format=tipo[1], errors='coerce')
+        if fechas.isna().sum() != vacias.sum():
+            return None
+        return fechas
+    return None
+
+def _aplicar_esquema(nombre_hoja, df):
+    """Convierte in-place las columnas de df declaradas en ESQUEMAS para la hoja"""
+    for col, tipo in ESQUEMAS.get(_hoja_base(nombre_hoja), {}).items():
+        if col in df.columns:
+            convertida = _convertir_columna(df[col], tipo)
+            if convertida is not None:
+                df[col] = convertida
+    return df
+
+def _serializar_columna(serie, tipo):
+    """Columna en el formato de la hoja a partir de su dtype declarado (o de lo que haya si no se convirtió)"""
+    clase = tipo[0]
+    if clase == 'si_no':
+        return serie.map(lambda v: ('Sí' if v else 'No') if isinstance(v, (bool, np.bool_)) else v).astype(object).where(serie.notna(), '')
+    if clase == 'fecha':
+        if pd.api.types.is_datetime64_any_dtype(serie):
+            return serie.dt.strftime(tipo[1]).astype(object).where(serie.notna(), '')
+        return serie.map(lambda v: v.strftime(tipo[1]) if isinstance(v, (pd.Timestamp, datetime)) and pd.notna(v) else v)
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        return serie.astype(object).where(serie.notna(), '')
+    if serie.dtype == 'float32':
+        # Texto corto del float32 (12.3 y no 12.300000190734863)
+        return pd.to_numeric(serie.astype(str), errors='coerce').astype('float64')
+    if isinstance(serie.dtype, pd.Int32Dtype):
+        return serie.astype(object).where(serie.notna(), None)
+    return serie
+
+def _serializar_hoja(nombre_hoja, df):
+    """Copia de df con los textos normalizados y las columnas del esquema en el formato de la hoja, lista para el espejo y el almacenamiento"""
+    if df is None:
+        return df
+    df = normalizar_columnas_id(df.copy())
+    for col, tipo in ESQUEMAS.get(_hoja_base(nombre_hoja), {}).items():
+        if col in df.columns:
+            df[col] = _serializar_columna(df[col], tipo)
+    return df
+
+def _concatenar_hoja(nombre_hoja, df_a, df_b):
+    """Concatena dos DataFrames ya normalizados de una hoja conservando los dtypes del esquema"""
+    df = pd.concat([df_a, df_b], ignore_index=True)
+    # pd.concat pierde el dtype si difiere entre las partes (ej: categorías con valores distintos)
+    for col, tipo in ESQUEMAS.get(_hoja_base(nombre_hoja), {}).items():
+        if col in df.columns and col in df_a.columns and df[col].dtype != df_a[col].dtype:
+            convertida = _convertir_columna(df[col], tipo)
+            if convertida is not None:
+                df[col] = convertida
+    return df
+
+def _es_si(valor):
+    """True si una celda de un servicio realizado está marcada (True o 'Sí', según el tipo de la columna)"""
+    if isinstance(valor, (bool, np.bool_)):
+        return bool(valor)
+    return not pd.isna(valor) and str(valor).strip().lower() in _TEXTOS_SI
+
+def _contar_si(serie):
+    """Cantidad de celdas marcadas en una columna de servicios realizados"""
+    if pd.api.types.is_bool_dtype(serie):
+        return int(serie.sum())
+    return int(serie.map(_es_si).sum())
+
 def limpiar_clientes_asignados(valor):
     """Convierte clientes_asignados a string limpio, manejando floats y múltiples NITs"""
     if pd.isna(valor) or valor == '' or valor is None:
@@ -177,15 +1229,59 @@ def limpiar_clientes_asignados(valor):
                 nits.append(nit)
     return ','.join(nits)
 
-def normalizar_columnas_id(df):
-    """Normaliza todas las columnas de ID a tipo string para evitar inconsistencias"""
-    columnas_id = ['id_vehiculo', 'id_llanta', 'id_servicio', 'id_movimiento',
-                   'id_alineacion', 'id_usuario', 'placa_vehiculo', 'usuario']
+# Columnas que identifican registros y se cruzan entre hojas: siempre texto sin espacios ni decimales
+COLUMNAS_ID = ['id_vehiculo', 'id_llanta', 'id_servicio', 'id_movimiento',
+               'id_alineacion', 'id_usuario', 'placa_vehiculo', 'usuario', 'nit', 'nit_cliente']
+_TIPOS_NUMERO = [int, float, np.int64, np.int32, np.float64, np.float32]
 
-    for col in columnas_id:
-        if col in df.columns:
-            df[col] = df[col].apply(lambda x: str(x).strip() if pd.notna(x) and str(x).strip() != 'nan' else '')
+def _texto_normalizado(serie):
+    """
+    Columna como texto sin espacios alrededor, con '' en las celdas vacías y sin decimales
+    en las celdas que llegaron como número entero (1234567890.0 → '1234567890').
+    Los textos con forma de número se dejan como están ('007' sigue siendo '007').
+    """
+    vacias = serie.isna()
+    tipo = pd.api.types.infer_dtype(serie, skipna=True)
+    if tipo in ('string', 'empty'):
+        # Caso común: la columna ya es texto
+        texto = serie.astype(object)
+        if vacias.any():
+            texto = texto.where(~vacias, '')
+        texto = texto.str.strip()
+        texto[texto == 'nan'] = ''
+        return texto
+    if pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_bool_dtype(serie):
+        numeros = serie.astype('float64')
+        texto = pd.Series('', index=serie.index, dtype=object)
+    else:
+        es_numero = serie.map(type).isin(_TIPOS_NUMERO)
+        numeros = pd.to_numeric(serie.where(es_numero), errors='coerce').astype('float64')
+        texto = serie.astype(object).where(~vacias, '').astype(str).str.strip()
+    enteros = numeros.notna() & np.isfinite(numeros) & (numeros % 1 == 0) & (numeros.abs() < 2 ** 53)
+    texto[enteros] = numeros[enteros].astype('int64').astype(str)
+    otros = numeros.notna() & ~enteros
+    texto[otros] = numeros[otros].astype(str)
+    texto[texto == 'nan'] = ''
+    return texto
+
+def _nits_normalizados(serie):
+    """Versión vectorizada de limpiar_clientes_asignados para una columna completa"""
+    texto = _texto_normalizado(serie).reset_index(drop=True)
+    nits = texto.str.split(',').explode().str.strip()
+    nits = nits[nits != '']
+    numeros = pd.to_numeric(nits, errors='coerce')
+    enteros = numeros.notna() & np.isfinite(numeros) & (numeros.abs() < 2 ** 53)
+    nits[enteros] = numeros[enteros].astype('int64').astype(str)
+    limpios = nits.groupby(level=0).agg(','.join).reindex(texto.index, fill_value='')
+    return pd.Series(limpios.values, index=serie.index, dtype=object)
 
+def normalizar_columnas_id(df):
+    """Normaliza las columnas de ID y NIT y clientes_asignados a texto para evitar inconsistencias"""
+    for col in COLUMNAS_ID:
+        if col in df.columns:
+            df[col] = _texto_normalizado(df[col])
+    if 'clientes_asignados' in df.columns:
+        df['clientes_asignados'] = _nits_normalizados(df['clientes_asignados'])
     return df
 
 def generar_id_usuario(nombre, df_usuarios):
@@ -226,86 +1322,1209 @@ def generar_id_usuario(nombre, df_usuarios):
     return nuevo_id
 
 def leer_hoja(nombre_hoja):
-    """Lee una hoja de Google Sheets y retorna un DataFrame"""
+    """
+    Lee una hoja desde el espejo local, sincronizando con Google Sheets si está vencida.
+    Dentro de una UnidadDeTrabajo incluye los cambios pendientes de confirmar.
+    Las HOJAS_PARTICIONADAS se leen completas (todas sus particiones); ver leer_historial.
+    """
+    if nombre_hoja in HOJAS_PARTICIONADAS:
+        return leer_historial(nombre_hoja)
+    return _leer_hoja_fisica(nombre_hoja)
+
+def _leer_hoja_fisica(nombre_hoja):
+    """leer_hoja de una hoja tal como existe en el almacenamiento (una partición, no la hoja lógica)"""
+    unidad = _unidad_actual()
+    if unidad is not None and unidad.tiene_cambios(nombre_hoja):
+        return unidad.vista(nombre_hoja)
+    return _leer_hoja_confirmada(nombre_hoja)
+
+def _normalizar_hoja(nombre_hoja, df):
+    """
+    Normalización única de una hoja leída (caché, espejo, vistas de la unidad de trabajo):
+    IDs, NITs y clientes_asignados a texto y el resto de columnas a los dtypes del esquema.
+    Las escrituras pasan por la misma normalización de textos en _serializar_hoja.
+    """
+    normalizar_columnas_id(df)
+    return _aplicar_esquema(nombre_hoja, df)
+
+def _leer_hoja_confirmada(nombre_hoja):
+    """Lee una hoja ya confirmada desde la caché del proceso, la instantánea o el espejo local, normalizando NITs e IDs"""
     try:
-        conn = get_gsheets_connection()
-        df = conn.read(
-            spreadsheet=SPREADSHEET_URL,
-            worksheet=nombre_hoja,
-            ttl=300
-        )
-        if df is None or df.empty:
-            return pd.DataFrame()
-        # Eliminar filas completamente vacías
-        df = df.dropna(how='all')
-        # Convertir columnas NIT a string (evitar decimales como 1234567890.0)
-        for col in ['nit', 'nit_cliente']:
-            if col in df.columns:
-                df[col] = df[col].apply(lambda x: str(int(x)) if pd.notna(x) and isinstance(x, (int, float)) else str(x) if pd.notna(x) else '')
-        # Convertir clientes_asignados a string limpio (manejar floats como 123456789.0)
-        if 'clientes_asignados' in df.columns:
-            df['clientes_asignados'] = df['clientes_asignados'].apply(limpiar_clientes_asignados)
-        # Normalizar todas las columnas ID a string
-        df = normalizar_columnas_id(df)
+        sincronizado, _ = _espejo_estado(nombre_hoja)
+        vencida = sincronizado is None or time.time() - sincronizado > ESPEJO_TTL
+        # Recién arrancado el proceso, iniciar_reconciliacion la actualiza en segundo plano
+        if vencida and nombre_hoja not in _hojas_por_reconciliar():
+            try:
+                _sincronizar_hoja(nombre_hoja)
+            except Exception:
+                # Sin conexión: servir la copia local si existe
+                if sincronizado is None:
+                    raise
+                st.warning(f"No se pudo sincronizar {nombre_hoja}, mostrando la copia local")
+
+        conexion, lock = get_espejo_local()
+        with lock:
+            sincronizado, version = _espejo_estado(nombre_hoja)
+            df = _cache_obtener(nombre_hoja, version)
+            if df is None:
+                df = _instantanea_leer(nombre_hoja, version, sincronizado)
+                if df is not None:
+                    _cache_poner(nombre_hoja, version, df)
+            if df is None:
+                df, _ = _espejo_leer(nombre_hoja)
+                df = _cache_guardar(nombre_hoja, version, df)
+        df = df.copy()
+        df.attrs['hoja'] = nombre_hoja
+        df.attrs['version'] = version
+        _versiones_leidas().setdefault(nombre_hoja, version)
         return df
     except Exception as e:
-        st.error(f"Error leyendo {nombre_hoja}: {str(e)}")
+        if _es_error_cuota(e):
+            st.warning(f"Google Sheets está limitando las consultas y aún no hay copia local de {nombre_hoja}; intenta de nuevo en un momento")
+        else:
+            st.error(f"Error leyendo {nombre_hoja}: {str(e)}")
         return pd.DataFrame()
 
-def leer_hoja_fresco(nombre_hoja):
-    """Lee una hoja de Google Sheets SIN caché - para verificaciones críticas"""
+def _texto_comparable(serie):
+    """Representación en texto de una columna para comparar celdas sin importar el tipo (100 == 100.0 == '100')"""
+    texto = serie.astype(str)
+    if not pd.api.types.is_bool_dtype(serie):
+        numeros = pd.to_numeric(serie, errors='coerce').astype('float64')
+        enteros = numeros.notna() & np.isfinite(numeros) & (numeros % 1 == 0) & (numeros.abs() < 2 ** 53)
+        texto[enteros] = numeros[enteros].astype('int64').astype(str)
+    texto[serie.isna()] = ''
+    return texto
+
+def _celda_api(valor):
+    """Convierte un valor de pandas en una celda (CellData) de la API de Google Sheets"""
+    if isinstance(valor, np.generic):
+        valor = valor.item()
+    if not isinstance(valor, str) and pd.isna(valor):
+        return {}
+    if isinstance(valor, bool):
+        return {'userEnteredValue': {'boolValue': valor}}
+    if isinstance(valor, (int, float)):
+        return {'userEnteredValue': {'numberValue': valor}}
+    return {'userEnteredValue': {'stringValue': str(valor)}}
+
+def _celdas_distintas(df_a, df_b):
+    """Matriz booleana (filas comunes x columnas de df_b) con True en las celdas que difieren entre dos versiones"""
+    n = min(len(df_a), len(df_b))
+    distintas = np.zeros((n, len(df_b.columns)), dtype=bool)
+    for j, col in enumerate(df_b.columns):
+        if col not in df_a.columns:
+            distintas[:, j] = True
+            continue
+        distintas[:, j] = _texto_comparable(df_a[col].iloc[:n]).values != _texto_comparable(df_b[col].iloc[:n]).values
+    return distintas
+
+def _parche(df_anterior, df_nuevo):
+    """
+    Diferencia entre dos versiones de una hoja: {'celdas': [(fila, columna_inicio, valores)], 'nuevas': DataFrame o None}
+    con un tramo por fila modificada (desde la primera hasta la última columna cambiada) y las filas agregadas al final.
+    Retorna None si cambió la estructura o hay demasiados cambios y conviene reescribir la hoja.
+    """
+    columnas = list(df_nuevo.columns)
+    if list(df_anterior.columns) != columnas or len(df_nuevo) < len(df_anterior):
+        return None
+
+    df_nuevo = df_nuevo.reset_index(drop=True)
+    n_anterior = len(df_anterior)
+    distintas = _celdas_distintas(df_anterior, df_nuevo)
+
+    total_cambios = distintas.sum() + (len(df_nuevo) - n_anterior) * len(columnas)
+    if total_cambios > PARCHE_MAX_FRACCION * max(1, len(df_nuevo) * len(columnas)):
+        return None
+
+    celdas = []
+    for i in np.flatnonzero(distintas.any(axis=1)):
+        cols = np.flatnonzero(distintas[i])
+        inicio, fin = int(cols[0]), int(cols[-1]) + 1
+        celdas.append((int(i), inicio, df_nuevo.iloc[i, inicio:fin].tolist()))
+    nuevas = df_nuevo.iloc[n_anterior:] if len(df_nuevo) > n_anterior else None
+    return {'celdas': celdas, 'nuevas': nuevas}
+
+def _peticiones_de_parche(nombre_hoja, parche, posiciones=None):
+    """
+    Peticiones batchUpdate que aplican a la hoja un parche armado por _parche. `posiciones` es la fila
+    de datos (desde 0) de cada fila del espejo en la hoja cuando tiene filas en blanco intermedias.
+    """
+    id_hoja = _ids_hojas()[nombre_hoja]
+    if posiciones is not None and len(posiciones):
+        # Las filas que no se leyeron siguen a la última leída
+        ubicar = lambda i: posiciones[i] if i < len(posiciones) else posiciones[-1] + i - len(posiciones) + 1
+    else:
+        ubicar = lambda i: i
+    # Una petición por fila modificada (la fila 0 de la hoja es el encabezado)
+    peticiones = [{'updateCells': {
+        'range': {'sheetId': id_hoja, 'startRowIndex': ubicar(i) + 1, 'endRowIndex': ubicar(i) + 2,
+                  'startColumnIndex': inicio, 'endColumnIndex': inicio + len(valores)},
+        'rows': [{'values': [_celda_api(v) for v in valores]}],
+        'fields': 'userEnteredValue'
+    }} for i, inicio, valores in parche['celdas']]
+    # Filas nuevas al final de la hoja
+    if parche['nuevas'] is not None:
+        peticiones.append(_peticion_agregar(id_hoja, parche['nuevas']))
+    return peticiones
+
+def _aplicar_parche(df, parche):
+    """Hoja que resulta de aplicar a df un parche armado por _parche (almacenamientos locales)"""
+    df = df.reset_index(drop=True).astype(object)
+    for i, inicio, valores in parche['celdas']:
+        df.iloc[i, inicio:inicio + len(valores)] = valores
+    if parche['nuevas'] is not None:
+        df = pd.concat([df, parche['nuevas'].set_axis(df.columns, axis=1)], ignore_index=True)
+    return df
+
+def _peticiones_parche(nombre_hoja, df_anterior, df_nuevo, posiciones=None):
+    """
+    Arma las peticiones batchUpdate que llevan la hoja de df_anterior a df_nuevo
+    tocando solo las filas y celdas modificadas (más las filas agregadas al final).
+    Retorna None si cambió la estructura, hay demasiados cambios o las filas leídas de la hoja
+    (`posiciones`) no corresponden a df_anterior, y conviene reescribir la hoja.
+    """
+    if posiciones is not None and len(posiciones) != len(df_anterior):
+        return None
+    parche = _parche(df_anterior, df_nuevo)
+    return _peticiones_de_parche(nombre_hoja, parche, posiciones) if parche is not None else None
+
+def _peticion_agregar(id_hoja, df_nuevas):
+    """Petición appendCells que agrega las filas de df_nuevas al final de la hoja"""
+    return {'appendCells': {
+        'sheetId': id_hoja,
+        'rows': [{'values': [_celda_api(v) for v in fila]} for fila in df_nuevas.itertuples(index=False)],
+        'fields': 'userEnteredValue'
+    }}
+
+def _peticiones_reescritura(nombre_hoja, df):
+    """Peticiones batchUpdate que reemplazan la hoja completa (encabezado + filas) por df"""
+    id_hoja = _ids_hojas()[nombre_hoja]
+    filas = [{'values': [_celda_api(c) for c in df.columns]}]
+    filas += [{'values': [_celda_api(v) for v in fila]} for fila in df.itertuples(index=False)]
+    return [
+        # Ajustar la cuadrícula al tamaño exacto de los datos
+        {'updateSheetProperties': {
+            'properties': {'sheetId': id_hoja, 'gridProperties': {'rowCount': len(df) + 1, 'columnCount': max(1, len(df.columns))}},
+            'fields': 'gridProperties(rowCount,columnCount)'
+        }},
+        # Sin 'rows' la petición borra todo el rango
+        {'updateCells': {'range': {'sheetId': id_hoja}, 'fields': 'userEnteredValue'}},
+        {'updateCells': {
+            'start': {'sheetId': id_hoja, 'rowIndex': 0, 'columnIndex': 0},
+            'rows': filas,
+            'fields': 'userEnteredValue'
+        }}
+    ]
+
+def _verificar_escritura(nombre_hoja, df_escrito=None):
+    """
+    Relee una hoja recién escrita y la compara con lo escrito (por defecto, la copia del espejo).
+    Si difiere, el espejo queda con lo que hay en Sheets. Retorna True si coincide.
+    No usa st.*: también corre en el hilo del diario, que no tiene contexto de Streamlit.
+    """
+    if df_escrito is None:
+        df_escrito, _ = _espejo_leer(nombre_hoja)
+    df_remoto = _sincronizar_hoja(nombre_hoja, completa=True).reset_index(drop=True)
+    coincide = (list(df_remoto.columns) == list(df_escrito.columns)
+                and len(df_remoto) == len(df_escrito)
+                and not _celdas_distintas(df_remoto, df_escrito).any())
+    return coincide
+
+def _mensaje_verificacion(nombre_hoja):
+    return f"La hoja {nombre_hoja} no quedó igual a lo escrito; se recargó desde Google Sheets"
+
+def _verificar_hojas(escritas):
+    """
+    escribir_hoja(verificar=True): espera a que se envíe el diario y compara cada hoja de
+    escritas ({hoja: lo escrito, None = la copia del espejo}). Solo desde el hilo del script.
+    """
+    if vaciar_diario() is not None:
+        st.warning(f"Los cambios en {', '.join(escritas)} quedaron pendientes de enviar; se reintentará automáticamente")
+        return
+    for nombre_hoja, df_escrito in escritas.items():
+        if not _verificar_escritura(nombre_hoja, df_escrito):
+            st.warning(_mensaje_verificacion(nombre_hoja))
+
+def escribir_hoja(nombre_hoja, df, verificar=False):
+    """
+    Escribe un DataFrame a una hoja de su almacenamiento y actualiza el espejo local.
+    Con un almacenamiento remoto no espera la red: la escritura queda en el diario y se envía en segundo plano.
+    Retorna el DataFrame aplicado localmente con su versión en df.attrs['version'].
+    Con verificar=True espera a que se envíe el diario y relee la hoja para compararla.
+    En las HOJAS_PARTICIONADAS ya migradas (ver migrar_particiones) df es el historial completo y se reparte por año.
+    """
+    if nombre_hoja in HOJAS_PARTICIONADAS and particiones_activas():
+        return _escribir_particionada(nombre_hoja, df, verificar)
+    return _escribir_hoja_fisica(nombre_hoja, df, verificar)
+
+def _escribir_hoja_fisica(nombre_hoja, df, verificar=False):
+    """escribir_hoja de una hoja tal como existe en el almacenamiento"""
+    unidad = _unidad_actual()
+    if unidad is not None:
+        return unidad.escribir(nombre_hoja, df)
     try:
-        conn = get_gsheets_connection()
-        df = conn.read(
-            spreadsheet=SPREADSHEET_URL,
-            worksheet=nombre_hoja,
-            ttl=0
-        )
-        if df is None or df.empty:
-            return pd.DataFrame()
-        df = df.dropna(how='all')
-        # Convertir columnas NIT a string (evitar decimales como 1234567890.0)
-        for col in ['nit', 'nit_cliente']:
-            if col in df.columns:
-                df[col] = df[col].apply(lambda x: str(int(x)) if pd.notna(x) and isinstance(x, (int, float)) else str(x) if pd.notna(x) else '')
-        # Convertir clientes_asignados a string limpio
-        if 'clientes_asignados' in df.columns:
-            df['clientes_asignados'] = df['clientes_asignados'].apply(limpiar_clientes_asignados)
-        # Normalizar todas las columnas ID a string
-        df = normalizar_columnas_id(df)
+        df_original, df = df, df.reset_index(drop=True)
+        # El espejo y el almacenamiento guardan el formato de la hoja, no los dtypes del esquema
+        df_hoja = _serializar_hoja(nombre_hoja, df)
+        conexion, lock = get_espejo_local()
+        with lock:
+            # Conservar lo que otras sesiones escribieron desde que se leyó df
+            df_fusion = _resolver_concurrencia(nombre_hoja, df_hoja, _version_base(nombre_hoja, df))
+            if df_fusion is not df_hoja:
+                df_hoja, df = df_fusion, _normalizar_hoja(nombre_hoja, df_fusion.copy())
+            # La última versión conocida permite enviar solo las celdas cambiadas
+            df_anterior, _ = _espejo_leer(nombre_hoja)
+            almacenamiento = get_almacenamiento(nombre_hoja)
+            if almacenamiento.remoto:
+                lote = [{'hoja': nombre_hoja, 'anterior': df_anterior, 'df': df_hoja, 'agregar': None}]
+                version = _espejo_aplicar(lote, en_diario=True)[nombre_hoja]
+            else:
+                reescrita = almacenamiento.escribir(nombre_hoja, df_hoja, df_anterior)
+                # Una reescritura completa deja la hoja idéntica a df; un parche solo garantiza las celdas enviadas
+                version = _espejo_guardar(nombre_hoja, df_hoja, sincronizado=reescrita)
+        # Lo escrito pasa a ser la base de df si se vuelve a escribir. _versiones_leidas conserva la primera
+        # lectura: un DataFrame que perdió attrs pudo armarse antes de esta escritura
+        df_original.attrs['version'] = version
+        if verificar:
+            _verificar_hojas({nombre_hoja: df_hoja})
+        df.attrs['version'] = version
         return df
+    except ConflictoDeEscritura as e:
+        _avisar_conflicto(f"No se guardaron los cambios: {str(e)}")
+        return None
     except Exception as e:
-        st.error(f"Error leyendo {nombre_hoja}: {str(e)}")
-        return pd.DataFrame()
+        st.error(f"Error escribiendo en {nombre_hoja}: {str(e)}")
+        return None
 
-def escribir_hoja(nombre_hoja, df):
-    """Escribe un DataFrame a una hoja de Google Sheets y retorna datos frescos"""
+def agregar_filas(nombre_hoja, df_nuevas):
+    """
+    Agrega filas al final de una hoja enviando solo las filas nuevas (append), sin reescribir el historial.
+    En las HOJAS_PARTICIONADAS ya migradas cada fila va a la partición del año de su fecha.
+    """
+    if nombre_hoja in HOJAS_PARTICIONADAS and particiones_activas():
+        return _agregar_particionada(nombre_hoja, df_nuevas)
+    return _agregar_filas_fisica(nombre_hoja, df_nuevas)
+
+def _agregar_filas_fisica(nombre_hoja, df_nuevas):
+    """agregar_filas en una hoja tal como existe en el almacenamiento"""
+    unidad = _unidad_actual()
+    if unidad is not None:
+        unidad.agregar(nombre_hoja, df_nuevas)
+        return True
     try:
-        conn = get_gsheets_connection()
-        conn.update(
-            spreadsheet=SPREADSHEET_URL,
-            worksheet=nombre_hoja,
-            data=df
-        )
-        # Leer datos frescos inmediatamente después de escribir
-        df_fresco = conn.read(
-            spreadsheet=SPREADSHEET_URL,
-            worksheet=nombre_hoja,
-            ttl=0
-        )
-        if df_fresco is not None:
-            df_fresco = df_fresco.dropna(how='all')
-            # Convertir columnas NIT a string (evitar decimales como 1234567890.0)
-            for col in ['nit', 'nit_cliente']:
-                if col in df_fresco.columns:
-                    df_fresco[col] = df_fresco[col].apply(lambda x: str(int(x)) if pd.notna(x) and isinstance(x, (int, float)) else str(x) if pd.notna(x) else '')
-            # Convertir clientes_asignados a string limpio
-            if 'clientes_asignados' in df_fresco.columns:
-                df_fresco['clientes_asignados'] = df_fresco['clientes_asignados'].apply(limpiar_clientes_asignados)
-        return df_fresco if df_fresco is not None else df
+        df_actual, _ = _espejo_leer(nombre_hoja)
+        if df_actual is None:
+            df_actual = _sincronizar_hoja(nombre_hoja)
+        columnas = list(df_actual.columns)
+
+        # Hoja sin encabezado o con columnas nuevas: hay que reescribirla completa
+        if not columnas or not set(df_nuevas.columns).issubset(columnas):
+            df_completo = _concatenar_hoja(nombre_hoja, _leer_hoja_fisica(nombre_hoja), _normalizar_hoja(nombre_hoja, df_nuevas.copy()))
+            return _escribir_hoja_fisica(nombre_hoja, df_completo) is not None
+
+        # Respetar el orden de columnas de la hoja
+        df_nuevas = _serializar_hoja(nombre_hoja, df_nuevas.reindex(columns=columnas))
+        almacenamiento = get_almacenamiento(nombre_hoja)
+        if almacenamiento.remoto:
+            _espejo_aplicar([{'hoja': nombre_hoja, 'anterior': None, 'df': None, 'agregar': df_nuevas}], en_diario=True)
+        else:
+            almacenamiento.agregar(nombre_hoja, df_nuevas)
+            _espejo_agregar(nombre_hoja, df_nuevas)
+        return True
+    except Exception as e:
+        st.error(f"Error agregando filas en {nombre_hoja}: {str(e)}")
+        return False
+
+# ============= PARTICIONES POR AÑO =============
+# servicios y movimientos crecen sin límite, así que sus filas se guardan en una hoja por año
+# según su fecha (servicios_2024, servicios_2025, ...). La hoja "particiones" es el manifiesto
+# con las particiones que existen; en la hoja original solo quedan las filas sin fecha válida.
+# leer_hoja devuelve el historial completo y leer_historial solo los años del rango pedido.
+# escribir_hoja y agregar_filas reparten las filas por año dentro de una UnidadDeTrabajo.
+# El paso a este formato lo inicia el administrador (migrar_particiones): mientras no exista el
+# manifiesto, servicios y movimientos se leen y escriben como una sola hoja, igual que antes.
+SHEET_PARTICIONES = "particiones"
+HOJAS_PARTICIONADAS = [SHEET_SERVICIOS, SHEET_MOVIMIENTOS]
+# Días que muestran por defecto las vistas de historial
+DIAS_HISTORIAL = 90
+
+def _hoja_base(nombre_hoja):
+    """Hoja lógica de una partición (servicios_2024 → servicios); cualquier otra hoja se retorna igual"""
+    base, _, anio = nombre_hoja.rpartition('_')
+    return base if base in HOJAS_PARTICIONADAS and anio.isdigit() and len(anio) == 4 else nombre_hoja
+
+def _nombre_particion(nombre_hoja, anio):
+    return f"{nombre_hoja}_{int(anio)}"
+
+def _fechas_hoja(nombre_hoja, df):
+    """Columna fecha de una hoja particionada como datetime (NaT si la fila no tiene una fecha válida)"""
+    if 'fecha' not in df.columns:
+        return pd.Series(pd.NaT, index=df.index)
+    tipo = ESQUEMAS[nombre_hoja]['fecha']
+    return pd.to_datetime(_serializar_columna(df['fecha'], tipo), format=tipo[1], errors='coerce')
+
+@st.cache_resource
+def _estado_particiones():
+    """Lo revisado en este proceso: {'activas': existe el manifiesto, 'pendientes': queda historial por mover} (None = sin revisar)"""
+    return {'activas': None, 'pendientes': None}
+
+def particiones_activas():
+    """True si ya se migró al formato por año (existe el manifiesto). Se consulta al almacenamiento una vez por proceso"""
+    estado = _estado_particiones()
+    if estado['activas'] is None:
+        estado['activas'] = (_espejo_estado(SHEET_PARTICIONES)[0] is not None
+                             or SHEET_PARTICIONES in get_almacenamiento(SHEET_PARTICIONES).hojas())
+    return estado['activas']
+
+def particiones_pendientes():
+    """True si falta migrar: no hay manifiesto o alguna hoja original conserva filas con fecha. Se revisa una vez por proceso"""
+    estado = _estado_particiones()
+    if estado['pendientes'] is None:
+        estado['pendientes'] = not particiones_activas() or any(
+            _fechas_hoja(nombre_hoja, _leer_hoja_fisica(nombre_hoja)).notna().any() for nombre_hoja in HOJAS_PARTICIONADAS)
+    return estado['pendientes']
+
+def _particiones(nombre_hoja):
+    """Años que tienen partición según el manifiesto, de menor a mayor"""
+    if not particiones_activas():
+        return []
+    manifiesto = _leer_hoja_fisica(SHEET_PARTICIONES)
+    if manifiesto.empty or 'hoja' not in manifiesto.columns:
+        return []
+    anios = pd.to_numeric(manifiesto.loc[manifiesto['hoja'] == nombre_hoja, 'anio'], errors='coerce').dropna()
+    return sorted(set(anios.astype(int)))
+
+def _hojas_fisicas(nombre_hoja, desde=None, hasta=None):
+    """Hojas del almacenamiento que forman una hoja: la original más las particiones con año entre desde y hasta"""
+    if nombre_hoja not in HOJAS_PARTICIONADAS:
+        return [nombre_hoja]
+    return [nombre_hoja] + [_nombre_particion(nombre_hoja, anio) for anio in _particiones(nombre_hoja)
+                            if (desde is None or anio >= desde.year) and (hasta is None or anio <= hasta.year)]
+
+def leer_historial(nombre_hoja, desde=None, hasta=None):
+    """
+    Filas de una hoja particionada con fecha entre desde y hasta (date, inclusive; None = sin límite).
+    Solo lee las particiones de los años del rango. Sin rango retorna el historial completo,
+    incluidas las filas sin fecha.
+    """
+    df = pd.DataFrame()
+    for fisica in _hojas_fisicas(nombre_hoja, desde, hasta):
+        parte = _leer_hoja_fisica(fisica)
+        if not parte.empty:
+            df = _concatenar_hoja(nombre_hoja, df, parte) if not df.empty else parte
+    # La hoja lógica no tiene una versión propia: cada partición usa la leída en esta ejecución
+    df.attrs.pop('hoja', None)
+    df.attrs.pop('version', None)
+    if df.empty or (desde is None and hasta is None):
+        return df
+    fechas = _fechas_hoja(nombre_hoja, df)
+    en_rango = fechas.notna()
+    if desde is not None:
+        en_rango &= fechas >= pd.Timestamp(desde)
+    if hasta is not None:
+        en_rango &= fechas < pd.Timestamp(hasta) + pd.Timedelta(days=1)
+    return df[en_rango].reset_index(drop=True)
+
+def _repartir_por_anio(nombre_hoja, df):
+    """{hoja física: filas de df} según el año de la fecha; las filas sin fecha van a la hoja original"""
+    anios = _fechas_hoja(nombre_hoja, df).dt.year
+    partes = {nombre_hoja: df[anios.isna()]}
+    con_fecha = anios.notna()
+    for anio, filas in df[con_fecha].groupby(anios[con_fecha].astype(int)):
+        partes[_nombre_particion(nombre_hoja, anio)] = filas
+    return partes
+
+def _crear_particion(nombre_hoja, fisica):
+    """Registra una partición nueva en el manifiesto y en la unidad de trabajo activa, para escribirla sin leerla"""
+    _preparar_hoja_nueva(fisica)
+    anio = int(fisica.rpartition('_')[2])
+    _agregar_filas_fisica(SHEET_PARTICIONES, pd.DataFrame([{'hoja': nombre_hoja, 'anio': anio, 'particion': fisica}]))
+
+def _preparar_hoja_nueva(nombre_hoja):
+    """
+    Si una hoja no existe en su almacenamiento ni en el espejo, la registra vacía en la unidad de
+    trabajo activa: llega al espejo y se crea en el almacenamiento solo si la unidad se confirma
+    """
+    if _espejo_estado(nombre_hoja)[0] is None and nombre_hoja not in get_almacenamiento(nombre_hoja).hojas():
+        _unidad_actual().crear(nombre_hoja)
+
+def _en_unidad(nombre_hoja, funcion):
+    """Ejecuta funcion dentro de la UnidadDeTrabajo activa o, si no hay, de una propia. Retorna True si se confirmó"""
+    if _unidad_actual() is not None:
+        funcion()
+        return True
+    try:
+        with UnidadDeTrabajo() as unidad:
+            funcion()
     except Exception as e:
         st.error(f"Error escribiendo en {nombre_hoja}: {str(e)}")
+        return False
+    return unidad.confirmada
+
+def _escribir_particionada(nombre_hoja, df, verificar=False):
+    """
+    escribir_hoja de una hoja particionada: reparte el historial por año y reescribe solo las hojas que cambiaron.
+    Con verificar=True compara después cada partición escrita (si la unidad de trabajo es propia).
+    """
+    df = df.reset_index(drop=True)
+    existentes = _hojas_fisicas(nombre_hoja)
+    partes = _repartir_por_anio(nombre_hoja, df)
+    # Particiones que se quedaron sin filas
+    for fisica in existentes:
+        partes.setdefault(fisica, df.iloc[0:0])
+    escritas = []
+
+    def escribir():
+        for fisica, filas in partes.items():
+            if fisica not in existentes:
+                _crear_particion(nombre_hoja, fisica)
+            else:
+                actual = _serializar_hoja(fisica, _leer_hoja_fisica(fisica))
+                nueva = _serializar_hoja(fisica, filas.reset_index(drop=True))
+                if _hojas_iguales(actual, nueva):
+                    continue
+            _escribir_hoja_fisica(fisica, filas)
+            escritas.append(fisica)
+
+    # Dentro de una unidad ajena las escrituras se confirman después, igual que en _escribir_hoja_fisica
+    propia = _unidad_actual() is None
+    if not _en_unidad(nombre_hoja, escribir):
         return None
+    if verificar and propia and escritas:
+        _verificar_hojas(dict.fromkeys(escritas))
+    return df
+
+def _agregar_particionada(nombre_hoja, df_nuevas):
+    """agregar_filas de una hoja particionada: cada fila va al final de la partición de su año"""
+    existentes = _hojas_fisicas(nombre_hoja)
+    partes = _repartir_por_anio(nombre_hoja, df_nuevas.reset_index(drop=True))
+
+    def agregar():
+        for fisica, filas in partes.items():
+            if filas.empty:
+                continue
+            if fisica not in existentes:
+                _crear_particion(nombre_hoja, fisica)
+            _agregar_filas_fisica(fisica, filas)
+
+    return _en_unidad(nombre_hoja, agregar)
+
+def migrar_particiones():
+    """
+    Pasa servicios y movimientos al formato por año: crea el manifiesto si no existe y mueve a sus
+    particiones las filas con fecha que sigan en la hoja original. La inicia el administrador;
+    repetirla solo completa lo que haya quedado sin mover. Retorna True si terminó.
+    """
+    estado = _estado_particiones()
+    if not particiones_activas():
+        if _escribir_hoja_fisica(SHEET_PARTICIONES, pd.DataFrame(columns=['hoja', 'anio', 'particion'])) is None:
+            return False
+        estado['activas'] = True
+    for nombre_hoja in HOJAS_PARTICIONADAS:
+        original = _leer_hoja_fisica(nombre_hoja)
+        if not original.empty and _fechas_hoja(nombre_hoja, original).notna().any():
+            if escribir_hoja(nombre_hoja, leer_hoja(nombre_hoja)) is None:
+                return False
+    estado['pendientes'] = False
+    return True
+
+# ============= CONCURRENCIA OPTIMISTA =============
+# Dos sesiones que leen la misma hoja, cambian filas distintas y la escriben completa no deben
+# borrarse los cambios entre sí. Cada lectura deja en df.attrs['version'] la versión del espejo
+# sobre la que se armó el DataFrame (o queda anotada en la ejecución del script). Al escribir,
+# si la hoja cambió desde esa versión, se compara fila por fila (por su clave) contra la versión
+# leída, que se conserva en _versiones_retenidas. Las filas cambiadas solo por esta escritura se
+# aplican sobre la versión actual y los cambios ajenos se conservan. Si las dos cambiaron o
+# borraron la misma fila se rechaza la escritura con ConflictoDeEscritura.
+# Columna que identifica cada fila de una hoja (las particiones usan la de su hoja)
+CLAVES_HOJAS = {
+    SHEET_CLIENTES: 'nit',
+    SHEET_VEHICULOS: 'id_vehiculo',
+    SHEET_LLANTAS: 'id_llanta',
+    SHEET_SERVICIOS: 'id_servicio',
+    SHEET_USUARIOS: 'id_usuario',
+    SHEET_MOVIMIENTOS: 'id_movimiento',
+    SHEET_ALINEACIONES: 'id_alineacion',
+    SHEET_PARTICIONES: 'particion',
+}
+
+class ConflictoDeEscritura(Exception):
+    """Otra sesión (o una edición directa en Google Sheets) cambió las mismas filas desde que se leyeron"""
+
+_lecturas_local = threading.local()
+
+def _versiones_leidas():
+    """
+    {hoja: versión} de la primera lectura de cada hoja en la ejecución actual del script. Las escrituras
+    de la ejecución no la cambian: tomar como base una versión posterior a la que se usó para armar un
+    DataFrame saltaría la fusión y devolvería las filas que otra escritura borró.
+    """
+    if not hasattr(_lecturas_local, 'versiones'):
+        _lecturas_local.versiones = {}
+    return _lecturas_local.versiones
+
+def _version_base(nombre_hoja, df):
+    """Versión de la hoja sobre la que se armó df: la de df.attrs o, si se perdió, la leída en esta ejecución"""
+    version = df.attrs.get('version') if df.attrs.get('hoja', nombre_hoja) == nombre_hoja else None
+    return version if version is not None else _versiones_leidas().get(nombre_hoja)
+
+def _avisar_conflicto(mensaje):
+    """Muestra un conflicto y lo guarda para la próxima ejecución (muchas pantallas hacen st.rerun() al escribir)"""
+    st.error(mensaje)
+    st.session_state['conflicto_escritura'] = mensaje
+
+def _hoja_en_version(nombre_hoja, version):
+    """DataFrame normalizado de una versión de la hoja si todavía se conserva, si no None"""
+    df = _versiones_retenidas().get(nombre_hoja, {}).get(version)
+    if df is None and version == _espejo_estado(nombre_hoja)[1]:
+        df = _cache_guardar(nombre_hoja, version, _espejo_leer(nombre_hoja)[0])
+    return df
+
+def _hojas_iguales(df_a, df_b):
+    """True si dos hojas serializadas tienen las mismas columnas, filas y celdas"""
+    return (list(df_a.columns) == list(df_b.columns) and len(df_a) == len(df_b)
+            and not _celdas_distintas(df_a, df_b).any())
+
+def _huellas_filas(df, clave, columnas):
+    """Hash del contenido de cada fila (en texto comparable) indexado por el valor de la clave"""
+    texto = pd.DataFrame({col: _texto_comparable(df[col]) if col in df.columns else '' for col in columnas},
+                         index=df.index)
+    return pd.Series(pd.util.hash_pandas_object(texto, index=False).values, index=_texto_comparable(df[clave]).values)
+
+def _claves_cambiadas(huellas, huellas_base):
+    """Claves de las filas agregadas, modificadas o borradas respecto de la base"""
+    comunes = huellas.index.intersection(huellas_base.index)
+    modificadas = comunes[huellas[comunes].values != huellas_base[comunes].values]
+    return (set(modificadas) | set(huellas.index.difference(huellas_base.index))
+            | set(huellas_base.index.difference(huellas.index)))
+
+def _resolver_concurrencia(nombre_hoja, df_hoja, base):
+    """
+    Hoja a escribir a partir de df_hoja (serializada, armada sobre la versión `base`): df_hoja si
+    nadie más escribió la hoja desde entonces, o la fusión por filas con la versión actual.
+    Lanza ConflictoDeEscritura si no se puede fusionar. Se llama con el lock del espejo tomado.
+    """
+    version_actual = _espejo_estado(nombre_hoja)[1]
+    if base is None or version_actual is None or base == version_actual:
+        return df_hoja
+    df_base = _hoja_en_version(nombre_hoja, base)
+    if df_base is None:
+        raise ConflictoDeEscritura(f"{nombre_hoja} cambió varias veces mientras se editaba; vuelve a cargar los datos e intenta de nuevo")
+    anterior = _serializar_hoja(nombre_hoja, df_base)
+    actual = _serializar_hoja(nombre_hoja, _hoja_en_version(nombre_hoja, version_actual))
+    # La versión subió sin cambiar el contenido (ej: una sincronización que no trajo nada nuevo)
+    if _hojas_iguales(anterior, actual):
+        return df_hoja
+
+    clave = CLAVES_HOJAS.get(_hoja_base(nombre_hoja))
+    if clave is None or any(clave not in d.columns or _texto_comparable(d[clave]).duplicated().any()
+                            for d in (anterior, actual, df_hoja)):
+        raise ConflictoDeEscritura(f"otro usuario modificó {nombre_hoja} mientras se editaba; vuelve a cargar los datos e intenta de nuevo")
+    columnas = list(dict.fromkeys(list(actual.columns) + list(df_hoja.columns)))
+    huellas_base = _huellas_filas(anterior, clave, columnas)
+    huellas_propias = _huellas_filas(df_hoja, clave, columnas)
+    huellas_ajenas = _huellas_filas(actual, clave, columnas)
+    propias = _claves_cambiadas(huellas_propias, huellas_base)
+    ajenas = _claves_cambiadas(huellas_ajenas, huellas_base)
+    # Si las dos escrituras dejaron la fila igual (o las dos la borraron) no hay conflicto
+    conflictos = sorted(k for k in propias & ajenas if huellas_propias.get(k) != huellas_ajenas.get(k))
+    if conflictos:
+        raise ConflictoDeEscritura(f"otro usuario modificó en {nombre_hoja} {', '.join(conflictos[:5])}"
+                                   f"{'...' if len(conflictos) > 5 else ''} mientras se editaba; vuelve a cargar los datos e intenta de nuevo")
+
+    # Sobre la versión actual: reemplazar las filas propias modificadas, quitar las borradas y agregar las nuevas
+    nueva = df_hoja.reindex(columns=columnas).astype(object)
+    nueva.index = huellas_propias.index
+    fusion = actual.reindex(columns=columnas).astype(object)
+    fusion.index = huellas_ajenas.index
+    reemplazadas = [k for k in fusion.index if k in propias and k in nueva.index]
+    fusion.loc[reemplazadas] = nueva.loc[reemplazadas].values
+    fusion = fusion[~fusion.index.isin([k for k in propias if k not in nueva.index])]
+    agregadas = nueva[nueva.index.isin(list(propias)) & ~nueva.index.isin(fusion.index)]
+    return pd.concat([fusion, agregadas]).reset_index(drop=True)
+
+# ============= ÍNDICES POR CLAVE =============
+# Buscar una fila con df[df[col] == valor].iloc[0] recorre toda la hoja, y los format_func de los
+# selectbox lo hacen por cada opción (cuadrático). Se arma una vez un diccionario {valor: etiqueta}:
+# por versión de la hoja, compartido entre sesiones, o por DataFrame para los derivados sin versión.
+# Cada búsqueda se comprueba contra la fila y, si no coincide, se recorre la hoja como antes.
+
+# Columnas que identifican una fila y se indexan por versión de la hoja
+COLUMNAS_INDICE = ['nit', 'id_vehiculo', 'placa_vehiculo', 'id_llanta', 'id_servicio', 'id_movimiento', 'usuario']
+
+@st.cache_resource
+def _indices_hojas():
+    """Índice de la última versión indexada de cada hoja: {(hoja, columna): (versión, {valor: etiqueta})}"""
+    return {}
+
+_indices_local = threading.local()
+
+def _armar_indice(serie):
+    """{valor: etiqueta} con la primera fila de cada valor, igual que df[df[col] == valor].iloc[0]"""
+    serie = serie[serie.notna() & ~serie.duplicated()]
+    return dict(zip(serie.values, serie.index))
+
+def indice_por_clave(df, columna):
+    """Diccionario {valor: etiqueta de la primera fila} de df[columna]"""
+    hoja, version = df.attrs.get('hoja'), df.attrs.get('version')
+    if hoja is not None and version is not None and columna in COLUMNAS_INDICE:
+        entrada = _indices_hojas().get((hoja, columna))
+        if entrada is not None and entrada[0] == version:
+            return entrada[1]
+        # df es una copia (o un filtro) de la versión retenida: mismas etiquetas de fila
+        df_version = _versiones_retenidas().get(hoja, {}).get(version)
+        if df_version is not None and columna in df_version.columns:
+            indice = _armar_indice(df_version[columna])
+            _indices_hojas()[(hoja, columna)] = (version, indice)
+            return indice
+
+    # DataFrames sin versión: se reutiliza el índice mientras se consulte el mismo objeto
+    indices = getattr(_indices_local, 'indices', None)
+    if indices is None:
+        indices = _indices_local.indices = {}
+    entrada = indices.get(columna)
+    if entrada is None or entrada[0]() is not df:
+        entrada = (weakref.ref(df), _armar_indice(df[columna]))
+        indices[columna] = entrada
+    return entrada[1]
+
+def fila_por_clave(df, columna, valor):
+    """Primera fila (Series) de df con df[columna] == valor, o None si no hay"""
+    if df.empty or columna not in df.columns:
+        return None
+    if df.index.is_unique:
+        try:
+            etiqueta = indice_por_clave(df, columna).get(valor)
+        except TypeError:
+            etiqueta = None
+        if etiqueta is not None and etiqueta in df.index:
+            fila = df.loc[etiqueta]
+            if pd.notna(fila[columna]) and fila[columna] == valor:
+                return fila
+    coincidencias = df[df[columna] == valor]
+    return coincidencias.iloc[0] if not coincidencias.empty else None
+
+# ============= ALMACENAMIENTO =============
+# leer_hoja, escribir_hoja y agregar_filas hablan con un almacenamiento, no directamente
+# con Google Sheets. Se elige por configuración (variable de entorno SILL_ALMACENAMIENTO o
+# sección [sill] de secrets.toml): "sheets" (por defecto), "sqlite" o "memoria". Cada hoja
+# puede usar otro con SILL_ALMACENAMIENTO_<HOJA>, ej: SILL_ALMACENAMIENTO_SERVICIOS=sqlite.
+# Todos implementan:
+#   leer(hoja) → DataFrame
+#   leer_varias(hojas) → {hoja: DataFrame}
+#   leer_colas({hoja: (fila, columnas)}) → {hoja: filas desde esa fila de la hoja (encabezado = fila 1)}
+#   hojas() → nombres de las hojas que existen (escribir una hoja que no existe la crea)
+#   escribir(hoja, df, df_anterior) → True si reescribió la hoja completa
+#   agregar(hoja, df_nuevas)
+#   aplicar(lote) → {hoja: reescrita}, todo el lote o nada
+#     lote = [{'hoja', 'anterior', 'df' (hoja completa) o 'agregar' (filas nuevas)}]
+#     en el diario un cambio de hoja completa puede llegar como 'parche' (ver _parche) con 'df' = None
+RUTA_DATOS_SQLITE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sill_datos.db")
+
+def _config(clave, defecto=None):
+    """Opción de configuración: variable de entorno SILL_<CLAVE> o clave en la sección [sill] de secrets.toml"""
+    valor = os.environ.get(f"SILL_{clave.upper()}")
+    if valor is not None:
+        return valor
+    try:
+        return st.secrets.get("sill", {}).get(clave, defecto)
+    except Exception:
+        # Sin secrets.toml
+        return defecto
+
+def _valores_a_dataframe(valores):
+    """DataFrame a partir de los valores de un rango de Sheets (primera fila = encabezado), igual que conn.read"""
+    if not valores:
+        return pd.DataFrame()
+    ancho = max(len(fila) for fila in valores)
+    df = TextParser([fila + [''] * (ancho - len(fila)) for fila in valores], header=0).read()
+    df = df.dropna(how='all')
+    # Columnas sin encabezado y sin datos
+    vacias = [col for col in df.columns if str(col).startswith('Unnamed:') and df[col].isna().all()]
+    return df.drop(columns=vacias)
+
+def _letra_columna(numero):
+    """Letra de la columna número `numero` (1 → A, 27 → AA) en notación A1"""
+    letras = ''
+    while numero > 0:
+        numero, resto = divmod(numero - 1, 26)
+        letras = chr(ord('A') + resto) + letras
+    return letras
+
+# ============= CUOTA DE GOOGLE SHEETS =============
+# Google Sheets limita las peticiones por minuto. Todas las llamadas de AlmacenamientoSheets
+# pasan por un cubo de fichas (lecturas y escrituras por separado) que hace esperar a las que
+# exceden el ritmo en lugar de dejarlas fallar, y un 429 que llegue igual se reintenta con espera
+# exponencial. Los límites se configuran con SILL_CUOTA_LECTURAS / SILL_CUOTA_ESCRITURAS.
+CUOTA_LECTURAS_POR_MINUTO = 60
+CUOTA_ESCRITURAS_POR_MINUTO = 60
+# Reintentos ante un error de cuota (429) y espera inicial en segundos (se duplica en cada intento)
+CUOTA_REINTENTOS = 5
+CUOTA_ESPERA_BASE = 2
+
+class CuboDeFichas:
+    """Limitador token bucket: se recarga a `por_minuto` fichas por minuto, con ráfagas de hasta `capacidad`"""
+
+    def __init__(self, por_minuto, capacidad=None):
+        self.por_segundo = por_minuto / 60
+        self.capacidad = capacidad or max(1, por_minuto // 4)
+        self.fichas = self.capacidad
+        self.ultima_recarga = time.monotonic()
+        self.lock = threading.Lock()
+
+    def tomar(self, cantidad=1):
+        """Toma fichas, esperando lo necesario si no alcanzan"""
+        while True:
+            with self.lock:
+                ahora = time.monotonic()
+                self.fichas = min(self.capacidad, self.fichas + (ahora - self.ultima_recarga) * self.por_segundo)
+                self.ultima_recarga = ahora
+                if self.fichas >= cantidad:
+                    self.fichas -= cantidad
+                    return
+                espera = (cantidad - self.fichas) / self.por_segundo
+            time.sleep(espera)
+
+def _es_error_cuota(error):
+    """True si la excepción es un 429 / cuota excedida de la API de Google"""
+    respuesta = getattr(error, 'response', None)
+    if getattr(respuesta, 'status_code', None) == 429:
+        return True
+    texto = str(error)
+    return '429' in texto or 'RESOURCE_EXHAUSTED' in texto or 'Quota exceeded' in texto
+
+class AlmacenamientoSheets:
+    """Hojas del spreadsheet SPREADSHEET_URL en Google Sheets"""
+    remoto = True
+
+    def __init__(self):
+        self.cuota_lecturas = CuboDeFichas(int(_config("cuota_lecturas", CUOTA_LECTURAS_POR_MINUTO)))
+        self.cuota_escrituras = CuboDeFichas(int(_config("cuota_escrituras", CUOTA_ESCRITURAS_POR_MINUTO)))
+        # Lecturas en curso: clave → {'listo': Event, 'resultado', 'error'}
+        self.en_curso = {}
+        self.lock = threading.Lock()
+
+    def _llamar(self, cuota, funcion, fichas=1):
+        """Ejecuta una llamada a la API respetando la cuota y reintentando los 429"""
+        for intento in range(CUOTA_REINTENTOS):
+            cuota.tomar(fichas)
+            try:
+                return funcion()
+            except Exception as e:
+                if not _es_error_cuota(e) or intento == CUOTA_REINTENTOS - 1:
+                    raise
+                time.sleep(CUOTA_ESPERA_BASE * 2 ** intento + random.random())
+
+    def _leer_unificado(self, clave, funcion):
+        """Si ya hay una lectura igual en curso (otra sesión), espera su resultado en lugar de repetirla"""
+        with self.lock:
+            pendiente = self.en_curso.get(clave)
+            propia = pendiente is None
+            if propia:
+                pendiente = {'listo': threading.Event(), 'resultado': None, 'error': None}
+                self.en_curso[clave] = pendiente
+        if propia:
+            try:
+                pendiente['resultado'] = self._llamar(self.cuota_lecturas, funcion)
+            except Exception as e:
+                pendiente['error'] = e
+            finally:
+                with self.lock:
+                    del self.en_curso[clave]
+                pendiente['listo'].set()
+        else:
+            pendiente['listo'].wait()
+        if pendiente['error'] is not None:
+            raise pendiente['error']
+        # Cada sesión recibe su propia copia
+        resultado = pendiente['resultado']
+        if isinstance(resultado, dict):
+            return {nombre: df.copy() for nombre, df in resultado.items()}
+        return resultado.copy()
+
+    def hojas(self):
+        # Consulta de nuevo el spreadsheet: otro proceso pudo crear hojas
+        _ids_hojas.clear()
+        return set(self._llamar(self.cuota_lecturas, _ids_hojas))
+
+    def _asegurar_hojas(self, nombres_hojas):
+        """Crea en el spreadsheet las hojas que todavía no existen (particiones nuevas, manifiesto)"""
+        faltantes = [nombre for nombre in dict.fromkeys(nombres_hojas) if nombre not in _ids_hojas()]
+        if faltantes:
+            existentes = self.hojas()
+            faltantes = [nombre for nombre in faltantes if nombre not in existentes]
+        if faltantes:
+            self._llamar(self.cuota_escrituras, lambda: get_spreadsheet().batch_update(
+                {'requests': [{'addSheet': {'properties': {'title': nombre}}} for nombre in faltantes]}))
+            _ids_hojas.clear()
+
+    def leer(self, nombre_hoja):
+        def leer():
+            conn = get_gsheets_connection()
+            df = conn.read(
+                spreadsheet=SPREADSHEET_URL,
+                worksheet=nombre_hoja,
+                ttl=0
+            )
+            df = df.dropna(how='all') if df is not None else pd.DataFrame()
+            _huecos_anotar(nombre_hoja, _hay_huecos(df))
+            return df
+        return self._leer_unificado(('leer', nombre_hoja), leer)
+
+    def leer_varias(self, nombres_hojas):
+        def leer():
+            # Mismas opciones de lectura que conn.read (gspread_dataframe)
+            respuesta = get_spreadsheet().values_batch_get(
+                ["'" + nombre.replace("'", "''") + "'" for nombre in nombres_hojas],
+                params={'valueRenderOption': 'UNFORMATTED_VALUE', 'dateTimeRenderOption': 'FORMATTED_STRING'}
+            )
+            rangos = respuesta.get('valueRanges', [])
+            hojas = {nombre: _valores_a_dataframe(rango.get('values', [])) for nombre, rango in zip(nombres_hojas, rangos)}
+            for nombre, df in hojas.items():
+                _huecos_anotar(nombre, _hay_huecos(df))
+            return hojas
+        return self._leer_unificado(('leer_varias', tuple(nombres_hojas)), leer)
+
+    def leer_colas(self, pedidos):
+        """
+        {hoja: (fila, columnas)} → {hoja: DataFrame con las filas desde `fila` hasta el final}, en un solo
+        values.batchGet que también trae el encabezado (fila 1) de cada hoja: las filas se interpretan
+        con él, así una columna agregada, quitada o movida en la hoja no coincide con las del espejo
+        """
+        nombres_hojas = list(pedidos)
+        rangos = []
+        for nombre in nombres_hojas:
+            hoja = "'" + nombre.replace("'", "''") + "'"
+            rangos += [f"{hoja}!1:1", f"{hoja}!A{pedidos[nombre][0]}:{_letra_columna(len(pedidos[nombre][1]))}"]
+
+        def leer():
+            respuesta = get_spreadsheet().values_batch_get(
+                rangos,
+                params={'valueRenderOption': 'UNFORMATTED_VALUE', 'dateTimeRenderOption': 'FORMATTED_STRING'}
+            )
+            valores = [rango.get('values', []) for rango in respuesta.get('valueRanges', [])]
+            # Encabezado + filas se interpretan igual que en una lectura completa
+            colas = {nombre: _valores_a_dataframe(encabezado + filas) if encabezado and filas else pd.DataFrame()
+                     for nombre, encabezado, filas in zip(nombres_hojas, valores[::2], valores[1::2])}
+            # Un hueco en la cola también desplaza las filas; sin huecos aquí, puede haberlos más arriba
+            for nombre, df in colas.items():
+                if _hay_huecos(df):
+                    _huecos_anotar(nombre, True)
+            return colas
+        return self._leer_unificado(('leer_colas', tuple(rangos)), leer)
+
+    def _posiciones(self, nombre_hoja):
+        """
+        Fila de datos (desde 0) de cada fila de la hoja si sus lecturas descartan filas en blanco
+        intermedias, releída para ubicar un parche; si no hay huecos, None (fila i del espejo = fila i)
+        """
+        if not _huecos_tiene(nombre_hoja):
+            return None
+        return list(self.leer_varias([nombre_hoja])[nombre_hoja].index)
+
+    def escribir(self, nombre_hoja, df, df_anterior=None):
+        self._asegurar_hojas([nombre_hoja])
+        peticiones = None
+        if df_anterior is not None:
+            peticiones = _peticiones_parche(nombre_hoja, df_anterior, df, self._posiciones(nombre_hoja))
+        if peticiones is None:
+            conn = get_gsheets_connection()
+            # conn.update borra la hoja y luego escribe: son dos peticiones
+            self._llamar(self.cuota_escrituras, lambda: conn.update(
+                spreadsheet=SPREADSHEET_URL,
+                worksheet=nombre_hoja,
+                data=df
+            ), fichas=2)
+            _huecos_anotar(nombre_hoja, False)
+        elif peticiones:
+            self._llamar(self.cuota_escrituras, lambda: get_spreadsheet().batch_update({'requests': peticiones}))
+        return peticiones is None
+
+    def agregar(self, nombre_hoja, df_nuevas):
+        self._asegurar_hojas([nombre_hoja])
+        # appendCells con los mismos valores que aplicar(): el texto se guarda tal cual, sin que Sheets lo interprete
+        peticion = _peticion_agregar(_ids_hojas()[nombre_hoja], df_nuevas)
+        self._llamar(self.cuota_escrituras, lambda: get_spreadsheet().batch_update({'requests': [peticion]}))
+
+    def aplicar(self, lote):
+        # Un solo batchUpdate: Google Sheets lo aplica completo o no aplica nada
+        self._asegurar_hojas([cambio['hoja'] for cambio in lote])
+        peticiones = []
+        reescritas = {}
+        for cambio in lote:
+            nombre_hoja = cambio['hoja']
+            if cambio['agregar'] is not None:
+                peticiones.append(_peticion_agregar(_ids_hojas()[nombre_hoja], cambio['agregar']))
+                reescritas[nombre_hoja] = False
+                continue
+            if cambio.get('parche') is not None:
+                peticiones += _peticiones_de_parche(nombre_hoja, cambio['parche'], self._posiciones(nombre_hoja))
+                reescritas[nombre_hoja] = False
+                continue
+            anterior = cambio['anterior']
+            parche = None
+            if anterior is not None and len(anterior.columns):
+                parche = _peticiones_parche(nombre_hoja, anterior, cambio['df'], self._posiciones(nombre_hoja))
+            peticiones += parche if parche is not None else _peticiones_reescritura(nombre_hoja, cambio['df'])
+            reescritas[nombre_hoja] = parche is None
+        if peticiones:
+            self._llamar(self.cuota_escrituras, lambda: get_spreadsheet().batch_update({'requests': peticiones}))
+        for nombre_hoja, reescrita in reescritas.items():
+            if reescrita:
+                _huecos_anotar(nombre_hoja, False)
+        return reescritas
+
+class AlmacenamientoSQLite:
+    """Hojas como tablas hoja_<nombre> de una base SQLite local"""
+    remoto = False
+
+    def __init__(self, ruta):
+        _registrar_adaptadores_sqlite()
+        self.conexion = sqlite3.connect(ruta, check_same_thread=False)
+        self.lock = threading.RLock()
+
+    def leer(self, nombre_hoja):
+        tabla = f"hoja_{nombre_hoja}"
+        with self.lock:
+            existe = self.conexion.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (tabla,)).fetchone()
+            return pd.read_sql_query(f'SELECT * FROM "{tabla}"', self.conexion) if existe else pd.DataFrame()
+
+    def leer_varias(self, nombres_hojas):
+        return {nombre: self.leer(nombre) for nombre in nombres_hojas}
+
+    def hojas(self):
+        with self.lock:
+            tablas = self.conexion.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'hoja\\_%' ESCAPE '\\'").fetchall()
+        return {tabla[0][len('hoja_'):] for tabla in tablas}
+
+    def leer_colas(self, pedidos):
+        colas = {}
+        with self.lock:
+            for nombre_hoja, (fila, _) in pedidos.items():
+                tabla = f"hoja_{nombre_hoja}"
+                existe = self.conexion.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (tabla,)).fetchone()
+                # La fila 1 de la hoja es el encabezado: la fila n de la hoja es la n - 2 (desde 0) de la tabla
+                colas[nombre_hoja] = pd.read_sql_query(f'SELECT * FROM "{tabla}" ORDER BY rowid LIMIT -1 OFFSET ?',
+                                                       self.conexion, params=(fila - 2,)) if existe else pd.DataFrame()
+        return colas
+
+    def escribir(self, nombre_hoja, df, df_anterior=None):
+        self.aplicar([{'hoja': nombre_hoja, 'anterior': df_anterior, 'df': df, 'agregar': None}])
+        return True
+
+    def agregar(self, nombre_hoja, df_nuevas):
+        self.aplicar([{'hoja': nombre_hoja, 'anterior': None, 'df': None, 'agregar': df_nuevas}])
+
+    def aplicar(self, lote):
+        # Una sola transacción para todo el lote
+        with self.lock:
+            try:
+                for cambio in lote:
+                    tabla = f"hoja_{cambio['hoja']}"
+                    if cambio['agregar'] is not None:
+                        _sqlite_insertar(self.conexion, tabla, cambio['agregar'])
+                    elif cambio.get('parche') is not None:
+                        _sqlite_reemplazar(self.conexion, tabla, _aplicar_parche(self.leer(cambio['hoja']), cambio['parche']))
+                    else:
+                        _sqlite_reemplazar(self.conexion, tabla, cambio['df'])
+                self.conexion.commit()
+            except Exception:
+                self.conexion.rollback()
+                raise
+        return {cambio['hoja']: cambio['agregar'] is None and cambio.get('parche') is None for cambio in lote}
+
+class AlmacenamientoMemoria:
+    """Hojas como DataFrames en memoria; si se da una ruta, se guardan en ese archivo (pickle) en cada escritura"""
+    remoto = False
+
+    def __init__(self, ruta=None):
+        self.ruta = ruta
+        self.lock = threading.RLock()
+        self.datos = {}
+        if ruta and os.path.exists(ruta):
+            with open(ruta, 'rb') as archivo:
+                self.datos = pickle.load(archivo)
+
+    def leer(self, nombre_hoja):
+        with self.lock:
+            return self.datos.get(nombre_hoja, pd.DataFrame()).copy()
+
+    def leer_varias(self, nombres_hojas):
+        return {nombre: self.leer(nombre) for nombre in nombres_hojas}
+
+    def hojas(self):
+        with self.lock:
+            return set(self.datos)
+
+    def leer_colas(self, pedidos):
+        with self.lock:
+            return {nombre_hoja: self.datos.get(nombre_hoja, pd.DataFrame()).iloc[fila - 2:].reset_index(drop=True)
+                    for nombre_hoja, (fila, _) in pedidos.items()}
+
+    def escribir(self, nombre_hoja, df, df_anterior=None):
+        self.aplicar([{'hoja': nombre_hoja, 'anterior': df_anterior, 'df': df, 'agregar': None}])
+        return True
+
+    def agregar(self, nombre_hoja, df_nuevas):
+        self.aplicar([{'hoja': nombre_hoja, 'anterior': None, 'df': None, 'agregar': df_nuevas}])
+
+    def aplicar(self, lote):
+        with self.lock:
+            # Armar el nuevo estado aparte y reemplazarlo solo si todo salió bien
+            hojas = dict(self.datos)
+            for cambio in lote:
+                nombre_hoja = cambio['hoja']
+                if cambio['agregar'] is not None:
+                    hojas[nombre_hoja] = pd.concat([hojas.get(nombre_hoja, pd.DataFrame()), cambio['agregar']], ignore_index=True)
+                elif cambio.get('parche') is not None:
+                    hojas[nombre_hoja] = _aplicar_parche(hojas.get(nombre_hoja, pd.DataFrame()), cambio['parche'])
+                else:
+                    hojas[nombre_hoja] = cambio['df'].reset_index(drop=True).copy()
+            if self.ruta:
+                temporal = f"{self.ruta}.tmp"
+                with open(temporal, 'wb') as archivo:
+                    pickle.dump(hojas, archivo)
+                os.replace(temporal, self.ruta)
+            self.datos = hojas
+        return {cambio['hoja']: cambio['agregar'] is None and cambio.get('parche') is None for cambio in lote}
+
+@st.cache_resource
+def _crear_almacenamiento(tipo, ruta):
+    """Una instancia por proceso de cada almacenamiento configurado"""
+    if tipo == 'sheets':
+        return AlmacenamientoSheets()
+    if tipo == 'sqlite':
+        return AlmacenamientoSQLite(ruta or RUTA_DATOS_SQLITE)
+    if tipo == 'memoria':
+        return AlmacenamientoMemoria(ruta)
+    raise ValueError(f"Almacenamiento desconocido: {tipo} (usar sheets, sqlite o memoria)")
+
+def get_almacenamiento(nombre_hoja):
+    """Almacenamiento configurado para una hoja (las particiones usan el de su hoja)"""
+    tipo = str(_config(f"almacenamiento_{_hoja_base(nombre_hoja)}") or _config("almacenamiento", "sheets")).lower()
+    return _crear_almacenamiento(tipo, _config(f"ruta_{tipo}"))
+
+# ============= UNIDAD DE TRABAJO =============
+# Agrupa los cambios de una acción del usuario (ej: montaje = llantas + movimiento + servicio)
+# y los envía como un solo lote (un solo batchUpdate) al final. Google Sheets aplica el batchUpdate completo
+# o no aplica nada, así una falla no deja la llanta actualizada sin su movimiento.
+_unidad_local = threading.local()
+
+def _unidad_actual():
+    """UnidadDeTrabajo activa en el hilo actual (cada sesión de Streamlit corre en su propio hilo) o None"""
+    return getattr(_unidad_local, 'unidad', None)
+
+class UnidadDeTrabajo:
+    """
+    Mientras está activa, escribir_hoja y agregar_filas solo registran los cambios y
+    leer_hoja los refleja. Al salir del bloque se envían todos juntos.
+
+        with UnidadDeTrabajo() as unidad:
+            escribir_hoja(SHEET_LLANTAS, df_llantas)
+            crear_movimiento(...)
+        if unidad.confirmada:
+            st.rerun()
+    """
+
+    def __init__(self):
+        # nombre_hoja → {'df': hoja completa o None, 'agregar': filas nuevas o None,
+        #                'base': versión sobre la que se armó 'df' (ver _resolver_concurrencia)}
+        self.cambios = {}
+        # Hojas que todavía no existen en su almacenamiento (ver crear)
+        self.nuevas = set()
+        self.confirmada = False
+
+    def __enter__(self):
+        _unidad_local.unidad = self
+        return self
+
+    def __exit__(self, tipo_error, error, traza):
+        _unidad_local.unidad = None
+        # Si el bloque falló no se envía nada
+        if tipo_error is None:
+            self.confirmar()
+        return False
+
+    def tiene_cambios(self, nombre_hoja):
+        return nombre_hoja in self.cambios
+
+    def crear(self, nombre_hoja):
+        """Registra una hoja nueva y vacía (ej: una partición); se crea al confirmar junto con su contenido"""
+        self.nuevas.add(nombre_hoja)
+        self.cambios.setdefault(nombre_hoja, {'df': pd.DataFrame(), 'agregar': None, 'base': None})
+
+    def escribir(self, nombre_hoja, df):
+        """Registra el contenido completo de una hoja (reemplaza filas agregadas antes, que df ya incluye)"""
+        anterior = self.cambios.get(nombre_hoja)
+        # Si la hoja ya tenía cambios en la unidad, df se armó sobre su vista: la base sigue siendo la primera
+        base = anterior['base'] if anterior is not None and anterior['df'] is not None else _version_base(nombre_hoja, df)
+        df = _normalizar_hoja(nombre_hoja, df.reset_index(drop=True))
+        self.cambios[nombre_hoja] = {'df': df, 'agregar': None, 'base': base}
+        return df
+
+    def agregar(self, nombre_hoja, df_nuevas):
+        """Registra filas nuevas al final de una hoja"""
+        cambio = self.cambios.setdefault(nombre_hoja, {'df': None, 'agregar': None, 'base': None})
+        # Con los dtypes del esquema, igual que lo que devuelve leer_hoja
+        df_nuevas = _normalizar_hoja(nombre_hoja, df_nuevas.reset_index(drop=True))
+        if cambio['df'] is not None:
+            cambio['df'] = _concatenar_hoja(nombre_hoja, cambio['df'], df_nuevas)
+        elif cambio['agregar'] is not None:
+            cambio['agregar'] = _concatenar_hoja(nombre_hoja, cambio['agregar'], df_nuevas)
+        else:
+            cambio['agregar'] = df_nuevas
+
+    def vista(self, nombre_hoja):
+        """La hoja como quedará después de confirmar"""
+        cambio = self.cambios[nombre_hoja]
+        if cambio['df'] is not None:
+            return cambio['df'].copy()
+        return _concatenar_hoja(nombre_hoja, _leer_hoja_confirmada(nombre_hoja), cambio['agregar'])
+
+    def confirmar(self):
+        """Envía todos los cambios (un solo lote por almacenamiento) y, si tuvo éxito, actualiza el espejo local"""
+        conexion, lock = get_espejo_local()
+        try:
+            with lock:
+                por_almacenamiento = {}
+                for nombre_hoja, cambio in self.cambios.items():
+                    df_anterior, _ = _espejo_leer(nombre_hoja)
+                    if df_anterior is None and nombre_hoja in self.nuevas:
+                        df_anterior = pd.DataFrame()
+                    elif df_anterior is None:
+                        df_anterior = _sincronizar_hoja(nombre_hoja)
+                    df_anterior = df_anterior.reset_index(drop=True)
+                    columnas = list(df_anterior.columns)
+                    df, df_nuevas = _serializar_hoja(nombre_hoja, cambio['df']), _serializar_hoja(nombre_hoja, cambio['agregar'])
+
+                    if df is None and columnas and set(df_nuevas.columns).issubset(columnas):
+                        # Solo filas nuevas con columnas conocidas
+                        df_nuevas, df_anterior = df_nuevas.reindex(columns=columnas), None
+                    elif df is None:
+                        df, df_nuevas = pd.concat([df_anterior, df_nuevas], ignore_index=True), None
+                    else:
+                        # Conservar lo que otras sesiones escribieron desde que se leyó la hoja
+                        df, df_nuevas = _resolver_concurrencia(nombre_hoja, df, cambio['base']), None
+                    almacenamiento = get_almacenamiento(nombre_hoja)
+                    por_almacenamiento.setdefault(almacenamiento, []).append(
+                        {'hoja': nombre_hoja, 'anterior': df_anterior, 'df': df, 'agregar': df_nuevas})
+
+                # Cada almacenamiento aplica su lote completo o nada
+                for almacenamiento, lote in por_almacenamiento.items():
+                    if almacenamiento.remoto:
+                        # Un solo lote en el diario = un solo batchUpdate cuando se envíe
+                        _espejo_aplicar(lote, en_diario=True)
+                    else:
+                        reescritas = almacenamiento.aplicar(lote)
+                        _espejo_aplicar(lote, sincronizadas=[hoja for hoja, reescrita in reescritas.items() if reescrita])
+            self.confirmada = True
+        except ConflictoDeEscritura as e:
+            _avisar_conflicto(f"No se guardó ningún cambio: {str(e)}")
+            self.confirmada = False
+        except Exception as e:
+            st.error(f"Error guardando los cambios (no se aplicó ninguno): {str(e)}")
+            self.confirmada = False
+        return self.confirmada
 
 def filtrar_por_clientes(df, columna_nit, clientes_acceso):
     """Filtra un DataFrame por clientes accesibles de forma segura"""
@@ -324,19 +2543,22 @@ def existe_valor(df, columna, valor):
 def crear_movimiento(id_llanta, tipo, vida, placa_vehiculo='', posicion='', kilometraje=0,
                      nueva_disponibilidad='', marca_reencauche='', ref_reencauche='',
                      precio_reencauche=0, observaciones='', orden_trabajo='', planilla='', operario='',
-                     nit_cliente=''):
-    """Crea un nuevo registro en la hoja de movimientos"""
+                     nit_cliente='', id_movimiento=None):
+    """
+    Crea un nuevo registro en la hoja de movimientos.
+    id_movimiento: ID ya reservado con generar_ids_movimiento (operaciones con varias llantas); None = generar uno.
+    """
     try:
-        df_movimientos = leer_hoja(SHEET_MOVIMIENTOS)
+        nuevo_id = id_movimiento
+        if nuevo_id is None:
+            # Obtener nit_cliente de la llanta si no se proporcionó
+            if not nit_cliente:
+                df_llantas_mov = leer_hoja(SHEET_LLANTAS)
+                llanta_match = fila_por_clave(df_llantas_mov, 'id_llanta', id_llanta)
+                nit_cliente = llanta_match['nit_cliente'] if llanta_match is not None else ''
 
-        # Obtener nit_cliente de la llanta si no se proporcionó
-        if not nit_cliente:
-            df_llantas_mov = leer_hoja(SHEET_LLANTAS)
-            llanta_match = df_llantas_mov[df_llantas_mov['id_llanta'] == id_llanta]
-            nit_cliente = llanta_match['nit_cliente'].values[0] if not llanta_match.empty else ''
-
-        # Generar ID de movimiento con formato id_cliente
-        nuevo_id = generar_id_movimiento(nit_cliente) if nit_cliente else 'M001'
+            # Generar ID de movimiento con formato id_cliente
+            nuevo_id = generar_id_movimiento(nit_cliente) if nit_cliente else 'M001'
 
         # Obtener usuario actual
         usuario_actual = st.session_state.get('usuario', 'sistema')
@@ -361,9 +2583,7 @@ def crear_movimiento(id_llanta, tipo, vida, placa_vehiculo='', posicion='', kilo
             'usuario': usuario_actual
         }])
 
-        df_movimientos = pd.concat([df_movimientos, nuevo_movimiento], ignore_index=True)
-        escribir_hoja(SHEET_MOVIMIENTOS, df_movimientos)
-        return True
+        return agregar_filas(SHEET_MOVIMIENTOS, nuevo_movimiento)
     except Exception as e:
         st.error(f"Error creando movimiento: {str(e)}")
         return False
@@ -383,6 +2603,88 @@ def inicializar_datos():
         escribir_hoja(SHEET_USUARIOS, usuarios_default)
 
 # ============= FUNCIONES AUXILIARES =============
+# Vidas de una llanta con columnas precio_vida{n} y costo_km_vida{n}
+VIDAS_COSTO = [1, 2, 3, 4]
+
+def calcular_costos_km(df_llantas, resumen_km):
+    """
+    Costo/km de todas las llantas de df_llantas a partir del resumen de km por (id_llanta, vida)
+    de resumen_km_llantas, sin recorrer el historial de servicios.
+    costo_km_vida{n} = precio_vida{n} / (km máximo - km mínimo de los servicios de esa vida) y
+    costo_km_acumulado = suma de los precios de las vidas usadas / km recorridos en todos sus servicios.
+    Hace falta al menos 2 servicios y km recorridos > 0; si no, el costo queda NaN.
+    Retorna un DataFrame indexado por id_llanta con vida_actual, costo_km_vida1..4 y costo_km_acumulado.
+    """
+    llantas = df_llantas.drop_duplicates('id_llanta').set_index('id_llanta')
+    if 'vida_actual' in llantas.columns:
+        vida_actual = llantas['vida_actual']
+    elif 'vida' in llantas.columns:
+        vida_actual = llantas['vida']
+    else:
+        vida_actual = pd.Series(1, index=llantas.index)
+    vida_actual = pd.to_numeric(vida_actual, errors='coerce').fillna(1).astype(int)
+    costos = pd.DataFrame({'vida_actual': vida_actual}, index=llantas.index)
+
+    resumen = resumen_km[resumen_km['id_llanta'].isin(llantas.index)]
+
+    def km_recorridos(km):
+        return (km['km_max'] - km['km_min']).where((km['servicios'] >= 2) & (km['km_max'] > km['km_min']))
+
+    precios = pd.DataFrame(index=llantas.index)
+    for v in VIDAS_COSTO:
+        precio_col = f'precio_vida{v}'
+        precios[v] = pd.to_numeric(llantas[precio_col], errors='coerce') if precio_col in llantas.columns else np.nan
+
+    # El resumen ya tiene una fila por (id_llanta, vida); las vidas que no son 1..4 se ignoran
+    km_vida = km_recorridos(resumen.set_index(['id_llanta', 'vida'])).unstack('vida') if not resumen.empty else pd.DataFrame()
+    for v in VIDAS_COSTO:
+        km = km_vida[v].reindex(llantas.index) if v in km_vida.columns else np.nan
+        costos[f'costo_km_vida{v}'] = (precios[v] / km).round(2)
+
+    # Precio de las vidas usadas: 1..vida_actual+1 (vida 0 = nueva, vida1)
+    usadas = pd.DataFrame({v: v <= vida_actual + 1 for v in VIDAS_COSTO}, index=llantas.index)
+    precio_total = precios.where(usadas).sum(axis=1)
+    por_llanta = resumen.groupby('id_llanta').agg(km_min=('km_min', 'min'), km_max=('km_max', 'max'), servicios=('servicios', 'sum'))
+    km_totales = km_recorridos(por_llanta).reindex(llantas.index) if not resumen.empty else np.nan
+    costos['costo_km_acumulado'] = (precio_total / km_totales).where(precio_total > 0).round(2)
+    return costos
+
+def recalcular_costos_km(ids_llanta=None):
+    """
+    Recalcula y guarda costo_km_vida1..4 de las llantas indicadas (todas si ids_llanta es None)
+    con una lectura de llantas, el resumen de km de _km_llantas y una sola escritura de la hoja de llantas.
+    Solo se actualizan las vidas ya usadas (hasta vida_actual + 1); sin datos suficientes quedan vacías.
+    Retorna la cantidad de llantas recalculadas o None si hubo un error.
+    """
+    try:
+        df_llantas = leer_hoja(SHEET_LLANTAS)
+        if df_llantas.empty:
+            return 0
+        objetivo = df_llantas if ids_llanta is None else df_llantas[df_llantas['id_llanta'].isin(list(ids_llanta))]
+        if objetivo.empty:
+            return 0
+
+        costos = calcular_costos_km(objetivo, resumen_km_llantas(None if ids_llanta is None else objetivo['id_llanta'].tolist()))
+        por_fila = costos.reindex(df_llantas['id_llanta'].values)
+        por_fila.index = df_llantas.index
+        filas = df_llantas['id_llanta'].isin(costos.index)
+        for v in VIDAS_COSTO:
+            costo_col = f'costo_km_vida{v}'
+            mascara = filas & (por_fila['vida_actual'] + 1 >= v)
+            valores = por_fila.loc[mascara, costo_col]
+            if costo_col not in df_llantas.columns:
+                if valores.isna().all():
+                    continue
+                df_llantas[costo_col] = np.nan
+            df_llantas.loc[mascara, costo_col] = valores
+
+        escribir_hoja(SHEET_LLANTAS, df_llantas)
+        return len(costos)
+
+    except Exception as e:
+        st.error(f"Error recalculando costos/km: {str(e)}")
+        return None
+
 def calcular_costo_km_vida(id_llanta, vida, guardar=False):
     """
     Calcula el costo/km de una llanta en una vida específica
@@ -392,40 +2694,15 @@ def calcular_costo_km_vida(id_llanta, vida, guardar=False):
     """
     try:
         df_llantas = leer_hoja(SHEET_LLANTAS)
-        df_servicios = leer_hoja(SHEET_SERVICIOS)
-        
         llanta = df_llantas[df_llantas['id_llanta'] == id_llanta]
-        if llanta.empty:
-            return None
-        
-        # Obtener el precio de la vida correspondiente
-        precio_col = f'precio_vida{vida}'
-        if precio_col not in llanta.columns or pd.isna(llanta.iloc[0][precio_col]):
+        if llanta.empty or vida not in VIDAS_COSTO:
             return None
-        
-        precio = float(llanta.iloc[0][precio_col])
-        
-        # Obtener servicios de esa vida específica
-        servicios_vida = df_servicios[
-            (df_servicios['id_llanta'] == id_llanta) & 
-            (df_servicios['vida'] == vida)
-        ]
-        
-        if servicios_vida.empty or len(servicios_vida) < 2:
-            return None
-        
-        # Calcular kilómetros recorridos en esa vida
-        km_inicial = servicios_vida['kilometraje'].min()
-        km_final = servicios_vida['kilometraje'].max()
-        km_recorridos = km_final - km_inicial
-        
-        if km_recorridos <= 0:
+
+        costo_km = calcular_costos_km(llanta, resumen_km_llantas([id_llanta]))[f'costo_km_vida{vida}'].iloc[0]
+        if pd.isna(costo_km):
             return None
-        
-        # Calcular costo/km
-        costo_km = precio / km_recorridos
-        costo_km_redondeado = round(costo_km, 2)
-        
+        costo_km_redondeado = float(costo_km)
+
         # Guardar en CSV si se solicita
         if guardar:
             costo_col = f'costo_km_vida{vida}'
@@ -444,39 +2721,12 @@ def calcular_costo_km_acumulado(id_llanta):
     """
     try:
         df_llantas = leer_hoja(SHEET_LLANTAS)
-        df_servicios = leer_hoja(SHEET_SERVICIOS)
-        
         llanta = df_llantas[df_llantas['id_llanta'] == id_llanta]
         if llanta.empty:
             return None
-        
-        # Sumar todos los precios de vidas que se han usado
-        vida_val = llanta.iloc[0].get('vida_actual', llanta.iloc[0].get('vida', 1))
-        vida_actual = int(vida_val) if pd.notna(vida_val) else 1
-        precio_total = 0
-        
-        for v in range(1, vida_actual + 2):  # +2 porque vida 0 = nueva (vida1)
-            precio_col = f'precio_vida{v}'
-            if precio_col in llanta.columns and pd.notna(llanta.iloc[0][precio_col]):
-                precio_total += float(llanta.iloc[0][precio_col])
-        
-        # Obtener todos los servicios de la llanta
-        servicios_llanta = df_servicios[df_servicios['id_llanta'] == id_llanta]
-        
-        if servicios_llanta.empty or len(servicios_llanta) < 2:
-            return None
-        
-        # Calcular kilómetros totales recorridos
-        km_inicial = servicios_llanta['kilometraje'].min()
-        km_final = servicios_llanta['kilometraje'].max()
-        km_totales = km_final - km_inicial
-        
-        if km_totales <= 0 or precio_total <= 0:
-            return None
-        
-        # Calcular costo/km acumulado
-        costo_km_acumulado = precio_total / km_totales
-        return round(costo_km_acumulado, 2)
+
+        costo_km_acumulado = calcular_costos_km(llanta, resumen_km_llantas([id_llanta]))['costo_km_acumulado'].iloc[0]
+        return None if pd.isna(costo_km_acumulado) else float(costo_km_acumulado)
     
     except Exception as e:
         return None
@@ -486,34 +2736,8 @@ def actualizar_costos_km_llanta(id_llanta):
     Actualiza todos los costos/km de una llanta después de registrar un servicio
     Recalcula costo_km_vida1, costo_km_vida2, costo_km_vida3, costo_km_vida4
     """
-    try:
-        df_llantas = leer_hoja(SHEET_LLANTAS)
-        
-        llanta = df_llantas[df_llantas['id_llanta'] == id_llanta]
-        if llanta.empty:
-            return False
-        
-        vida_val = llanta.iloc[0].get('vida_actual', llanta.iloc[0].get('vida', 1))
-        vida_actual = int(vida_val) if pd.notna(vida_val) else 1
-
-        # Recalcular costos para cada vida que se ha usado
-        for v in range(1, 5):  # Vidas 1, 2, 3, 4
-            if v <= vida_actual + 1:  # +1 porque vida 0 = nueva (vida1)
-                costo_km = calcular_costo_km_vida(id_llanta, v, guardar=False)
-                costo_col = f'costo_km_vida{v}'
-                
-                if costo_km is not None:
-                    df_llantas.loc[df_llantas['id_llanta'] == id_llanta, costo_col] = costo_km
-                else:
-                    # Si no hay suficientes datos, dejar en 0 o None
-                    if costo_col in df_llantas.columns:
-                        df_llantas.loc[df_llantas['id_llanta'] == id_llanta, costo_col] = None
-        
-        escribir_hoja(SHEET_LLANTAS, df_llantas)
-        return True
-    
-    except Exception as e:
-        return False
+    recalculadas = recalcular_costos_km([id_llanta])
+    return bool(recalculadas)
 
 def tiene_acceso_cliente(nit_cliente):
     """Verifica si el usuario tiene acceso al cliente especificado"""
@@ -578,10 +2802,10 @@ def obtener_id_cliente(nit_cliente):
     df_clientes = leer_hoja(SHEET_CLIENTES)
     if df_clientes.empty or 'id_cliente' not in df_clientes.columns:
         return 'XX00'
-    cliente_data = df_clientes[df_clientes['nit'] == nit_cliente]
-    if cliente_data.empty:
+    cliente_data = fila_por_clave(df_clientes, 'nit', nit_cliente)
+    if cliente_data is None:
         return 'XX00'
-    id_cliente = str(cliente_data['id_cliente'].values[0]).strip()
+    id_cliente = str(cliente_data['id_cliente']).strip()
     return id_cliente if id_cliente and id_cliente != 'nan' else 'XX00'
 
 def generar_id_cliente(nombre_cliente, df_clientes):
@@ -621,31 +2845,6 @@ def generar_id_cliente(nombre_cliente, df_clientes):
     nuevo_id = f"{prefijo}{max_consecutivo + 1:02d}"
     return nuevo_id
 
-def _max_consecutivo_por_prefijo(df, col_id, prefijo_completo):
-    """Busca el máximo consecutivo en una columna para un prefijo dado (ej: TR01_V)."""
-    max_num = 0
-    if not df.empty and col_id in df.columns:
-        for id_val in df[col_id].values:
-            if pd.notna(id_val):
-                id_str = str(id_val).strip()
-                if id_str.startswith(prefijo_completo):
-                    resto = id_str[len(prefijo_completo):]
-                    # Extraer solo los dígitos iniciales (antes de _ o texto opcional)
-                    num_str = ''
-                    for c in resto:
-                        if c.isdigit():
-                            num_str += c
-                        else:
-                            break
-                    if num_str:
-                        try:
-                            num = int(num_str)
-                            if num > max_num:
-                                max_num = num
-                        except ValueError:
-                            pass
-    return max_num
-
 def generar_id_unico(nit_cliente, frente=None, id_usuario=None, tipo='vehiculo'):
     """
     Genera ID único para vehículos y llantas basado en id_cliente.
@@ -656,56 +2855,116 @@ def generar_id_unico(nit_cliente, frente=None, id_usuario=None, tipo='vehiculo')
 
     if tipo == 'vehiculo':
         sufijo = '_V'
-        df_datos = leer_hoja(SHEET_VEHICULOS)
-        col_id = 'id_vehiculo'
+        nombre_hoja = SHEET_VEHICULOS
     else:
         sufijo = '_LL'
-        df_datos = leer_hoja(SHEET_LLANTAS)
-        col_id = 'id_llanta'
+        nombre_hoja = SHEET_LLANTAS
 
     prefijo_completo = id_cliente + sufijo
-    max_num = _max_consecutivo_por_prefijo(df_datos, col_id, prefijo_completo)
-
-    return f"{prefijo_completo}{max_num + 1:02d}"
+    return f"{prefijo_completo}{asignar_consecutivo(nombre_hoja, prefijo_completo):02d}"
 
 def generar_id_servicio(nit_cliente, frente=None):
     """
     Genera ID de servicio basado en id_cliente.
     Formato: {id_cliente}_S{4 dígitos}  → TR01_S0001
     """
-    id_cliente = obtener_id_cliente(nit_cliente)
-    df_servicios = leer_hoja(SHEET_SERVICIOS)
+    return generar_ids_servicio(nit_cliente, 1)[0]
 
-    prefijo_completo = id_cliente + '_S'
-    max_num = _max_consecutivo_por_prefijo(df_servicios, 'id_servicio', prefijo_completo)
-
-    return f"{prefijo_completo}{max_num + 1:04d}"
+def generar_ids_servicio(nit_cliente, cantidad):
+    """Reserva de una vez `cantidad` IDs de servicio consecutivos de un cliente (operaciones con varias llantas)"""
+    prefijo_completo = obtener_id_cliente(nit_cliente) + '_S'
+    return [f"{prefijo_completo}{numero:04d}" for numero in asignar_consecutivos(SHEET_SERVICIOS, prefijo_completo, cantidad)]
 
 def generar_id_alineacion(nit_cliente):
     """
     Genera ID de alineación basado en id_cliente.
     Formato: {id_cliente}_A{3 dígitos}  → TR01_A001
     """
-    id_cliente = obtener_id_cliente(nit_cliente)
-    df_alineaciones = leer_hoja(SHEET_ALINEACIONES)
-
-    prefijo_completo = id_cliente + '_A'
-    max_num = _max_consecutivo_por_prefijo(df_alineaciones, 'id_alineacion', prefijo_completo)
-
-    return f"{prefijo_completo}{max_num + 1:03d}"
+    prefijo_completo = obtener_id_cliente(nit_cliente) + '_A'
+    return f"{prefijo_completo}{asignar_consecutivo(SHEET_ALINEACIONES, prefijo_completo):03d}"
 
 def generar_id_movimiento(nit_cliente):
     """
     Genera ID de movimiento basado en id_cliente.
     Formato: {id_cliente}_M{3 dígitos}  → TR01_M001
     """
-    id_cliente = obtener_id_cliente(nit_cliente)
-    df_movimientos = leer_hoja(SHEET_MOVIMIENTOS)
-
-    prefijo_completo = id_cliente + '_M'
-    max_num = _max_consecutivo_por_prefijo(df_movimientos, 'id_movimiento', prefijo_completo)
+    return generar_ids_movimiento(nit_cliente, 1)[0]
+
+def generar_ids_movimiento(nit_cliente, cantidad):
+    """Reserva de una vez `cantidad` IDs de movimiento consecutivos de un cliente (operaciones con varias llantas)"""
+    prefijo_completo = obtener_id_cliente(nit_cliente) + '_M'
+    return [f"{prefijo_completo}{numero:03d}" for numero in asignar_consecutivos(SHEET_MOVIMIENTOS, prefijo_completo, cantidad)]
+
+# ============= SELECTOR CON BÚSQUEDA =============
+# Un st.selectbox con todos los IDs manda la lista entera al navegador (decenas de miles de
+# servicios). selector_paginado busca en el servidor, sobre un texto en minúsculas por fila que se
+# arma una vez por versión de la hoja, y solo envía una página de coincidencias.
+
+# Opciones que se envían al navegador por página del selector
+SELECTOR_POR_PAGINA = 50
+
+def _textos_busqueda(df, columnas):
+    """Serie con el texto en minúsculas de las columnas de cada fila de df, separado por espacios"""
+    def armar(d):
+        texto = pd.Series('', index=d.index)
+        for col in columnas:
+            texto = texto + ' ' + d[col].fillna('').astype(str)
+        return texto.str.lower()
+
+    hoja, version = df.attrs.get('hoja'), df.attrs.get('version')
+    if hoja is None or version is None:
+        return armar(df)
+    clave = (hoja, 'busqueda', tuple(columnas))
+    entrada = _indices_hojas().get(clave)
+    if entrada is None or entrada[0] != version:
+        df_version = _versiones_retenidas().get(hoja, {}).get(version)
+        if df_version is None or any(col not in df_version.columns for col in columnas):
+            return armar(df)
+        entrada = (version, armar(df_version))
+        _indices_hojas()[clave] = entrada
+    textos = entrada[1]
+    # df suele ser una copia o un filtro de la versión: mismas etiquetas de fila
+    if textos.index.equals(df.index):
+        return textos
+    if not df.index.is_unique or not df.index.isin(textos.index).all():
+        return armar(df)
+    return textos.reindex(df.index)
+
+def selector_paginado(etiqueta, df, columna, key, columnas_busqueda=None, format_func=str):
+    """
+    Selector de un valor de df[columna] con búsqueda por texto y resultados paginados.
+    Busca en `columna` y columnas_busqueda; primero las coincidencias que empiezan por el texto
+    buscado y luego las que lo contienen. El valor elegido queda en st.session_state[key].
+    Retorna el valor seleccionado, o None si df está vacío o la búsqueda no encontró nada
+    (nunca se preselecciona un registro que no coincide: el llamador no debe editar ni borrar).
+    """
+    if df.empty or columna not in df.columns:
+        return None
+    columnas = [columna] + [col for col in (columnas_busqueda or []) if col in df.columns and col != columna]
+    valores = df[columna]
+    buscar = st.text_input(f"🔍 Buscar {etiqueta.lower()}", key=f"{key}_buscar",
+                           placeholder=f"ID o parte del texto ({len(valores.drop_duplicates())} registros)")
+    consulta = ' '.join(buscar.lower().split())
+    if consulta:
+        textos = _textos_busqueda(df, columnas)
+        # El texto empieza con un espacio y la columna principal va primero
+        prefijo = textos.str.startswith(' ' + consulta).values
+        contiene = textos.str.contains(consulta, regex=False).values
+        encontrados = pd.concat([valores[prefijo], valores[contiene & ~prefijo]]).drop_duplicates()
+        if encontrados.empty:
+            st.warning(f"No hay coincidencias para '{buscar}'")
+            return None
+    else:
+        encontrados = valores.drop_duplicates()
 
-    return f"{prefijo_completo}{max_num + 1:03d}"
+    paginas = max(1, -(-len(encontrados) // SELECTOR_POR_PAGINA))
+    pagina = 1
+    if paginas > 1:
+        pagina = int(st.number_input(f"Página (de {paginas}, {len(encontrados)} resultados)", min_value=1,
+                                     max_value=paginas, value=1, step=1, key=f"{key}_pagina_{consulta}"))
+    inicio = (pagina - 1) * SELECTOR_POR_PAGINA
+    opciones = encontrados.iloc[inicio:inicio + SELECTOR_POR_PAGINA].tolist()
+    return st.selectbox(etiqueta, options=opciones, format_func=format_func, key=key)
 
 # ============= SISTEMA DE AUTENTICACIÓN =============
 def login():
@@ -779,25 +3038,15 @@ def subir_datos_csv():
             with col1:
                 if st.button("✅ Confirmar y Agregar Datos", type="primary"):
                     if tipo_dato == "Clientes":
-                        df_existente = leer_hoja(SHEET_CLIENTES)
-                        df_combinado = pd.concat([df_existente, df_nuevo], ignore_index=True)
-                        escribir_hoja(SHEET_CLIENTES, df_combinado)
+                        agregar_filas(SHEET_CLIENTES, df_nuevo)
                     elif tipo_dato == "Vehículos":
-                        df_existente = leer_hoja(SHEET_VEHICULOS)
-                        df_combinado = pd.concat([df_existente, df_nuevo], ignore_index=True)
-                        escribir_hoja(SHEET_VEHICULOS, df_combinado)
+                        agregar_filas(SHEET_VEHICULOS, df_nuevo)
                     elif tipo_dato == "Llantas":
-                        df_existente = leer_hoja(SHEET_LLANTAS)
-                        df_combinado = pd.concat([df_existente, df_nuevo], ignore_index=True)
-                        escribir_hoja(SHEET_LLANTAS, df_combinado)
+                        agregar_filas(SHEET_LLANTAS, df_nuevo)
                     elif tipo_dato == "Servicios":
-                        df_existente = leer_hoja(SHEET_SERVICIOS)
-                        df_combinado = pd.concat([df_existente, df_nuevo], ignore_index=True)
-                        escribir_hoja(SHEET_SERVICIOS, df_combinado)
+                        agregar_filas(SHEET_SERVICIOS, df_nuevo)
                     elif tipo_dato == "Movimientos":
-                        df_existente = leer_hoja(SHEET_MOVIMIENTOS)
-                        df_combinado = pd.concat([df_existente, df_nuevo], ignore_index=True)
-                        escribir_hoja(SHEET_MOVIMIENTOS, df_combinado)
+                        agregar_filas(SHEET_MOVIMIENTOS, df_nuevo)
 
                     st.success(f"✅ Datos de {tipo_dato} agregados exitosamente")
                     st.rerun()
@@ -819,6 +3068,8 @@ def eliminar_corregir_datos():
     
     if not verificar_permiso(2):
         return
+
+    precargar_hojas([SHEET_CLIENTES, SHEET_LLANTAS, SHEET_MOVIMIENTOS, SHEET_SERVICIOS, SHEET_VEHICULOS])
     
     tab1, tab2, tab3, tab4, tab5 = st.tabs(["🚛 Vehículos", "⚙️ Llantas", "🛠️ Servicios", "👤 Clientes", "📦 Movimientos"])
     
@@ -831,55 +3082,55 @@ def eliminar_corregir_datos():
             df_vehiculos = filtrar_por_clientes(df_vehiculos, 'nit_cliente', clientes_acceso)
             
             if not df_vehiculos.empty:
-                id_editar = st.selectbox("Seleccionar Vehículo",
-                    df_vehiculos['id_vehiculo'].values,
-                    format_func=lambda x: f"ID {x} - {df_vehiculos[df_vehiculos['id_vehiculo']==x]['placa_vehiculo'].values[0]}",
-                    key="select_vehiculo_editar")
+                id_editar = selector_paginado("Seleccionar Vehículo", df_vehiculos, 'id_vehiculo',
+                    key="select_vehiculo_editar", columnas_busqueda=['placa_vehiculo'],
+                    format_func=lambda x: f"ID {x} - {fila_por_clave(df_vehiculos, 'id_vehiculo', x)['placa_vehiculo']}")
                 
-                vehiculo = df_vehiculos[df_vehiculos['id_vehiculo'] == id_editar].iloc[0]
-
-                st.info(f"**Vehículo seleccionado:** {id_editar} | Placa: {vehiculo.get('placa_vehiculo', 'N/A')} | Marca: {vehiculo.get('marca', 'N/A')} | Línea: {vehiculo.get('linea', 'N/A')} | Estado: {vehiculo.get('estado', 'N/A')}")
-
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    nueva_marca = st.text_input("Marca", value=vehiculo.get('marca', ''), key=f"edit_marca_vehiculo_{id_editar}")
-                    nuevo_estado = st.selectbox("Estado",
-                        options=['no_asignado', 'activo', 'fuera_de_servicio'],
-                        index=['no_asignado', 'activo', 'fuera_de_servicio'].index(vehiculo.get('estado', 'no_asignado')),
-                        key=f"edit_estado_vehiculo_{id_editar}")
-
-                with col2:
-                    nueva_linea = st.text_input("Línea", value=vehiculo.get('linea', ''), key=f"edit_linea_vehiculo_{id_editar}")
-                    nuevo_km_inicial = st.number_input("Kilometraje Inicial", value=float(vehiculo.get('kilometraje_inicial', 0)), key=f"edit_km_vehiculo_{id_editar}")
-
-                with col3:
-                    nueva_tipologia = st.text_input("Tipología", value=vehiculo.get('tipologia', ''), key=f"edit_tipologia_vehiculo_{id_editar}")
-                    nuevo_calculo = st.selectbox("Cálculo KMs",
-                        options=['odometro', 'promedio', 'tabla'],
-                        index=['odometro', 'promedio', 'tabla'].index(vehiculo.get('calculo_kms', 'odometro')),
-                        key=f"edit_calculo_vehiculo_{id_editar}")
+                if id_editar is not None:
+                    vehiculo = fila_por_clave(df_vehiculos, 'id_vehiculo', id_editar)
+
+                    st.info(f"**Vehículo seleccionado:** {id_editar} | Placa: {vehiculo.get('placa_vehiculo', 'N/A')} | Marca: {vehiculo.get('marca', 'N/A')} | Línea: {vehiculo.get('linea', 'N/A')} | Estado: {vehiculo.get('estado', 'N/A')}")
+
+                    col1, col2, col3 = st.columns(3)
+                    with col1:
+                        nueva_marca = st.text_input("Marca", value=vehiculo.get('marca', ''), key=f"edit_marca_vehiculo_{id_editar}")
+                        nuevo_estado = st.selectbox("Estado",
+                            options=['no_asignado', 'activo', 'fuera_de_servicio'],
+                            index=['no_asignado', 'activo', 'fuera_de_servicio'].index(vehiculo.get('estado', 'no_asignado')),
+                            key=f"edit_estado_vehiculo_{id_editar}")
+
+                    with col2:
+                        nueva_linea = st.text_input("Línea", value=vehiculo.get('linea', ''), key=f"edit_linea_vehiculo_{id_editar}")
+                        nuevo_km_inicial = st.number_input("Kilometraje Inicial", value=float(vehiculo.get('kilometraje_inicial', 0)), key=f"edit_km_vehiculo_{id_editar}")
+
+                    with col3:
+                        nueva_tipologia = st.text_input("Tipología", value=vehiculo.get('tipologia', ''), key=f"edit_tipologia_vehiculo_{id_editar}")
+                        nuevo_calculo = st.selectbox("Cálculo KMs",
+                            options=['odometro', 'promedio', 'tabla'],
+                            index=['odometro', 'promedio', 'tabla'].index(vehiculo.get('calculo_kms', 'odometro')),
+                            key=f"edit_calculo_vehiculo_{id_editar}")
                 
-                col_btn1, col_btn2 = st.columns(2)
-                with col_btn1:
-                    if st.button("💾 Guardar Cambios", key="guardar_vehiculo"):
-                        df_todos = leer_hoja(SHEET_VEHICULOS)
-                        df_todos.loc[df_todos['id_vehiculo'] == id_editar, 'marca'] = nueva_marca
-                        df_todos.loc[df_todos['id_vehiculo'] == id_editar, 'linea'] = nueva_linea
-                        df_todos.loc[df_todos['id_vehiculo'] == id_editar, 'tipologia'] = nueva_tipologia
-                        df_todos.loc[df_todos['id_vehiculo'] == id_editar, 'estado'] = nuevo_estado
-                        df_todos.loc[df_todos['id_vehiculo'] == id_editar, 'kilometraje_inicial'] = nuevo_km_inicial
-                        df_todos.loc[df_todos['id_vehiculo'] == id_editar, 'calculo_kms'] = nuevo_calculo
-                        escribir_hoja(SHEET_VEHICULOS, df_todos)
-                        st.success("✅ Vehículo actualizado con éxito")
-                        st.rerun()
+                    col_btn1, col_btn2 = st.columns(2)
+                    with col_btn1:
+                        if st.button("💾 Guardar Cambios", key="guardar_vehiculo"):
+                            df_todos = leer_hoja(SHEET_VEHICULOS)
+                            df_todos.loc[df_todos['id_vehiculo'] == id_editar, 'marca'] = nueva_marca
+                            df_todos.loc[df_todos['id_vehiculo'] == id_editar, 'linea'] = nueva_linea
+                            df_todos.loc[df_todos['id_vehiculo'] == id_editar, 'tipologia'] = nueva_tipologia
+                            df_todos.loc[df_todos['id_vehiculo'] == id_editar, 'estado'] = nuevo_estado
+                            df_todos.loc[df_todos['id_vehiculo'] == id_editar, 'kilometraje_inicial'] = nuevo_km_inicial
+                            df_todos.loc[df_todos['id_vehiculo'] == id_editar, 'calculo_kms'] = nuevo_calculo
+                            escribir_hoja(SHEET_VEHICULOS, df_todos)
+                            st.success("✅ Vehículo actualizado con éxito")
+                            st.rerun()
                 
-                with col_btn2:
-                    if st.button("🗑️ Eliminar Vehículo", key="eliminar_vehiculo"):
-                        df_todos = leer_hoja(SHEET_VEHICULOS)
-                        df_todos = df_todos[df_todos['id_vehiculo'] != id_editar]
-                        escribir_hoja(SHEET_VEHICULOS, df_todos)
-                        st.success("✅ Vehículo eliminado con éxito")
-                        st.rerun()
+                    with col_btn2:
+                        if st.button("🗑️ Eliminar Vehículo", key="eliminar_vehiculo"):
+                            df_todos = leer_hoja(SHEET_VEHICULOS)
+                            df_todos = df_todos[df_todos['id_vehiculo'] != id_editar]
+                            escribir_hoja(SHEET_VEHICULOS, df_todos)
+                            st.success("✅ Vehículo eliminado con éxito")
+                            st.rerun()
             else:
                 st.info("No tienes vehículos accesibles")
         else:
@@ -894,52 +3145,54 @@ def eliminar_corregir_datos():
             df_llantas = filtrar_por_clientes(df_llantas, 'nit_cliente', clientes_acceso)
             
             if not df_llantas.empty:
-                id_editar = st.selectbox("Seleccionar Llanta", df_llantas['id_llanta'].values, key="select_llanta_editar")
+                id_editar = selector_paginado("Seleccionar Llanta", df_llantas, 'id_llanta', key="select_llanta_editar",
+                                              columnas_busqueda=['placa_actual', 'marca_llanta'])
                 
-                llanta = df_llantas[df_llantas['id_llanta'] == id_editar].iloc[0]
+                if id_editar is not None:
+                    llanta = fila_por_clave(df_llantas, 'id_llanta', id_editar)
 
-                st.info(f"**Llanta seleccionada:** {id_editar} | Marca: {llanta.get('marca_llanta', 'N/A')} | Ref: {llanta.get('referencia', 'N/A')} | Dimensión: {llanta.get('dimension', 'N/A')} | Disponibilidad: {llanta.get('disponibilidad', 'N/A')}")
+                    st.info(f"**Llanta seleccionada:** {id_editar} | Marca: {llanta.get('marca_llanta', 'N/A')} | Ref: {llanta.get('referencia', 'N/A')} | Dimensión: {llanta.get('dimension', 'N/A')} | Disponibilidad: {llanta.get('disponibilidad', 'N/A')}")
 
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    nueva_marca = st.text_input("Marca", value=llanta.get('marca_llanta', ''), key=f"edit_marca_llanta_{id_editar}")
-                    nueva_referencia = st.text_input("Referencia", value=llanta.get('referencia', ''), key=f"edit_referencia_llanta_{id_editar}")
+                    col1, col2, col3 = st.columns(3)
+                    with col1:
+                        nueva_marca = st.text_input("Marca", value=llanta.get('marca_llanta', ''), key=f"edit_marca_llanta_{id_editar}")
+                        nueva_referencia = st.text_input("Referencia", value=llanta.get('referencia', ''), key=f"edit_referencia_llanta_{id_editar}")
 
-                with col2:
-                    nueva_dimension = st.text_input("Dimensión", value=llanta.get('dimension', ''), key=f"edit_dimension_llanta_{id_editar}")
-                    precio_v1 = st.number_input("Precio Vida 1", value=float(llanta.get('precio_vida1', 0)), key=f"edit_precio_v1_llanta_{id_editar}")
+                    with col2:
+                        nueva_dimension = st.text_input("Dimensión", value=llanta.get('dimension', ''), key=f"edit_dimension_llanta_{id_editar}")
+                        precio_v1 = st.number_input("Precio Vida 1", value=float(llanta.get('precio_vida1', 0)), key=f"edit_precio_v1_llanta_{id_editar}")
 
-                with col3:
-                    precio_v2 = st.number_input("Precio Vida 2", value=float(llanta.get('precio_vida2', 0)), key=f"edit_precio_v2_llanta_{id_editar}")
-                    precio_v3 = st.number_input("Precio Vida 3", value=float(llanta.get('precio_vida3', 0)), key=f"edit_precio_v3_llanta_{id_editar}")
+                    with col3:
+                        precio_v2 = st.number_input("Precio Vida 2", value=float(llanta.get('precio_vida2', 0)), key=f"edit_precio_v2_llanta_{id_editar}")
+                        precio_v3 = st.number_input("Precio Vida 3", value=float(llanta.get('precio_vida3', 0)), key=f"edit_precio_v3_llanta_{id_editar}")
 
-                precio_v4 = st.number_input("Precio Vida 4", value=float(llanta.get('precio_vida4', 0)), key=f"edit_precio_v4_llanta_{id_editar}")
+                    precio_v4 = st.number_input("Precio Vida 4", value=float(llanta.get('precio_vida4', 0)), key=f"edit_precio_v4_llanta_{id_editar}")
                 
-                st.info("💡 Los costos/km se recalculan automáticamente al guardar cambios")
+                    st.info("💡 Los costos/km se recalculan automáticamente al guardar cambios")
                 
-                if st.button("💾 Guardar Cambios", key="guardar_llanta"):
-                    df_todos = leer_hoja(SHEET_LLANTAS)
-                    df_todos.loc[df_todos['id_llanta'] == id_editar, 'marca_llanta'] = nueva_marca
-                    df_todos.loc[df_todos['id_llanta'] == id_editar, 'referencia'] = nueva_referencia
-                    df_todos.loc[df_todos['id_llanta'] == id_editar, 'dimension'] = nueva_dimension
-                    df_todos.loc[df_todos['id_llanta'] == id_editar, 'precio_vida1'] = precio_v1
-                    df_todos.loc[df_todos['id_llanta'] == id_editar, 'precio_vida2'] = precio_v2
-                    df_todos.loc[df_todos['id_llanta'] == id_editar, 'precio_vida3'] = precio_v3
-                    df_todos.loc[df_todos['id_llanta'] == id_editar, 'precio_vida4'] = precio_v4
-                    escribir_hoja(SHEET_LLANTAS, df_todos)
+                    if st.button("💾 Guardar Cambios", key="guardar_llanta"):
+                        df_todos = leer_hoja(SHEET_LLANTAS)
+                        df_todos.loc[df_todos['id_llanta'] == id_editar, 'marca_llanta'] = nueva_marca
+                        df_todos.loc[df_todos['id_llanta'] == id_editar, 'referencia'] = nueva_referencia
+                        df_todos.loc[df_todos['id_llanta'] == id_editar, 'dimension'] = nueva_dimension
+                        df_todos.loc[df_todos['id_llanta'] == id_editar, 'precio_vida1'] = precio_v1
+                        df_todos.loc[df_todos['id_llanta'] == id_editar, 'precio_vida2'] = precio_v2
+                        df_todos.loc[df_todos['id_llanta'] == id_editar, 'precio_vida3'] = precio_v3
+                        df_todos.loc[df_todos['id_llanta'] == id_editar, 'precio_vida4'] = precio_v4
+                        escribir_hoja(SHEET_LLANTAS, df_todos)
                     
-                    # Recalcular costos/km después de guardar
-                    actualizar_costos_km_llanta(id_editar)
+                        # Recalcular costos/km después de guardar
+                        actualizar_costos_km_llanta(id_editar)
                     
-                    st.success("✅ Llanta actualizada con éxito")
-                    st.rerun()
+                        st.success("✅ Llanta actualizada con éxito")
+                        st.rerun()
                 
-                if st.button("🗑️ Eliminar Llanta", key="eliminar_llanta"):
-                    df_todos = leer_hoja(SHEET_LLANTAS)
-                    df_todos = df_todos[df_todos['id_llanta'] != id_editar]
-                    escribir_hoja(SHEET_LLANTAS, df_todos)
-                    st.success("✅ Llanta eliminada con éxito")
-                    st.rerun()
+                    if st.button("🗑️ Eliminar Llanta", key="eliminar_llanta"):
+                        df_todos = leer_hoja(SHEET_LLANTAS)
+                        df_todos = df_todos[df_todos['id_llanta'] != id_editar]
+                        escribir_hoja(SHEET_LLANTAS, df_todos)
+                        st.success("✅ Llanta eliminada con éxito")
+                        st.rerun()
             else:
                 st.info("No tienes llantas accesibles")
         else:
@@ -950,96 +3203,95 @@ def eliminar_corregir_datos():
         df_servicios = leer_hoja(SHEET_SERVICIOS)
 
         if not df_servicios.empty:
-            id_servicio_editar = st.selectbox("Seleccionar Servicio", df_servicios['id_servicio'].values, key="select_servicio_editar")
+            id_servicio_editar = selector_paginado("Seleccionar Servicio", df_servicios, 'id_servicio', key="select_servicio_editar",
+                                                   columnas_busqueda=['id_llanta', 'placa_vehiculo'])
 
-            servicio = df_servicios[df_servicios['id_servicio'] == id_servicio_editar].iloc[0]
+            if id_servicio_editar is not None:
+                servicio = fila_por_clave(df_servicios, 'id_servicio', id_servicio_editar)
 
-            st.info(f"**Servicio seleccionado:** {id_servicio_editar} | Llanta: {servicio.get('id_llanta', 'N/A')} | Placa: {servicio.get('placa_vehiculo', 'N/A')} | Fecha: {servicio.get('fecha', 'N/A')} | Tipo: {servicio.get('tipo_servicio', 'N/A')}")
+                st.info(f"**Servicio seleccionado:** {id_servicio_editar} | Llanta: {servicio.get('id_llanta', 'N/A')} | Placa: {servicio.get('placa_vehiculo', 'N/A')} | Fecha: {servicio.get('fecha', 'N/A')} | Tipo: {servicio.get('tipo_servicio', 'N/A')}")
 
-            col1, col2, col3 = st.columns(3)
+                col1, col2, col3 = st.columns(3)
 
-            with col1:
-                # Fecha del servicio
-                fecha_actual = servicio.get('fecha', '')
-                try:
-                    fecha_parsed = datetime.strptime(str(fecha_actual), "%d/%m/%Y").date() if fecha_actual else datetime.now().date()
-                except:
-                    fecha_parsed = datetime.now().date()
-                nueva_fecha = st.date_input("Fecha", value=fecha_parsed, key=f"edit_fecha_servicio_{id_servicio_editar}")
+                with col1:
+                    # Fecha del servicio
+                    fecha_actual = pd.to_datetime(servicio.get('fecha'), format=FORMATO_FECHA, errors='coerce')
+                    fecha_parsed = fecha_actual.date() if pd.notna(fecha_actual) else datetime.now().date()
+                    nueva_fecha = st.date_input("Fecha", value=fecha_parsed, key=f"edit_fecha_servicio_{id_servicio_editar}")
 
-                # Kilometraje
-                km_actual = int(servicio.get('kilometraje', 0)) if pd.notna(servicio.get('kilometraje')) else 0
-                nuevo_km = st.number_input("Kilometraje", min_value=0, value=km_actual, key=f"edit_km_servicio_{id_servicio_editar}")
+                    # Kilometraje
+                    km_actual = int(servicio.get('kilometraje', 0)) if pd.notna(servicio.get('kilometraje')) else 0
+                    nuevo_km = st.number_input("Kilometraje", min_value=0, value=km_actual, key=f"edit_km_servicio_{id_servicio_editar}")
 
-            with col2:
-                st.write("**Profundidades (mm)**")
-                prof1_actual = float(servicio.get('profundidad_1', 10.0)) if pd.notna(servicio.get('profundidad_1')) else 10.0
-                prof2_actual = float(servicio.get('profundidad_2', 10.0)) if pd.notna(servicio.get('profundidad_2')) else 10.0
-                prof3_actual = float(servicio.get('profundidad_3', 10.0)) if pd.notna(servicio.get('profundidad_3')) else 10.0
+                with col2:
+                    st.write("**Profundidades (mm)**")
+                    prof1_actual = float(servicio.get('profundidad_1', 10.0)) if pd.notna(servicio.get('profundidad_1')) else 10.0
+                    prof2_actual = float(servicio.get('profundidad_2', 10.0)) if pd.notna(servicio.get('profundidad_2')) else 10.0
+                    prof3_actual = float(servicio.get('profundidad_3', 10.0)) if pd.notna(servicio.get('profundidad_3')) else 10.0
 
-                nueva_prof1 = st.number_input("Profundidad 1", min_value=0.0, max_value=30.0, value=prof1_actual, step=0.5, key=f"edit_prof1_{id_servicio_editar}")
-                nueva_prof2 = st.number_input("Profundidad 2", min_value=0.0, max_value=30.0, value=prof2_actual, step=0.5, key=f"edit_prof2_{id_servicio_editar}")
-                nueva_prof3 = st.number_input("Profundidad 3", min_value=0.0, max_value=30.0, value=prof3_actual, step=0.5, key=f"edit_prof3_{id_servicio_editar}")
+                    nueva_prof1 = st.number_input("Profundidad 1", min_value=0.0, max_value=30.0, value=prof1_actual, step=0.5, key=f"edit_prof1_{id_servicio_editar}")
+                    nueva_prof2 = st.number_input("Profundidad 2", min_value=0.0, max_value=30.0, value=prof2_actual, step=0.5, key=f"edit_prof2_{id_servicio_editar}")
+                    nueva_prof3 = st.number_input("Profundidad 3", min_value=0.0, max_value=30.0, value=prof3_actual, step=0.5, key=f"edit_prof3_{id_servicio_editar}")
 
-            with col3:
-                st.write("**Servicios Realizados**")
-                edit_rotacion = st.checkbox("Rotación", value=(servicio.get('rotacion', 'No') == 'Sí'), key=f"edit_rotacion_{id_servicio_editar}")
-                if edit_rotacion:
-                    edit_pos_nueva = st.text_input("Nueva Posición", value=servicio.get('posicion_nueva', ''), key=f"edit_pos_nueva_{id_servicio_editar}")
-                else:
-                    edit_pos_nueva = ""
-                edit_balanceo = st.checkbox("Balanceo", value=(servicio.get('balanceo', 'No') == 'Sí'), key=f"edit_balanceo_{id_servicio_editar}")
-                edit_reparacion = st.checkbox("Reparación", value=(servicio.get('reparacion', 'No') == 'Sí'), key=f"edit_reparacion_{id_servicio_editar}")
-                edit_despinche = st.checkbox("Despinche", value=(servicio.get('despinche', 'No') == 'Sí'), key=f"edit_despinche_{id_servicio_editar}")
-                edit_regrabacion = st.checkbox("Regrabación", value=(servicio.get('regrabacion', 'No') == 'Sí'), key=f"edit_regrabacion_{id_servicio_editar}")
-                edit_torqueo = st.checkbox("Torqueo", value=(servicio.get('torqueo', 'No') == 'Sí'), key=f"edit_torqueo_{id_servicio_editar}")
+                with col3:
+                    st.write("**Servicios Realizados**")
+                    edit_rotacion = st.checkbox("Rotación", value=_es_si(servicio.get('rotacion')), key=f"edit_rotacion_{id_servicio_editar}")
+                    if edit_rotacion:
+                        edit_pos_nueva = st.text_input("Nueva Posición", value=servicio.get('posicion_nueva', ''), key=f"edit_pos_nueva_{id_servicio_editar}")
+                    else:
+                        edit_pos_nueva = ""
+                    edit_balanceo = st.checkbox("Balanceo", value=_es_si(servicio.get('balanceo')), key=f"edit_balanceo_{id_servicio_editar}")
+                    edit_reparacion = st.checkbox("Reparación", value=_es_si(servicio.get('reparacion')), key=f"edit_reparacion_{id_servicio_editar}")
+                    edit_despinche = st.checkbox("Despinche", value=_es_si(servicio.get('despinche')), key=f"edit_despinche_{id_servicio_editar}")
+                    edit_regrabacion = st.checkbox("Regrabación", value=_es_si(servicio.get('regrabacion')), key=f"edit_regrabacion_{id_servicio_editar}")
+                    edit_torqueo = st.checkbox("Torqueo", value=_es_si(servicio.get('torqueo')), key=f"edit_torqueo_{id_servicio_editar}")
 
-            # Comentario FVU (campo adicional)
-            comentario_actual = servicio.get('comentario_fvu', '') if pd.notna(servicio.get('comentario_fvu')) else ''
-            nuevo_comentario = st.text_area("Comentario FVU", value=comentario_actual, key=f"edit_comentario_fvu_{id_servicio_editar}")
+                # Comentario FVU (campo adicional)
+                comentario_actual = servicio.get('comentario_fvu', '') if pd.notna(servicio.get('comentario_fvu')) else ''
+                nuevo_comentario = st.text_area("Comentario FVU", value=comentario_actual, key=f"edit_comentario_fvu_{id_servicio_editar}")
 
-            col_btn1, col_btn2 = st.columns(2)
+                col_btn1, col_btn2 = st.columns(2)
 
-            with col_btn1:
-                if st.button("💾 Guardar Cambios", key="guardar_servicio", type="primary"):
-                    if edit_rotacion and not edit_pos_nueva:
-                        st.error("Si hay rotación, debes especificar la nueva posición")
-                    else:
-                        # Actualizar los campos editables
-                        df_servicios.loc[df_servicios['id_servicio'] == id_servicio_editar, 'fecha'] = nueva_fecha.strftime("%d/%m/%Y")
-                        df_servicios.loc[df_servicios['id_servicio'] == id_servicio_editar, 'kilometraje'] = nuevo_km
-                        df_servicios.loc[df_servicios['id_servicio'] == id_servicio_editar, 'profundidad_1'] = nueva_prof1
-                        df_servicios.loc[df_servicios['id_servicio'] == id_servicio_editar, 'profundidad_2'] = nueva_prof2
-                        df_servicios.loc[df_servicios['id_servicio'] == id_servicio_editar, 'profundidad_3'] = nueva_prof3
-                        df_servicios.loc[df_servicios['id_servicio'] == id_servicio_editar, 'rotacion'] = 'Sí' if edit_rotacion else 'No'
-                        df_servicios.loc[df_servicios['id_servicio'] == id_servicio_editar, 'posicion_nueva'] = edit_pos_nueva if edit_rotacion else ''
-                        df_servicios.loc[df_servicios['id_servicio'] == id_servicio_editar, 'balanceo'] = 'Sí' if edit_balanceo else 'No'
-                        df_servicios.loc[df_servicios['id_servicio'] == id_servicio_editar, 'reparacion'] = 'Sí' if edit_reparacion else 'No'
-                        df_servicios.loc[df_servicios['id_servicio'] == id_servicio_editar, 'despinche'] = 'Sí' if edit_despinche else 'No'
-                        df_servicios.loc[df_servicios['id_servicio'] == id_servicio_editar, 'regrabacion'] = 'Sí' if edit_regrabacion else 'No'
-                        df_servicios.loc[df_servicios['id_servicio'] == id_servicio_editar, 'torqueo'] = 'Sí' if edit_torqueo else 'No'
-                        df_servicios.loc[df_servicios['id_servicio'] == id_servicio_editar, 'comentario_fvu'] = nuevo_comentario
+                with col_btn1:
+                    if st.button("💾 Guardar Cambios", key="guardar_servicio", type="primary"):
+                        if edit_rotacion and not edit_pos_nueva:
+                            st.error("Si hay rotación, debes especificar la nueva posición")
+                        else:
+                            # Actualizar los campos editables
+                            df_servicios.loc[df_servicios['id_servicio'] == id_servicio_editar, 'fecha'] = pd.Timestamp(nueva_fecha)
+                            df_servicios.loc[df_servicios['id_servicio'] == id_servicio_editar, 'kilometraje'] = nuevo_km
+                            df_servicios.loc[df_servicios['id_servicio'] == id_servicio_editar, 'profundidad_1'] = nueva_prof1
+                            df_servicios.loc[df_servicios['id_servicio'] == id_servicio_editar, 'profundidad_2'] = nueva_prof2
+                            df_servicios.loc[df_servicios['id_servicio'] == id_servicio_editar, 'profundidad_3'] = nueva_prof3
+                            df_servicios.loc[df_servicios['id_servicio'] == id_servicio_editar, 'rotacion'] = edit_rotacion
+                            df_servicios.loc[df_servicios['id_servicio'] == id_servicio_editar, 'posicion_nueva'] = edit_pos_nueva if edit_rotacion else ''
+                            df_servicios.loc[df_servicios['id_servicio'] == id_servicio_editar, 'balanceo'] = edit_balanceo
+                            df_servicios.loc[df_servicios['id_servicio'] == id_servicio_editar, 'reparacion'] = edit_reparacion
+                            df_servicios.loc[df_servicios['id_servicio'] == id_servicio_editar, 'despinche'] = edit_despinche
+                            df_servicios.loc[df_servicios['id_servicio'] == id_servicio_editar, 'regrabacion'] = edit_regrabacion
+                            df_servicios.loc[df_servicios['id_servicio'] == id_servicio_editar, 'torqueo'] = edit_torqueo
+                            df_servicios.loc[df_servicios['id_servicio'] == id_servicio_editar, 'comentario_fvu'] = nuevo_comentario
+
+                            escribir_hoja(SHEET_SERVICIOS, df_servicios)
+
+                            # Recalcular costos si cambió el kilometraje
+                            id_llanta_servicio = servicio.get('id_llanta')
+                            if id_llanta_servicio:
+                                actualizar_costos_km_llanta(id_llanta_servicio)
+
+                            st.success("✅ Servicio actualizado con éxito")
+                            st.rerun()
 
+                with col_btn2:
+                    if st.button("🗑️ Eliminar Servicio", key="eliminar_servicio"):
+                        df_servicios = df_servicios[df_servicios['id_servicio'] != id_servicio_editar]
                         escribir_hoja(SHEET_SERVICIOS, df_servicios)
-
-                        # Recalcular costos si cambió el kilometraje
-                        id_llanta_servicio = servicio.get('id_llanta')
-                        if id_llanta_servicio:
-                            actualizar_costos_km_llanta(id_llanta_servicio)
-
-                        st.success("✅ Servicio actualizado con éxito")
+                        st.success("✅ Servicio eliminado con éxito")
                         st.rerun()
 
-            with col_btn2:
-                if st.button("🗑️ Eliminar Servicio", key="eliminar_servicio"):
-                    df_servicios = df_servicios[df_servicios['id_servicio'] != id_servicio_editar]
-                    escribir_hoja(SHEET_SERVICIOS, df_servicios)
-                    st.success("✅ Servicio eliminado con éxito")
-                    st.rerun()
-
-            # Mostrar información de referencia
-            st.divider()
-            st.caption(f"ID Llanta: {servicio.get('id_llanta', 'N/A')} | Placa: {servicio.get('placa_vehiculo', 'N/A')} | Posición original: {servicio.get('posicion', 'N/A')} | Vida: {servicio.get('vida', 'N/A')}")
+                # Mostrar información de referencia
+                st.divider()
+                st.caption(f"ID Llanta: {servicio.get('id_llanta', 'N/A')} | Placa: {servicio.get('placa_vehiculo', 'N/A')} | Posición original: {servicio.get('posicion', 'N/A')} | Vida: {servicio.get('vida', 'N/A')}")
         else:
             st.info("No hay servicios registrados")
     
@@ -1053,25 +3305,27 @@ def eliminar_corregir_datos():
         df_clientes = leer_hoja(SHEET_CLIENTES)
         
         if not df_clientes.empty:
-            nit_editar = st.selectbox("Seleccionar Cliente", df_clientes['nit'].values, key="select_cliente_editar")
+            nit_editar = selector_paginado("Seleccionar Cliente", df_clientes, 'nit', key="select_cliente_editar",
+                                           columnas_busqueda=['nombre_cliente'])
             
-            cliente = df_clientes[df_clientes['nit'] == nit_editar].iloc[0]
+            if nit_editar is not None:
+                cliente = fila_por_clave(df_clientes, 'nit', nit_editar)
 
-            st.info(f"**Cliente seleccionado:** NIT: {nit_editar} | Nombre: {cliente.get('nombre_cliente', 'N/A')}")
+                st.info(f"**Cliente seleccionado:** NIT: {nit_editar} | Nombre: {cliente.get('nombre_cliente', 'N/A')}")
 
-            nuevo_nombre = st.text_input("Nombre Cliente", value=cliente['nombre_cliente'], key=f"edit_nombre_cliente_{nit_editar}")
+                nuevo_nombre = st.text_input("Nombre Cliente", value=cliente['nombre_cliente'], key=f"edit_nombre_cliente_{nit_editar}")
             
-            if st.button("💾 Guardar Cambios", key="guardar_cliente"):
-                df_clientes.loc[df_clientes['nit'] == nit_editar, 'nombre_cliente'] = nuevo_nombre
-                escribir_hoja(SHEET_CLIENTES, df_clientes)
-                st.success("✅ Cliente actualizado con éxito")
-                st.rerun()
+                if st.button("💾 Guardar Cambios", key="guardar_cliente"):
+                    df_clientes.loc[df_clientes['nit'] == nit_editar, 'nombre_cliente'] = nuevo_nombre
+                    escribir_hoja(SHEET_CLIENTES, df_clientes)
+                    st.success("✅ Cliente actualizado con éxito")
+                    st.rerun()
             
-            if st.button("🗑️ Eliminar Cliente", key="eliminar_cliente"):
-                df_clientes = df_clientes[df_clientes['nit'] != nit_editar]
-                escribir_hoja(SHEET_CLIENTES, df_clientes)
-                st.success("✅ Cliente eliminado con éxito")
-                st.rerun()
+                if st.button("🗑️ Eliminar Cliente", key="eliminar_cliente"):
+                    df_clientes = df_clientes[df_clientes['nit'] != nit_editar]
+                    escribir_hoja(SHEET_CLIENTES, df_clientes)
+                    st.success("✅ Cliente eliminado con éxito")
+                    st.rerun()
         else:
             st.info("No hay clientes registrados")
 
@@ -1089,103 +3343,108 @@ def eliminar_corregir_datos():
                 df_movimientos = df_movimientos[df_movimientos['id_llanta'].isin(llantas_cliente)]
 
             if not df_movimientos.empty:
-                id_mov_editar = st.selectbox(
-                    "Seleccionar Movimiento",
-                    options=df_movimientos['id_movimiento'].values,
-                    format_func=lambda x: f"ID {x} - Llanta {df_movimientos[df_movimientos['id_movimiento']==x]['id_llanta'].values[0]} - {df_movimientos[df_movimientos['id_movimiento']==x]['tipo'].values[0]} ({df_movimientos[df_movimientos['id_movimiento']==x]['fecha'].values[0]})",
-                    key="select_movimiento_editar"
+                def format_movimiento(x):
+                    movimiento = fila_por_clave(df_movimientos, 'id_movimiento', x)
+                    return f"ID {x} - Llanta {movimiento['id_llanta']} - {movimiento['tipo']} ({movimiento['fecha']})"
+
+                id_mov_editar = selector_paginado(
+                    "Seleccionar Movimiento", df_movimientos, 'id_movimiento',
+                    key="select_movimiento_editar",
+                    columnas_busqueda=['id_llanta', 'placa_vehiculo', 'tipo'],
+                    format_func=format_movimiento
                 )
 
-                movimiento = df_movimientos[df_movimientos['id_movimiento'] == id_mov_editar].iloc[0]
-
-                st.info(f"**Movimiento seleccionado:** {id_mov_editar} | Llanta: {movimiento.get('id_llanta', 'N/A')} | Tipo: {movimiento.get('tipo', 'N/A')} | Placa: {movimiento.get('placa_vehiculo', 'N/A')} | Fecha: {movimiento.get('fecha', 'N/A')}")
-
-                col1, col2, col3 = st.columns(3)
-
-                with col1:
-                    # Tipo de movimiento
-                    tipos_mov = ['montaje', 'desmontaje', 'aprobacion_reencauche', 'rotacion', 'otro']
-                    tipo_actual = movimiento.get('tipo', 'otro')
-                    tipo_idx = tipos_mov.index(tipo_actual) if tipo_actual in tipos_mov else 4
-                    nuevo_tipo = st.selectbox("Tipo", options=tipos_mov, index=tipo_idx, key=f"edit_tipo_mov_{id_mov_editar}")
-
-                    # Vida
-                    vida_mov = int(movimiento.get('vida', 1)) if pd.notna(movimiento.get('vida')) else 1
-                    vida_mov = max(1, vida_mov)  # Asegurar que sea al menos 1
-                    # Limpiar session_state si tiene valor inválido
-                    vida_key = f"edit_vida_mov_{id_mov_editar}"
-                    if vida_key in st.session_state and st.session_state[vida_key] < 1:
-                        del st.session_state[vida_key]
-                    nueva_vida = st.number_input("Vida", min_value=1, max_value=4, value=vida_mov, key=vida_key)
-
-                with col2:
-                    # Placa vehículo
-                    placa_mov = movimiento.get('placa_vehiculo', '') if pd.notna(movimiento.get('placa_vehiculo')) else ''
-                    nueva_placa = st.text_input("Placa Vehículo", value=placa_mov, key=f"edit_placa_mov_{id_mov_editar}")
-
-                    # Posición
-                    pos_mov = movimiento.get('posicion', '') if pd.notna(movimiento.get('posicion')) else ''
-                    nueva_posicion = st.text_input("Posición", value=pos_mov, key=f"edit_pos_mov_{id_mov_editar}")
-
-                with col3:
-                    # Kilometraje
-                    km_mov = int(movimiento.get('kilometraje', 0)) if pd.notna(movimiento.get('kilometraje')) else 0
-                    nuevo_km = st.number_input("Kilometraje", min_value=0, value=km_mov, key=f"edit_km_mov_{id_mov_editar}")
-
-                    # Nueva disponibilidad
-                    disp_mov = movimiento.get('nueva_disponibilidad', '') if pd.notna(movimiento.get('nueva_disponibilidad')) else ''
-                    nueva_disp = st.text_input("Nueva Disponibilidad", value=disp_mov, key=f"edit_disp_mov_{id_mov_editar}")
-
-                # Datos de reencauche (si aplica)
-                st.write("**Datos de Reencauche (si aplica):**")
-                col4, col5, col6 = st.columns(3)
-
-                with col4:
-                    marca_reenc = movimiento.get('marca_reencauche', '') if pd.notna(movimiento.get('marca_reencauche')) else ''
-                    nueva_marca_reenc = st.text_input("Marca Reencauche", value=marca_reenc, key=f"edit_marca_reenc_{id_mov_editar}")
-
-                with col5:
-                    ref_reenc = movimiento.get('ref_reencauche', '') if pd.notna(movimiento.get('ref_reencauche')) else ''
-                    nueva_ref_reenc = st.text_input("Ref. Reencauche", value=ref_reenc, key=f"edit_ref_reenc_{id_mov_editar}")
-
-                with col6:
-                    precio_reenc = float(movimiento.get('precio_reencauche', 0)) if pd.notna(movimiento.get('precio_reencauche')) else 0
-                    nuevo_precio_reenc = st.number_input("Precio Reencauche", min_value=0.0, value=precio_reenc, key=f"edit_precio_reenc_{id_mov_editar}")
-
-                # Observaciones
-                obs_mov = movimiento.get('observaciones', '') if pd.notna(movimiento.get('observaciones')) else ''
-                nuevas_obs = st.text_area("Observaciones", value=obs_mov, key=f"edit_obs_mov_{id_mov_editar}")
-
-                col_btn1, col_btn2 = st.columns(2)
-
-                with col_btn1:
-                    if st.button("💾 Guardar Cambios", key="guardar_movimiento", type="primary"):
-                        df_mov_todos = leer_hoja(SHEET_MOVIMIENTOS)
-                        df_mov_todos.loc[df_mov_todos['id_movimiento'] == id_mov_editar, 'tipo'] = nuevo_tipo
-                        df_mov_todos.loc[df_mov_todos['id_movimiento'] == id_mov_editar, 'vida'] = nueva_vida
-                        df_mov_todos.loc[df_mov_todos['id_movimiento'] == id_mov_editar, 'placa_vehiculo'] = nueva_placa
-                        df_mov_todos.loc[df_mov_todos['id_movimiento'] == id_mov_editar, 'posicion'] = nueva_posicion
-                        df_mov_todos.loc[df_mov_todos['id_movimiento'] == id_mov_editar, 'kilometraje'] = nuevo_km
-                        df_mov_todos.loc[df_mov_todos['id_movimiento'] == id_mov_editar, 'nueva_disponibilidad'] = nueva_disp
-                        df_mov_todos.loc[df_mov_todos['id_movimiento'] == id_mov_editar, 'marca_reencauche'] = nueva_marca_reenc
-                        df_mov_todos.loc[df_mov_todos['id_movimiento'] == id_mov_editar, 'ref_reencauche'] = nueva_ref_reenc
-                        df_mov_todos.loc[df_mov_todos['id_movimiento'] == id_mov_editar, 'precio_reencauche'] = nuevo_precio_reenc
-                        df_mov_todos.loc[df_mov_todos['id_movimiento'] == id_mov_editar, 'observaciones'] = nuevas_obs
-                        escribir_hoja(SHEET_MOVIMIENTOS, df_mov_todos)
-                        st.success("✅ Movimiento actualizado con éxito")
-                        st.rerun()
+                if id_mov_editar is not None:
+                    movimiento = fila_por_clave(df_movimientos, 'id_movimiento', id_mov_editar)
+
+                    st.info(f"**Movimiento seleccionado:** {id_mov_editar} | Llanta: {movimiento.get('id_llanta', 'N/A')} | Tipo: {movimiento.get('tipo', 'N/A')} | Placa: {movimiento.get('placa_vehiculo', 'N/A')} | Fecha: {movimiento.get('fecha', 'N/A')}")
+
+                    col1, col2, col3 = st.columns(3)
+
+                    with col1:
+                        # Tipo de movimiento
+                        tipos_mov = ['montaje', 'desmontaje', 'aprobacion_reencauche', 'rotacion', 'otro']
+                        tipo_actual = movimiento.get('tipo', 'otro')
+                        tipo_idx = tipos_mov.index(tipo_actual) if tipo_actual in tipos_mov else 4
+                        nuevo_tipo = st.selectbox("Tipo", options=tipos_mov, index=tipo_idx, key=f"edit_tipo_mov_{id_mov_editar}")
+
+                        # Vida
+                        vida_mov = int(movimiento.get('vida', 1)) if pd.notna(movimiento.get('vida')) else 1
+                        vida_mov = max(1, vida_mov)  # Asegurar que sea al menos 1
+                        # Limpiar session_state si tiene valor inválido
+                        vida_key = f"edit_vida_mov_{id_mov_editar}"
+                        if vida_key in st.session_state and st.session_state[vida_key] < 1:
+                            del st.session_state[vida_key]
+                        nueva_vida = st.number_input("Vida", min_value=1, max_value=4, value=vida_mov, key=vida_key)
+
+                    with col2:
+                        # Placa vehículo
+                        placa_mov = movimiento.get('placa_vehiculo', '') if pd.notna(movimiento.get('placa_vehiculo')) else ''
+                        nueva_placa = st.text_input("Placa Vehículo", value=placa_mov, key=f"edit_placa_mov_{id_mov_editar}")
+
+                        # Posición
+                        pos_mov = movimiento.get('posicion', '') if pd.notna(movimiento.get('posicion')) else ''
+                        nueva_posicion = st.text_input("Posición", value=pos_mov, key=f"edit_pos_mov_{id_mov_editar}")
+
+                    with col3:
+                        # Kilometraje
+                        km_mov = int(movimiento.get('kilometraje', 0)) if pd.notna(movimiento.get('kilometraje')) else 0
+                        nuevo_km = st.number_input("Kilometraje", min_value=0, value=km_mov, key=f"edit_km_mov_{id_mov_editar}")
+
+                        # Nueva disponibilidad
+                        disp_mov = movimiento.get('nueva_disponibilidad', '') if pd.notna(movimiento.get('nueva_disponibilidad')) else ''
+                        nueva_disp = st.text_input("Nueva Disponibilidad", value=disp_mov, key=f"edit_disp_mov_{id_mov_editar}")
+
+                    # Datos de reencauche (si aplica)
+                    st.write("**Datos de Reencauche (si aplica):**")
+                    col4, col5, col6 = st.columns(3)
+
+                    with col4:
+                        marca_reenc = movimiento.get('marca_reencauche', '') if pd.notna(movimiento.get('marca_reencauche')) else ''
+                        nueva_marca_reenc = st.text_input("Marca Reencauche", value=marca_reenc, key=f"edit_marca_reenc_{id_mov_editar}")
+
+                    with col5:
+                        ref_reenc = movimiento.get('ref_reencauche', '') if pd.notna(movimiento.get('ref_reencauche')) else ''
+                        nueva_ref_reenc = st.text_input("Ref. Reencauche", value=ref_reenc, key=f"edit_ref_reenc_{id_mov_editar}")
+
+                    with col6:
+                        precio_reenc = float(movimiento.get('precio_reencauche', 0)) if pd.notna(movimiento.get('precio_reencauche')) else 0
+                        nuevo_precio_reenc = st.number_input("Precio Reencauche", min_value=0.0, value=precio_reenc, key=f"edit_precio_reenc_{id_mov_editar}")
+
+                    # Observaciones
+                    obs_mov = movimiento.get('observaciones', '') if pd.notna(movimiento.get('observaciones')) else ''
+                    nuevas_obs = st.text_area("Observaciones", value=obs_mov, key=f"edit_obs_mov_{id_mov_editar}")
+
+                    col_btn1, col_btn2 = st.columns(2)
+
+                    with col_btn1:
+                        if st.button("💾 Guardar Cambios", key="guardar_movimiento", type="primary"):
+                            df_mov_todos = leer_hoja(SHEET_MOVIMIENTOS)
+                            df_mov_todos.loc[df_mov_todos['id_movimiento'] == id_mov_editar, 'tipo'] = nuevo_tipo
+                            df_mov_todos.loc[df_mov_todos['id_movimiento'] == id_mov_editar, 'vida'] = nueva_vida
+                            df_mov_todos.loc[df_mov_todos['id_movimiento'] == id_mov_editar, 'placa_vehiculo'] = nueva_placa
+                            df_mov_todos.loc[df_mov_todos['id_movimiento'] == id_mov_editar, 'posicion'] = nueva_posicion
+                            df_mov_todos.loc[df_mov_todos['id_movimiento'] == id_mov_editar, 'kilometraje'] = nuevo_km
+                            df_mov_todos.loc[df_mov_todos['id_movimiento'] == id_mov_editar, 'nueva_disponibilidad'] = nueva_disp
+                            df_mov_todos.loc[df_mov_todos['id_movimiento'] == id_mov_editar, 'marca_reencauche'] = nueva_marca_reenc
+                            df_mov_todos.loc[df_mov_todos['id_movimiento'] == id_mov_editar, 'ref_reencauche'] = nueva_ref_reenc
+                            df_mov_todos.loc[df_mov_todos['id_movimiento'] == id_mov_editar, 'precio_reencauche'] = nuevo_precio_reenc
+                            df_mov_todos.loc[df_mov_todos['id_movimiento'] == id_mov_editar, 'observaciones'] = nuevas_obs
+                            escribir_hoja(SHEET_MOVIMIENTOS, df_mov_todos)
+                            st.success("✅ Movimiento actualizado con éxito")
+                            st.rerun()
 
-                with col_btn2:
-                    if st.button("🗑️ Eliminar Movimiento", key="eliminar_movimiento"):
-                        df_mov_todos = leer_hoja(SHEET_MOVIMIENTOS)
-                        df_mov_todos = df_mov_todos[df_mov_todos['id_movimiento'] != id_mov_editar]
-                        escribir_hoja(SHEET_MOVIMIENTOS, df_mov_todos)
-                        st.success("✅ Movimiento eliminado con éxito")
-                        st.rerun()
+                    with col_btn2:
+                        if st.button("🗑️ Eliminar Movimiento", key="eliminar_movimiento"):
+                            df_mov_todos = leer_hoja(SHEET_MOVIMIENTOS)
+                            df_mov_todos = df_mov_todos[df_mov_todos['id_movimiento'] != id_mov_editar]
+                            escribir_hoja(SHEET_MOVIMIENTOS, df_mov_todos)
+                            st.success("✅ Movimiento eliminado con éxito")
+                            st.rerun()
 
-                # Mostrar información de referencia
-                st.divider()
-                st.caption(f"ID Llanta: {movimiento.get('id_llanta', 'N/A')} | Fecha: {movimiento.get('fecha', 'N/A')} | Usuario: {movimiento.get('usuario', 'N/A')}")
+                    # Mostrar información de referencia
+                    st.divider()
+                    st.caption(f"ID Llanta: {movimiento.get('id_llanta', 'N/A')} | Fecha: {movimiento.get('fecha', 'N/A')} | Usuario: {movimiento.get('usuario', 'N/A')}")
             else:
                 st.info("No tienes movimientos accesibles")
         else:
@@ -1198,6 +3457,7 @@ def ver_llantas_disponibles():
     st.image("https://elchorroco.wordpress.com/wp-content/uploads/2025/10/megallanta-logo.png", width=200)
     st.header("🔍 Estado de Llantas")
     
+    precargar_hojas([SHEET_LLANTAS, SHEET_CLIENTES, SHEET_SERVICIOS, SHEET_VEHICULOS, SHEET_MOVIMIENTOS])
     df_llantas = leer_hoja(SHEET_LLANTAS)
     
     if df_llantas.empty:
@@ -1363,61 +3623,81 @@ def ver_llantas_disponibles():
                 elif len(llantas_seleccionadas) == 0:
                     st.error("⚠️ Debes seleccionar al menos una llanta")
                 else:
-                    df_todos = leer_hoja(SHEET_LLANTAS)
-                    aprobadas = 0
-
-                    for id_llanta in llantas_seleccionadas:
-                        llanta_row = llantas_reencauche[llantas_reencauche['id_llanta'] == id_llanta].iloc[0]
-                        # Usar vida_actual o vida según la columna disponible
-                        vida_col = 'vida_actual' if 'vida_actual' in llanta_row.index else 'vida'
-                        vida_actual = int(llanta_row[vida_col]) if pd.notna(llanta_row.get(vida_col)) else 1
-                        vida_nueva = vida_actual + 1
-
-                        # Guardar marca y referencia del reencauche
-                        marca_ref_reencauche = f"{marca_reencauche} - {referencia_reencauche}"
-                        if vida_nueva == 2:
-                            df_todos.loc[df_todos['id_llanta'] == id_llanta, 'reencauche1'] = marca_ref_reencauche
-                            df_todos.loc[df_todos['id_llanta'] == id_llanta, 'precio_vida2'] = precio_reencauche
-                        elif vida_nueva == 3:
-                            df_todos.loc[df_todos['id_llanta'] == id_llanta, 'reencauche2'] = marca_ref_reencauche
-                            df_todos.loc[df_todos['id_llanta'] == id_llanta, 'precio_vida3'] = precio_reencauche
-                        elif vida_nueva == 4:
-                            df_todos.loc[df_todos['id_llanta'] == id_llanta, 'reencauche3'] = marca_ref_reencauche
-                            df_todos.loc[df_todos['id_llanta'] == id_llanta, 'precio_vida4'] = precio_reencauche
-
-                        df_todos.loc[df_todos['id_llanta'] == id_llanta, 'vida_actual'] = vida_nueva
-                        df_todos.loc[df_todos['id_llanta'] == id_llanta, 'estado_reencauche'] = 'aprobado'
-                        df_todos.loc[df_todos['id_llanta'] == id_llanta, 'disponibilidad'] = 'recambio'
-                        df_todos.loc[df_todos['id_llanta'] == id_llanta, 'fecha_modificacion'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-                        # Crear movimiento de aprobación de reencauche
-                        crear_movimiento(
-                            id_llanta=id_llanta,
-                            tipo='aprobacion_reencauche',
-                            vida=vida_nueva,
-                            marca_reencauche=marca_reencauche,
-                            ref_reencauche=referencia_reencauche,
-                            precio_reencauche=precio_reencauche
-                        )
-                        aprobadas += 1
-
-                    escribir_hoja(SHEET_LLANTAS, df_todos)
-                    st.success(f"✅ {aprobadas} llantas aprobadas - Marca: {marca_reencauche}, Ref: {referencia_reencauche}, Precio: ${precio_reencauche:,.0f}")
-                    st.rerun()
+                    with UnidadDeTrabajo() as unidad:
+                        df_todos = leer_hoja(SHEET_LLANTAS)
+                        aprobadas = 0
+
+                        # IDs de los movimientos de aprobación: un bloque por cliente en lugar de uno por llanta
+                        llantas_por_cliente = {}
+                        for id_llanta in llantas_seleccionadas:
+                            nit_llanta = fila_por_clave(llantas_reencauche, 'id_llanta', id_llanta)['nit_cliente']
+                            if nit_llanta:
+                                llantas_por_cliente.setdefault(nit_llanta, []).append(id_llanta)
+                        ids_movimiento = {}
+                        for nit_llanta, llantas_cliente in llantas_por_cliente.items():
+                            ids_movimiento.update(zip(llantas_cliente, generar_ids_movimiento(nit_llanta, len(llantas_cliente))))
+
+                        for id_llanta in llantas_seleccionadas:
+                            llanta_row = fila_por_clave(llantas_reencauche, 'id_llanta', id_llanta)
+                            # Usar vida_actual o vida según la columna disponible
+                            vida_col = 'vida_actual' if 'vida_actual' in llanta_row.index else 'vida'
+                            vida_actual = int(llanta_row[vida_col]) if pd.notna(llanta_row.get(vida_col)) else 1
+                            vida_nueva = vida_actual + 1
+
+                            # Guardar marca y referencia del reencauche
+                            marca_ref_reencauche = f"{marca_reencauche} - {referencia_reencauche}"
+                            if vida_nueva == 2:
+                                df_todos.loc[df_todos['id_llanta'] == id_llanta, 'reencauche1'] = marca_ref_reencauche
+                                df_todos.loc[df_todos['id_llanta'] == id_llanta, 'precio_vida2'] = precio_reencauche
+                            elif vida_nueva == 3:
+                                df_todos.loc[df_todos['id_llanta'] == id_llanta, 'reencauche2'] = marca_ref_reencauche
+                                df_todos.loc[df_todos['id_llanta'] == id_llanta, 'precio_vida3'] = precio_reencauche
+                            elif vida_nueva == 4:
+                                df_todos.loc[df_todos['id_llanta'] == id_llanta, 'reencauche3'] = marca_ref_reencauche
+                                df_todos.loc[df_todos['id_llanta'] == id_llanta, 'precio_vida4'] = precio_reencauche
+
+                            df_todos.loc[df_todos['id_llanta'] == id_llanta, 'vida_actual'] = vida_nueva
+                            df_todos.loc[df_todos['id_llanta'] == id_llanta, 'estado_reencauche'] = 'aprobado'
+                            df_todos.loc[df_todos['id_llanta'] == id_llanta, 'disponibilidad'] = 'recambio'
+                            df_todos.loc[df_todos['id_llanta'] == id_llanta, 'fecha_modificacion'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+                            # Crear movimiento de aprobación de reencauche
+                            crear_movimiento(
+                                id_movimiento=ids_movimiento.get(id_llanta),
+                                id_llanta=id_llanta,
+                                tipo='aprobacion_reencauche',
+                                vida=vida_nueva,
+                                marca_reencauche=marca_reencauche,
+                                ref_reencauche=referencia_reencauche,
+                                precio_reencauche=precio_reencauche
+                            )
+                            aprobadas += 1
+
+                        escribir_hoja(SHEET_LLANTAS, df_todos)
+                    if unidad.confirmada:
+                        st.success(f"✅ {aprobadas} llantas aprobadas - Marca: {marca_reencauche}, Ref: {referencia_reencauche}, Precio: ${precio_reencauche:,.0f}")
+                        st.rerun()
         else:
             st.info("✨ No hay llantas pendientes de aprobación de reencauche")
     
     with tab3:
         st.subheader("💰 Análisis de Costos por Kilómetro")
-        
+
+        # Recalcular todas las llantas accesibles con una sola lectura y una sola escritura
+        if st.button(f"🔄 Recalcular Costos/km de todas las llantas ({len(df_llantas)})", key="recalcular_costos_todas"):
+            recalculadas = recalcular_costos_km(df_llantas['id_llanta'].tolist())
+            if recalculadas is not None:
+                st.success(f"✅ Costos recalculados para {recalculadas} llantas")
+                st.rerun()
+
         # Seleccionar llanta para análisis
         id_llanta_analisis = st.selectbox(
             "Seleccionar Llanta",
             options=df_llantas['id_llanta'].values,
-            format_func=lambda x: f"ID {x} - {df_llantas[df_llantas['id_llanta']==x]['marca_llanta'].values[0]}"
+            format_func=lambda x: f"ID {x} - {fila_por_clave(df_llantas, 'id_llanta', x)['marca_llanta']}"
         )
         
-        llanta_sel = df_llantas[df_llantas['id_llanta'] == id_llanta_analisis].iloc[0]
+        llanta_sel = fila_por_clave(df_llantas, 'id_llanta', id_llanta_analisis)
         vida_val = llanta_sel.get('vida_actual', llanta_sel.get('vida', 1))
         vida_actual = int(vida_val) if pd.notna(vida_val) else 1
 
@@ -1530,8 +3810,8 @@ def crear_cliente():
                 st.error("Debes ingresar todos los nombres de frentes")
             else:
                 st.session_state['guardando_cliente'] = True
-                # Leer datos frescos SIN caché para verificar duplicados
-                df_clientes = leer_hoja_fresco(SHEET_CLIENTES)
+                # La caché se actualiza en cada escritura: ya trae los últimos datos para verificar duplicados
+                df_clientes = leer_hoja(SHEET_CLIENTES)
 
                 # Verificar si el NIT ya existe
                 if existe_valor(df_clientes, 'nit', nit):
@@ -1604,7 +3884,7 @@ def crear_vehiculos():
             cliente_seleccionado = st.selectbox(
                 "Cliente",
                 options=df_clientes['nit'].values if not df_clientes.empty and 'nit' in df_clientes.columns else [],
-                format_func=lambda x: f"{df_clientes[df_clientes['nit']==x]['nombre_cliente'].values[0]} - {x}" if not df_clientes.empty else str(x)
+                format_func=lambda x: f"{fila_por_clave(df_clientes, 'nit', x)['nombre_cliente']} - {x}" if not df_clientes.empty else str(x)
             )
 
             # ID del usuario (opcional) - el sistema generará un ID único
@@ -1619,7 +3899,7 @@ def crear_vehiculos():
             placa_vehiculo = st.text_input("Placa del Vehículo").upper()
         
         with col3:
-            frentes_cliente = json.loads(df_clientes[df_clientes['nit']==cliente_seleccionado]['frentes'].values[0])
+            frentes_cliente = json.loads(fila_por_clave(df_clientes, 'nit', cliente_seleccionado)['frentes'])
             if frentes_cliente:
                 frente = st.selectbox("Frente", options=frentes_cliente)
             else:
@@ -1634,8 +3914,8 @@ def crear_vehiculos():
             if not placa_vehiculo or not marca or not linea:
                 st.error("Debes completar todos los campos obligatorios")
             else:
-                # Leer datos frescos SIN caché para verificar duplicados
-                df_vehiculos = leer_hoja_fresco(SHEET_VEHICULOS)
+                # La caché se actualiza en cada escritura: ya trae los últimos datos para verificar duplicados
+                df_vehiculos = leer_hoja(SHEET_VEHICULOS)
 
                 if existe_valor(df_vehiculos, 'placa_vehiculo', placa_vehiculo):
                     st.error("Esta placa ya está registrada")
@@ -1706,8 +3986,8 @@ def crear_llantas():
         with col1:
             def format_cliente(x):
                 try:
-                    nombre = df_clientes[df_clientes['nit']==x]['nombre_cliente'].values
-                    return nombre[0] if len(nombre) > 0 else f"NIT: {x}"
+                    cliente = fila_por_clave(df_clientes, 'nit', x)
+                    return cliente['nombre_cliente'] if cliente is not None else f"NIT: {x}"
                 except:
                     return f"NIT: {x}"
 
@@ -1749,8 +4029,8 @@ def crear_llantas():
             if not dimension or not referencia or not marca_llanta:
                 st.error("Debes completar todos los campos")
             else:
-                # Leer datos frescos SIN caché para verificar duplicados
-                df_llantas = leer_hoja_fresco(SHEET_LLANTAS)
+                # La caché se actualiza en cada escritura: ya trae los últimos datos para verificar duplicados
+                df_llantas = leer_hoja(SHEET_LLANTAS)
 
                 # Obtener el frente (puede venir de selectbox o text_input)
                 frente_final = frente_llanta if 'frente_llanta' in dir() else "General"
@@ -1858,7 +4138,7 @@ def montaje_llantas(embedded=False):
         placa_vehiculo = st.selectbox(
             "1️⃣ Seleccionar Vehículo",
             options=df_vehiculos['placa_vehiculo'].values,
-            format_func=lambda x: f"{x} - {df_vehiculos[df_vehiculos['placa_vehiculo']==x]['marca'].values[0] if 'marca' in df_vehiculos.columns else ''}"
+            format_func=lambda x: f"{x} - {fila_por_clave(df_vehiculos, 'placa_vehiculo', x)['marca'] if 'marca' in df_vehiculos.columns else ''}"
         )
 
     # Obtener el nit_cliente y kilometraje del vehículo seleccionado
@@ -1878,10 +4158,15 @@ def montaje_llantas(embedded=False):
             st.warning(f"⚠️ No hay llantas disponibles para este cliente")
             id_llanta = None
         else:
+            def format_llanta(x):
+                llanta = fila_por_clave(llantas_disponibles, 'id_llanta', x)
+                vida = int(llanta['vida_actual']) if 'vida_actual' in llanta.index and pd.notna(llanta['vida_actual']) else 1
+                return f"ID {x} - {llanta['marca_llanta']} {llanta['dimension']} (Vida {vida})"
+
             id_llanta = st.selectbox(
                 "2️⃣ Seleccionar Llanta",
                 options=llantas_disponibles['id_llanta'].values,
-                format_func=lambda x: f"ID {x} - {llantas_disponibles[llantas_disponibles['id_llanta']==x]['marca_llanta'].values[0]} {llantas_disponibles[llantas_disponibles['id_llanta']==x]['dimension'].values[0]} (Vida {int(llantas_disponibles[llantas_disponibles['id_llanta']==x]['vida_actual'].values[0]) if 'vida_actual' in llantas_disponibles.columns and pd.notna(llantas_disponibles[llantas_disponibles['id_llanta']==x]['vida_actual'].values[0]) else 1})"
+                format_func=format_llanta
             )
 
     # Verificar posiciones ocupadas en el vehículo seleccionado
@@ -1949,88 +4234,88 @@ def montaje_llantas(embedded=False):
         elif kilometraje <= 0:
             st.error("Debes ingresar el kilometraje actual del vehículo")
         else:
-            df_llantas = leer_hoja(SHEET_LLANTAS)
+            with UnidadDeTrabajo() as unidad:
+                df_llantas = leer_hoja(SHEET_LLANTAS)
 
-            # Obtener vida actual de la llanta
-            vida_actual = df_llantas.loc[df_llantas['id_llanta'] == id_llanta, 'vida_actual'].values[0] if 'vida_actual' in df_llantas.columns else 1
-            vida_actual = int(vida_actual) if pd.notna(vida_actual) else 1
+                # Obtener vida actual de la llanta
+                vida_actual = fila_por_clave(df_llantas, 'id_llanta', id_llanta)['vida_actual'] if 'vida_actual' in df_llantas.columns else 1
+                vida_actual = int(vida_actual) if pd.notna(vida_actual) else 1
 
-            # Actualizar datos en hoja llantas (nuevos nombres de columnas)
-            df_llantas.loc[df_llantas['id_llanta'] == id_llanta, 'disponibilidad'] = 'al_piso'
-            df_llantas.loc[df_llantas['id_llanta'] == id_llanta, 'placa_actual'] = placa_vehiculo
-            df_llantas.loc[df_llantas['id_llanta'] == id_llanta, 'posicion_actual'] = posicion
-            df_llantas.loc[df_llantas['id_llanta'] == id_llanta, 'estado_reencauche'] = ''
-            df_llantas.loc[df_llantas['id_llanta'] == id_llanta, 'km_ultimo_montaje'] = kilometraje
-            df_llantas.loc[df_llantas['id_llanta'] == id_llanta, 'fecha_modificacion'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                # Actualizar datos en hoja llantas (nuevos nombres de columnas)
+                df_llantas.loc[df_llantas['id_llanta'] == id_llanta, 'disponibilidad'] = 'al_piso'
+                df_llantas.loc[df_llantas['id_llanta'] == id_llanta, 'placa_actual'] = placa_vehiculo
+                df_llantas.loc[df_llantas['id_llanta'] == id_llanta, 'posicion_actual'] = posicion
+                df_llantas.loc[df_llantas['id_llanta'] == id_llanta, 'estado_reencauche'] = ''
+                df_llantas.loc[df_llantas['id_llanta'] == id_llanta, 'km_ultimo_montaje'] = kilometraje
+                df_llantas.loc[df_llantas['id_llanta'] == id_llanta, 'fecha_modificacion'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-            escribir_hoja(SHEET_LLANTAS, df_llantas)
+                escribir_hoja(SHEET_LLANTAS, df_llantas)
 
-            # Crear movimiento de montaje
-            crear_movimiento(
-                id_llanta=id_llanta,
-                tipo='montaje',
-                vida=vida_actual,
-                placa_vehiculo=placa_vehiculo,
-                posicion=posicion,
-                kilometraje=kilometraje,
-                orden_trabajo=orden_trabajo,
-                planilla=planilla,
-                operario=operario
-            )
+                # Crear movimiento de montaje
+                crear_movimiento(
+                    id_llanta=id_llanta,
+                    tipo='montaje',
+                    vida=vida_actual,
+                    placa_vehiculo=placa_vehiculo,
+                    posicion=posicion,
+                    kilometraje=kilometraje,
+                    orden_trabajo=orden_trabajo,
+                    planilla=planilla,
+                    operario=operario
+                )
 
-            # Crear registro en servicios para el montaje
-            df_servicios = leer_hoja(SHEET_SERVICIOS)
-            df_vehiculos_srv = leer_hoja(SHEET_VEHICULOS)
+                # Crear registro en servicios para el montaje
+                df_vehiculos_srv = leer_hoja(SHEET_VEHICULOS)
 
-            # Obtener datos del vehículo
-            vehiculo_data = df_vehiculos_srv[df_vehiculos_srv['placa_vehiculo'] == placa_vehiculo].iloc[0]
-            frente = vehiculo_data.get('frente', 'General')
-            tipologia = vehiculo_data.get('tipologia', '')
+                # Obtener datos del vehículo
+                vehiculo_data = fila_por_clave(df_vehiculos_srv, 'placa_vehiculo', placa_vehiculo)
+                frente = vehiculo_data.get('frente', 'General')
+                tipologia = vehiculo_data.get('tipologia', '')
 
-            # Obtener datos de la llanta
-            llanta_data = df_llantas[df_llantas['id_llanta'] == id_llanta].iloc[0]
-            disponibilidad_anterior = llanta_data.get('disponibilidad', 'llanta_nueva')
+                # Obtener datos de la llanta
+                llanta_data = fila_por_clave(df_llantas, 'id_llanta', id_llanta)
+                disponibilidad_anterior = llanta_data.get('disponibilidad', 'llanta_nueva')
 
-            # Generar ID de servicio
-            id_servicio = generar_id_servicio(nit_cliente_vehiculo)
+                # Generar ID de servicio
+                id_servicio = generar_id_servicio(nit_cliente_vehiculo)
 
-            nuevo_servicio = pd.DataFrame([{
-                'id_servicio': id_servicio,
-                'orden_trabajo': orden_trabajo,
-                'planilla': planilla,
-                'fecha': datetime.now().strftime("%d/%m/%Y"),
-                'id_llanta': id_llanta,
-                'placa_vehiculo': placa_vehiculo,
-                'posicion': posicion,
-                'vida': vida_actual,
-                'tipologia': tipologia,
-                'tipo_servicio': 'montaje',
-                'disponibilidad': 'al_piso',
-                'kilometraje': kilometraje,
-                'rotacion': 'No',
-                'posicion_nueva': '',
-                'profundidad_1': 0,
-                'profundidad_2': 0,
-                'profundidad_3': 0,
-                'balanceo': 'No',
-                'reparacion': 'No',
-                'despinche': 'No',
-                'regrabacion': 'No',
-                'torqueo': 'No',
-                'inspeccion': 'No',
-                'insumos': '',
-                'comentario_fvu': '',
-                'operario': operario,
-                'usuario_registro': st.session_state['usuario'],
-                'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            }])
+                nuevo_servicio = pd.DataFrame([{
+                    'id_servicio': id_servicio,
+                    'orden_trabajo': orden_trabajo,
+                    'planilla': planilla,
+                    'fecha': datetime.now().strftime("%d/%m/%Y"),
+                    'id_llanta': id_llanta,
+                    'placa_vehiculo': placa_vehiculo,
+                    'posicion': posicion,
+                    'vida': vida_actual,
+                    'tipologia': tipologia,
+                    'tipo_servicio': 'montaje',
+                    'disponibilidad': 'al_piso',
+                    'kilometraje': kilometraje,
+                    'rotacion': 'No',
+                    'posicion_nueva': '',
+                    'profundidad_1': 0,
+                    'profundidad_2': 0,
+                    'profundidad_3': 0,
+                    'balanceo': 'No',
+                    'reparacion': 'No',
+                    'despinche': 'No',
+                    'regrabacion': 'No',
+                    'torqueo': 'No',
+                    'inspeccion': 'No',
+                    'insumos': '',
+                    'comentario_fvu': '',
+                    'operario': operario,
+                    'usuario_registro': st.session_state['usuario'],
+                    'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                }])
 
-            df_servicios = pd.concat([df_servicios, nuevo_servicio], ignore_index=True)
-            escribir_hoja(SHEET_SERVICIOS, df_servicios)
+                agregar_filas(SHEET_SERVICIOS, nuevo_servicio)
 
-            st.success(f"✅ Llanta ID {id_llanta} montada en vehículo {placa_vehiculo} - Posición: {posicion} - Km: {kilometraje:,}")
-            st.info(f"📋 Servicio de montaje registrado: {id_servicio}")
-            st.rerun()
+            if unidad.confirmada:
+                st.success(f"✅ Llanta ID {id_llanta} montada en vehículo {placa_vehiculo} - Posición: {posicion} - Km: {kilometraje:,}")
+                st.info(f"📋 Servicio de montaje registrado: {id_servicio}")
+                st.rerun()
 
 def registrar_servicios(embedded=False):
     """Función para registrar servicios de mantenimiento"""
@@ -2079,172 +4364,171 @@ def registrar_servicios(embedded=False):
     with col1:
         # 5.1 - Mostrar profundidad y km sobre la casilla de selección
         df_servicios_hist = leer_hoja(SHEET_SERVICIOS)
-        llanta_opciones = llantas_en_piso['id_llanta'].values
-
-        id_llanta = st.selectbox(
-            "ID Llanta",
-            options=llanta_opciones,
-            format_func=lambda x: f"ID {x} - Placa: {llantas_en_piso[llantas_en_piso['id_llanta']==x][placa_col].values[0] if placa_col in llantas_en_piso.columns else 'N/A'}",
-            key="srv_id_llanta"
+        id_llanta = selector_paginado(
+            "ID Llanta", llantas_en_piso, 'id_llanta',
+            key="srv_id_llanta",
+            columnas_busqueda=[placa_col],
+            format_func=lambda x: f"ID {x} - Placa: {fila_por_clave(llantas_en_piso, 'id_llanta', x)[placa_col] if placa_col in llantas_en_piso.columns else 'N/A'}"
         )
 
         fecha_servicio = st.date_input("Fecha del Servicio", datetime.now(), key="srv_fecha")
         kilometraje = st.number_input("Kilometraje", min_value=0, value=0, key="srv_km")
 
-    # Mostrar info completa de la llanta seleccionada en recuadro azul
-    llanta_sel = llantas_en_piso[llantas_en_piso['id_llanta'] == id_llanta].iloc[0]
-    posicion_actual = llanta_sel.get('posicion_actual', llanta_sel.get('pos_final', ''))
-    vida_actual = int(llanta_sel.get('vida_actual', llanta_sel.get('vida', 1))) if pd.notna(llanta_sel.get('vida_actual', llanta_sel.get('vida', 1))) else 1
-    marca_ll = llanta_sel.get('marca_llanta', 'N/A')
-    ref_ll = llanta_sel.get('referencia', 'N/A')
-    dim_ll = llanta_sel.get('dimension', 'N/A')
-    disp_ll = llanta_sel.get('disponibilidad', 'N/A')
-
-    # Buscar último servicio para profundidades y km
-    info_ultimo = ""
-    if not df_servicios_hist.empty and 'id_llanta' in df_servicios_hist.columns:
-        servicios_llanta = df_servicios_hist[df_servicios_hist['id_llanta'] == id_llanta]
-        if not servicios_llanta.empty:
-            ultimo_servicio = servicios_llanta.iloc[-1]
-            ult_km = ultimo_servicio.get('kilometraje', 'N/A')
-            ult_p1 = ultimo_servicio.get('profundidad_1', 'N/A')
-            ult_p2 = ultimo_servicio.get('profundidad_2', 'N/A')
-            ult_p3 = ultimo_servicio.get('profundidad_3', 'N/A')
-            info_ultimo = f"  \nÚltimo servicio → Km: **{ult_km}** | Prof: Int:**{ult_p1}**mm · Cen:**{ult_p2}**mm · Ext:**{ult_p3}**mm"
+    if id_llanta is not None:
+        # Mostrar info completa de la llanta seleccionada en recuadro azul
+        llanta_sel = fila_por_clave(llantas_en_piso, 'id_llanta', id_llanta)
+        posicion_actual = llanta_sel.get('posicion_actual', llanta_sel.get('pos_final', ''))
+        vida_actual = int(llanta_sel.get('vida_actual', llanta_sel.get('vida', 1))) if pd.notna(llanta_sel.get('vida_actual', llanta_sel.get('vida', 1))) else 1
+        marca_ll = llanta_sel.get('marca_llanta', 'N/A')
+        ref_ll = llanta_sel.get('referencia', 'N/A')
+        dim_ll = llanta_sel.get('dimension', 'N/A')
+        disp_ll = llanta_sel.get('disponibilidad', 'N/A')
+
+        # Buscar último servicio para profundidades y km
+        info_ultimo = ""
+        if not df_servicios_hist.empty and 'id_llanta' in df_servicios_hist.columns:
+            servicios_llanta = df_servicios_hist[df_servicios_hist['id_llanta'] == id_llanta]
+            if not servicios_llanta.empty:
+                ultimo_servicio = servicios_llanta.iloc[-1]
+                ult_km = ultimo_servicio.get('kilometraje', 'N/A')
+                ult_p1 = ultimo_servicio.get('profundidad_1', 'N/A')
+                ult_p2 = ultimo_servicio.get('profundidad_2', 'N/A')
+                ult_p3 = ultimo_servicio.get('profundidad_3', 'N/A')
+                info_ultimo = f"  \nÚltimo servicio → Km: **{ult_km}** | Prof: Int:**{ult_p1}**mm · Cen:**{ult_p2}**mm · Ext:**{ult_p3}**mm"
+            else:
+                info_ultimo = "  \nSin servicios previos registrados"
         else:
             info_ultimo = "  \nSin servicios previos registrados"
-    else:
-        info_ultimo = "  \nSin servicios previos registrados"
 
-    st.info(
-        f"**Llanta:** {id_llanta} | **Marca:** {marca_ll} | **Ref:** {ref_ll} | **Dimensión:** {dim_ll}  \n"
-        f"**Posición:** {posicion_actual} | **Vida:** {vida_actual} | **Disponibilidad:** {disp_ll}"
-        f"{info_ultimo}"
-    )
+        st.info(
+            f"**Llanta:** {id_llanta} | **Marca:** {marca_ll} | **Ref:** {ref_ll} | **Dimensión:** {dim_ll}  \n"
+            f"**Posición:** {posicion_actual} | **Vida:** {vida_actual} | **Disponibilidad:** {disp_ll}"
+            f"{info_ultimo}"
+        )
 
-    with col2:
-        st.write("**Profundidades (mm)**")
-        profundidad_1 = st.number_input("Profundidad 1 (interna)", min_value=0.0, max_value=30.0, value=0.0, step=0.5, key="srv_prof1")
-        profundidad_2 = st.number_input("Profundidad 2 (centro)", min_value=0.0, max_value=30.0, value=0.0, step=0.5, key="srv_prof2")
-        profundidad_3 = st.number_input("Profundidad 3 (externa)", min_value=0.0, max_value=30.0, value=0.0, step=0.5, key="srv_prof3")
+        with col2:
+            st.write("**Profundidades (mm)**")
+            profundidad_1 = st.number_input("Profundidad 1 (interna)", min_value=0.0, max_value=30.0, value=0.0, step=0.5, key="srv_prof1")
+            profundidad_2 = st.number_input("Profundidad 2 (centro)", min_value=0.0, max_value=30.0, value=0.0, step=0.5, key="srv_prof2")
+            profundidad_3 = st.number_input("Profundidad 3 (externa)", min_value=0.0, max_value=30.0, value=0.0, step=0.5, key="srv_prof3")
 
-    with col3:
-        st.write("**Servicios Realizados**")
-        balanceo = st.checkbox("Balanceo", key="srv_balanceo")
-        reparacion = st.checkbox("Reparación", key="srv_reparacion")
-        despinche = st.checkbox("Despinche", key="srv_despinche")
-        regrabacion = st.checkbox("Regrabación", key="srv_regrabacion")
-        torqueo = st.checkbox("Torqueo", key="srv_torqueo")
-        inspeccion = st.checkbox("Inspección", key="srv_inspeccion")
-
-        # 5.2 - Casilla insumos cuando se marque balanceo o reparación
-        insumos = ""
-        if balanceo or reparacion:
-            insumos = st.text_input("📦 Insumos utilizados", placeholder="Ej: Parche, pegamento, plomos", key="srv_insumos")
-
-    # Obtener NIT del cliente de la llanta seleccionada para filtrar operarios
-    llanta_sel_temp = llantas_en_piso[llantas_en_piso['id_llanta'] == id_llanta].iloc[0]
-    nit_cliente_temp = llanta_sel_temp['nit_cliente']
-    operarios_disponibles = obtener_operarios_cliente(nit_cliente_temp)
-
-    # Selector de operario
-    st.divider()
-    if operarios_disponibles:
-        operario = st.selectbox("👷 Operario", options=operarios_disponibles, key="srv_operario")
-    else:
-        operario = st.text_input("👷 Operario", placeholder="No hay operarios asignados a este cliente", key="srv_operario_txt")
+        with col3:
+            st.write("**Servicios Realizados**")
+            balanceo = st.checkbox("Balanceo", key="srv_balanceo")
+            reparacion = st.checkbox("Reparación", key="srv_reparacion")
+            despinche = st.checkbox("Despinche", key="srv_despinche")
+            regrabacion = st.checkbox("Regrabación", key="srv_regrabacion")
+            torqueo = st.checkbox("Torqueo", key="srv_torqueo")
+            inspeccion = st.checkbox("Inspección", key="srv_inspeccion")
+
+            # 5.2 - Casilla insumos cuando se marque balanceo o reparación
+            insumos = ""
+            if balanceo or reparacion:
+                insumos = st.text_input("📦 Insumos utilizados", placeholder="Ej: Parche, pegamento, plomos", key="srv_insumos")
+
+        # Obtener NIT del cliente de la llanta seleccionada para filtrar operarios
+        llanta_sel_temp = fila_por_clave(llantas_en_piso, 'id_llanta', id_llanta)
+        nit_cliente_temp = llanta_sel_temp['nit_cliente']
+        operarios_disponibles = obtener_operarios_cliente(nit_cliente_temp)
+
+        # Selector de operario
+        st.divider()
+        if operarios_disponibles:
+            operario = st.selectbox("👷 Operario", options=operarios_disponibles, key="srv_operario")
+        else:
+            operario = st.text_input("👷 Operario", placeholder="No hay operarios asignados a este cliente", key="srv_operario_txt")
 
-    if st.button("💾 Registrar Servicio", type="primary", key="srv_btn_registrar"):
-        df_servicios = leer_hoja(SHEET_SERVICIOS)
-        df_llantas = leer_hoja(SHEET_LLANTAS)
-        df_vehiculos = leer_hoja(SHEET_VEHICULOS)
+        if st.button("💾 Registrar Servicio", type="primary", key="srv_btn_registrar"):
+            df_llantas = leer_hoja(SHEET_LLANTAS)
+            df_vehiculos = leer_hoja(SHEET_VEHICULOS)
+
+            llanta_data = df_llantas[df_llantas['id_llanta'] == id_llanta]
+            if llanta_data.empty:
+                st.error("No se encontró la llanta seleccionada")
+                st.stop()
+
+            llanta_data = llanta_data.iloc[0]
+            placa = llanta_data.get('placa_actual', llanta_data.get('placa_vehiculo', ''))
+            nit_cliente = llanta_data['nit_cliente']
+            posicion = llanta_data.get('posicion_actual', llanta_data.get('pos_final', ''))
+            vida = llanta_data.get('vida_actual', llanta_data.get('vida', 1))
+            disponibilidad = llanta_data.get('disponibilidad', '')
+
+            vehiculo_match = df_vehiculos[df_vehiculos['placa_vehiculo'] == placa]
+            if vehiculo_match.empty:
+                frente = 'General'
+                tipologia = ''
+            else:
+                vehiculo_data = vehiculo_match.iloc[0]
+                frente = vehiculo_data.get('frente', 'General')
+                tipologia = vehiculo_data.get('tipologia', '')
+
+            id_servicio = generar_id_servicio(nit_cliente)
+
+            # Determinar tipo de servicio principal
+            tipos_servicio = []
+            if balanceo: tipos_servicio.append('Balanceo')
+            if reparacion: tipos_servicio.append('Reparación')
+            if despinche: tipos_servicio.append('Despinche')
+            if regrabacion: tipos_servicio.append('Regrabación')
+            if torqueo: tipos_servicio.append('Torqueo')
+            if inspeccion: tipos_servicio.append('Inspección')
+            tipo_servicio = ', '.join(tipos_servicio) if tipos_servicio else 'Inspección'
 
-        llanta_data = df_llantas[df_llantas['id_llanta'] == id_llanta]
-        if llanta_data.empty:
-            st.error("No se encontró la llanta seleccionada")
-            st.stop()
-
-        llanta_data = llanta_data.iloc[0]
-        placa = llanta_data.get('placa_actual', llanta_data.get('placa_vehiculo', ''))
-        nit_cliente = llanta_data['nit_cliente']
-        posicion = llanta_data.get('posicion_actual', llanta_data.get('pos_final', ''))
-        vida = llanta_data.get('vida_actual', llanta_data.get('vida', 1))
-        disponibilidad = llanta_data.get('disponibilidad', '')
-
-        vehiculo_match = df_vehiculos[df_vehiculos['placa_vehiculo'] == placa]
-        if vehiculo_match.empty:
-            frente = 'General'
-            tipologia = ''
-        else:
-            vehiculo_data = vehiculo_match.iloc[0]
-            frente = vehiculo_data.get('frente', 'General')
-            tipologia = vehiculo_data.get('tipologia', '')
-
-        id_servicio = generar_id_servicio(nit_cliente)
-
-        # Determinar tipo de servicio principal
-        tipos_servicio = []
-        if balanceo: tipos_servicio.append('Balanceo')
-        if reparacion: tipos_servicio.append('Reparación')
-        if despinche: tipos_servicio.append('Despinche')
-        if regrabacion: tipos_servicio.append('Regrabación')
-        if torqueo: tipos_servicio.append('Torqueo')
-        if inspeccion: tipos_servicio.append('Inspección')
-        tipo_servicio = ', '.join(tipos_servicio) if tipos_servicio else 'Inspección'
-
-        nuevo_servicio = pd.DataFrame([{
-            'id_servicio': id_servicio,
-            'orden_trabajo': orden_trabajo,
-            'planilla': planilla,
-            'fecha': fecha_servicio.strftime("%d/%m/%Y"),
-            'id_llanta': id_llanta,
-            'placa_vehiculo': placa,
-            'posicion': posicion,
-            'vida': vida,
-            'tipologia': tipologia,
-            'tipo_servicio': tipo_servicio,
-            'disponibilidad': disponibilidad,
-            'kilometraje': kilometraje,
-            'rotacion': 'No',
-            'posicion_nueva': '',
-            'profundidad_1': profundidad_1,
-            'profundidad_2': profundidad_2,
-            'profundidad_3': profundidad_3,
-            'balanceo': 'Sí' if balanceo else 'No',
-            'reparacion': 'Sí' if reparacion else 'No',
-            'despinche': 'Sí' if despinche else 'No',
-            'regrabacion': 'Sí' if regrabacion else 'No',
-            'torqueo': 'Sí' if torqueo else 'No',
-            'inspeccion': 'Sí' if inspeccion else 'No',
-            'insumos': insumos,
-            'comentario_fvu': '',
-            'operario': operario,
-            'usuario_registro': st.session_state['usuario'],
-            'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        }])
+            nuevo_servicio = pd.DataFrame([{
+                'id_servicio': id_servicio,
+                'orden_trabajo': orden_trabajo,
+                'planilla': planilla,
+                'fecha': fecha_servicio.strftime("%d/%m/%Y"),
+                'id_llanta': id_llanta,
+                'placa_vehiculo': placa,
+                'posicion': posicion,
+                'vida': vida,
+                'tipologia': tipologia,
+                'tipo_servicio': tipo_servicio,
+                'disponibilidad': disponibilidad,
+                'kilometraje': kilometraje,
+                'rotacion': 'No',
+                'posicion_nueva': '',
+                'profundidad_1': profundidad_1,
+                'profundidad_2': profundidad_2,
+                'profundidad_3': profundidad_3,
+                'balanceo': 'Sí' if balanceo else 'No',
+                'reparacion': 'Sí' if reparacion else 'No',
+                'despinche': 'Sí' if despinche else 'No',
+                'regrabacion': 'Sí' if regrabacion else 'No',
+                'torqueo': 'Sí' if torqueo else 'No',
+                'inspeccion': 'Sí' if inspeccion else 'No',
+                'insumos': insumos,
+                'comentario_fvu': '',
+                'operario': operario,
+                'usuario_registro': st.session_state['usuario'],
+                'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            }])
 
-        df_servicios = pd.concat([df_servicios, nuevo_servicio], ignore_index=True)
-        escribir_hoja(SHEET_SERVICIOS, df_servicios)
+            with UnidadDeTrabajo() as unidad:
+                agregar_filas(SHEET_SERVICIOS, nuevo_servicio)
 
-        # Si hubo regrabación, incrementar contador en llantas
-        if regrabacion:
-            df_llantas_update = leer_hoja(SHEET_LLANTAS)
-            regrabaciones_actual = df_llantas_update.loc[df_llantas_update['id_llanta'] == id_llanta, 'total_regrabaciones'].values
-            regrabaciones_actual = int(regrabaciones_actual[0]) if len(regrabaciones_actual) > 0 and pd.notna(regrabaciones_actual[0]) else 0
-            df_llantas_update.loc[df_llantas_update['id_llanta'] == id_llanta, 'total_regrabaciones'] = regrabaciones_actual + 1
-            escribir_hoja(SHEET_LLANTAS, df_llantas_update)
+                # Si hubo regrabación, incrementar contador en llantas
+                if regrabacion:
+                    df_llantas_update = leer_hoja(SHEET_LLANTAS)
+                    regrabaciones_actual = df_llantas_update.loc[df_llantas_update['id_llanta'] == id_llanta, 'total_regrabaciones'].values
+                    regrabaciones_actual = int(regrabaciones_actual[0]) if len(regrabaciones_actual) > 0 and pd.notna(regrabaciones_actual[0]) else 0
+                    df_llantas_update.loc[df_llantas_update['id_llanta'] == id_llanta, 'total_regrabaciones'] = regrabaciones_actual + 1
+                    escribir_hoja(SHEET_LLANTAS, df_llantas_update)
 
-        # ACTUALIZAR COSTOS/KM AUTOMÁTICAMENTE
-        actualizar_costos_km_llanta(id_llanta)
+                # ACTUALIZAR COSTOS/KM AUTOMÁTICAMENTE
+                actualizar_costos_km_llanta(id_llanta)
 
-        st.success(f"✅ Servicio {id_servicio} registrado exitosamente para llanta ID {id_llanta}")
-        if regrabacion:
-            st.info(f"🔧 Regrabación registrada. Total regrabaciones: {regrabaciones_actual + 1}")
-        st.info("💡 Los costos/km se han actualizado automáticamente")
+            if unidad.confirmada:
+                st.success(f"✅ Servicio {id_servicio} registrado exitosamente para llanta ID {id_llanta}")
+                if regrabacion:
+                    st.info(f"🔧 Regrabación registrada. Total regrabaciones: {regrabaciones_actual + 1}")
+                st.info("💡 Los costos/km se han actualizado automáticamente")
 
-        st.session_state['servicio_completado'] = True
-        st.session_state['id_llanta_servicio'] = id_llanta
-        st.rerun()
+                st.session_state['servicio_completado'] = True
+                st.session_state['id_llanta_servicio'] = id_llanta
+                st.rerun()
 
     if st.session_state.get('servicio_completado', False):
         st.divider()
@@ -2269,7 +4553,13 @@ def registrar_servicios(embedded=False):
     # ============= 5.4 y 5.5: HISTORIAL DE SERVICIOS CON FILTROS =============
     st.divider()
     st.subheader("📋 Historial de Servicios")
-    df_servicios = leer_hoja(SHEET_SERVICIOS)
+    # El rango de fechas se elige antes de leer: solo se cargan las particiones de esos años
+    col_fecha_ini, col_fecha_fin = st.columns(2)
+    with col_fecha_ini:
+        filtro_fecha_ini = st.date_input("Fecha Inicial", value=(datetime.now() - pd.Timedelta(days=DIAS_HISTORIAL)).date(), key="hist_fecha_ini")
+    with col_fecha_fin:
+        filtro_fecha_fin = st.date_input("Fecha Final", value=None, key="hist_fecha_fin")
+    df_servicios = leer_historial(SHEET_SERVICIOS, filtro_fecha_ini, filtro_fecha_fin)
     df_llantas_hist = leer_hoja(SHEET_LLANTAS)
 
     if not df_servicios.empty:
@@ -2286,7 +4576,7 @@ def registrar_servicios(embedded=False):
         if not df_servicios_filtrado.empty:
             # 5.5 - FILTROS
             st.write("**Filtros:**")
-            col_f1, col_f2, col_f3, col_f4 = st.columns(4)
+            col_f1, col_f3, col_f4 = st.columns(3)
 
             with col_f1:
                 # Filtro Cliente
@@ -2304,11 +4594,6 @@ def registrar_servicios(embedded=False):
                     frentes_disponibles = ['Todos']
                 filtro_frente = st.selectbox("Frente", options=frentes_disponibles, key="hist_filtro_frente")
 
-            with col_f2:
-                # Filtro Fecha Inicial y Final
-                filtro_fecha_ini = st.date_input("Fecha Inicial", value=None, key="hist_fecha_ini")
-                filtro_fecha_fin = st.date_input("Fecha Final", value=None, key="hist_fecha_fin")
-
             with col_f3:
                 # Filtro Placa
                 placas_opciones = ['Todas'] + list(df_servicios_filtrado['placa_vehiculo'].unique())
@@ -2343,15 +4628,6 @@ def registrar_servicios(embedded=False):
                     placas_frente = df_vehiculos_hist[(df_vehiculos_hist['nit_cliente'] == nit_filtro) & (df_vehiculos_hist['frente'] == filtro_frente)]['placa_vehiculo'].values
                     df_resultado = df_resultado[df_resultado['placa_vehiculo'].isin(placas_frente)]
 
-            if filtro_fecha_ini and 'fecha' in df_resultado.columns:
-                df_resultado['fecha_dt'] = pd.to_datetime(df_resultado['fecha'], format='%d/%m/%Y', errors='coerce')
-                df_resultado = df_resultado[df_resultado['fecha_dt'] >= pd.Timestamp(filtro_fecha_ini)]
-
-            if filtro_fecha_fin and 'fecha' in df_resultado.columns:
-                if 'fecha_dt' not in df_resultado.columns:
-                    df_resultado['fecha_dt'] = pd.to_datetime(df_resultado['fecha'], format='%d/%m/%Y', errors='coerce')
-                df_resultado = df_resultado[df_resultado['fecha_dt'] <= pd.Timestamp(filtro_fecha_fin)]
-
             if filtro_placa != 'Todas':
                 df_resultado = df_resultado[df_resultado['placa_vehiculo'] == filtro_placa]
 
@@ -2364,10 +4640,6 @@ def registrar_servicios(embedded=False):
             if filtro_operario != 'Todos' and 'operario' in df_resultado.columns:
                 df_resultado = df_resultado[df_resultado['operario'] == filtro_operario]
 
-            # Eliminar columna temporal
-            if 'fecha_dt' in df_resultado.columns:
-                df_resultado = df_resultado.drop(columns=['fecha_dt'])
-
             # 5.4 - Enriquecer con datos de llantas (marca, referencia, dimensión)
             if not df_llantas_hist.empty:
                 cols_llanta = ['id_llanta']
@@ -2387,7 +4659,7 @@ def registrar_servicios(embedded=False):
         else:
             st.info("No hay servicios registrados para tus clientes")
     else:
-        st.info("No hay servicios registrados")
+        st.info("No hay servicios registrados en el período seleccionado")
 
 def desmontaje_llantas(embedded=False):
     """Función para desmontar llantas y cambiar disponibilidad"""
@@ -2429,11 +4701,11 @@ def desmontaje_llantas(embedded=False):
     with col1:
         # Usar placa_actual en lugar de placa_vehiculo
         placa_col = 'placa_actual' if 'placa_actual' in llantas_montadas.columns else 'placa_vehiculo'
-        id_llanta = st.selectbox(
-            "Seleccionar Llanta a Desmontar",
-            options=llantas_montadas['id_llanta'].values,
-            format_func=lambda x: f"ID {x} - Placa: {llantas_montadas[llantas_montadas['id_llanta']==x][placa_col].values[0] if placa_col in llantas_montadas.columns else 'N/A'}",
-            key="desm_id_llanta"
+        id_llanta = selector_paginado(
+            "Seleccionar Llanta a Desmontar", llantas_montadas, 'id_llanta',
+            key="desm_id_llanta",
+            columnas_busqueda=[placa_col],
+            format_func=lambda x: f"ID {x} - Placa: {fila_por_clave(llantas_montadas, 'id_llanta', x)[placa_col] if placa_col in llantas_montadas.columns else 'N/A'}"
         )
 
     with col2:
@@ -2443,8 +4715,11 @@ def desmontaje_llantas(embedded=False):
             key="desm_nueva_disp"
         )
 
+    if id_llanta is None:
+        return
+
     # Obtener datos de la llanta seleccionada
-    llanta_sel = llantas_montadas[llantas_montadas['id_llanta'] == id_llanta].iloc[0]
+    llanta_sel = fila_por_clave(llantas_montadas, 'id_llanta', id_llanta)
     posicion_actual = llanta_sel.get('posicion_actual', llanta_sel.get('pos_final', ''))
     placa_actual = llanta_sel.get('placa_actual', llanta_sel.get('placa_vehiculo', ''))
     vida_actual = int(llanta_sel.get('vida_actual', llanta_sel.get('vida', 1))) if pd.notna(llanta_sel.get('vida_actual', llanta_sel.get('vida', 1))) else 1
@@ -2475,105 +4750,105 @@ def desmontaje_llantas(embedded=False):
         elif nueva_disponibilidad == 'FVU' and not razon_fvu:
             st.error("Debes especificar la razón del desecho")
         else:
-            df_llantas = leer_hoja(SHEET_LLANTAS)
+            with UnidadDeTrabajo() as unidad:
+                df_llantas = leer_hoja(SHEET_LLANTAS)
 
-            # Calcular kilómetros recorridos y sumar a kilometros_totales
-            llanta_data = df_llantas[df_llantas['id_llanta'] == id_llanta].iloc[0]
-            km_ultimo_montaje = float(llanta_data.get('km_ultimo_montaje', 0)) if pd.notna(llanta_data.get('km_ultimo_montaje', 0)) else 0
-            kilometros_totales_actual = float(llanta_data.get('kilometros_totales', 0)) if pd.notna(llanta_data.get('kilometros_totales', 0)) else 0
-
-            # Calcular km recorridos en este período
-            km_recorridos = max(0, kilometraje - km_ultimo_montaje)
-            nuevo_total_km = kilometros_totales_actual + km_recorridos
-
-            # Limpiar placa y posición actuales
-            df_llantas.loc[df_llantas['id_llanta'] == id_llanta, 'placa_actual'] = ''
-            df_llantas.loc[df_llantas['id_llanta'] == id_llanta, 'posicion_actual'] = ''
-            df_llantas.loc[df_llantas['id_llanta'] == id_llanta, 'kilometros_totales'] = nuevo_total_km
-            df_llantas.loc[df_llantas['id_llanta'] == id_llanta, 'fecha_modificacion'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-            observaciones = ''
-            if nueva_disponibilidad == 'reencauche':
-                df_llantas.loc[df_llantas['id_llanta'] == id_llanta, 'disponibilidad'] = 'reencauche'
-                df_llantas.loc[df_llantas['id_llanta'] == id_llanta, 'estado_reencauche'] = 'condicionada_planta'
-                mensaje = f"✅ Llanta ID {id_llanta} desmontada. Estado: REENCAUCHE - Condicionada en planta"
-            elif nueva_disponibilidad == 'FVU':
-                df_llantas.loc[df_llantas['id_llanta'] == id_llanta, 'disponibilidad'] = 'FVU'
-                df_llantas.loc[df_llantas['id_llanta'] == id_llanta, 'estado_reencauche'] = ''
-                observaciones = f"FVU: {razon_fvu}"
-                mensaje = f"✅ Llanta ID {id_llanta} desmontada. Estado: FVU (Fuera de Uso)"
-            else:
-                df_llantas.loc[df_llantas['id_llanta'] == id_llanta, 'disponibilidad'] = 'recambio'
-                df_llantas.loc[df_llantas['id_llanta'] == id_llanta, 'estado_reencauche'] = ''
-                mensaje = f"✅ Llanta ID {id_llanta} desmontada. Estado: RECAMBIO (Disponible)"
+                # Calcular kilómetros recorridos y sumar a kilometros_totales
+                llanta_data = fila_por_clave(df_llantas, 'id_llanta', id_llanta)
+                km_ultimo_montaje = float(llanta_data.get('km_ultimo_montaje', 0)) if pd.notna(llanta_data.get('km_ultimo_montaje', 0)) else 0
+                kilometros_totales_actual = float(llanta_data.get('kilometros_totales', 0)) if pd.notna(llanta_data.get('kilometros_totales', 0)) else 0
+
+                # Calcular km recorridos en este período
+                km_recorridos = max(0, kilometraje - km_ultimo_montaje)
+                nuevo_total_km = kilometros_totales_actual + km_recorridos
+
+                # Limpiar placa y posición actuales
+                df_llantas.loc[df_llantas['id_llanta'] == id_llanta, 'placa_actual'] = ''
+                df_llantas.loc[df_llantas['id_llanta'] == id_llanta, 'posicion_actual'] = ''
+                df_llantas.loc[df_llantas['id_llanta'] == id_llanta, 'kilometros_totales'] = nuevo_total_km
+                df_llantas.loc[df_llantas['id_llanta'] == id_llanta, 'fecha_modificacion'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+                observaciones = ''
+                if nueva_disponibilidad == 'reencauche':
+                    df_llantas.loc[df_llantas['id_llanta'] == id_llanta, 'disponibilidad'] = 'reencauche'
+                    df_llantas.loc[df_llantas['id_llanta'] == id_llanta, 'estado_reencauche'] = 'condicionada_planta'
+                    mensaje = f"✅ Llanta ID {id_llanta} desmontada. Estado: REENCAUCHE - Condicionada en planta"
+                elif nueva_disponibilidad == 'FVU':
+                    df_llantas.loc[df_llantas['id_llanta'] == id_llanta, 'disponibilidad'] = 'FVU'
+                    df_llantas.loc[df_llantas['id_llanta'] == id_llanta, 'estado_reencauche'] = ''
+                    observaciones = f"FVU: {razon_fvu}"
+                    mensaje = f"✅ Llanta ID {id_llanta} desmontada. Estado: FVU (Fuera de Uso)"
+                else:
+                    df_llantas.loc[df_llantas['id_llanta'] == id_llanta, 'disponibilidad'] = 'recambio'
+                    df_llantas.loc[df_llantas['id_llanta'] == id_llanta, 'estado_reencauche'] = ''
+                    mensaje = f"✅ Llanta ID {id_llanta} desmontada. Estado: RECAMBIO (Disponible)"
 
-            escribir_hoja(SHEET_LLANTAS, df_llantas)
+                escribir_hoja(SHEET_LLANTAS, df_llantas)
 
-            # Crear movimiento de desmontaje
-            crear_movimiento(
-                id_llanta=id_llanta,
-                tipo='desmontaje',
-                vida=vida_actual,
-                placa_vehiculo=placa_actual,
-                posicion=posicion_actual,
-                kilometraje=kilometraje,
-                nueva_disponibilidad=nueva_disponibilidad,
-                observaciones=observaciones,
-                orden_trabajo=orden_trabajo,
-                planilla=planilla,
-                operario=operario
-            )
+                # Crear movimiento de desmontaje
+                crear_movimiento(
+                    id_llanta=id_llanta,
+                    tipo='desmontaje',
+                    vida=vida_actual,
+                    placa_vehiculo=placa_actual,
+                    posicion=posicion_actual,
+                    kilometraje=kilometraje,
+                    nueva_disponibilidad=nueva_disponibilidad,
+                    observaciones=observaciones,
+                    orden_trabajo=orden_trabajo,
+                    planilla=planilla,
+                    operario=operario
+                )
 
-            # Crear registro en servicios para el desmontaje
-            df_servicios = leer_hoja(SHEET_SERVICIOS)
-            df_vehiculos_srv = leer_hoja(SHEET_VEHICULOS)
+                # Crear registro en servicios para el desmontaje
+                df_vehiculos_srv = leer_hoja(SHEET_VEHICULOS)
 
-            # Obtener datos del vehículo
-            vehiculo_srv = df_vehiculos_srv[df_vehiculos_srv['placa_vehiculo'] == placa_actual]
-            frente = vehiculo_srv.iloc[0].get('frente', 'General') if not vehiculo_srv.empty else 'General'
-            tipologia = vehiculo_srv.iloc[0].get('tipologia', '') if not vehiculo_srv.empty else ''
+                # Obtener datos del vehículo
+                vehiculo_srv = df_vehiculos_srv[df_vehiculos_srv['placa_vehiculo'] == placa_actual]
+                frente = vehiculo_srv.iloc[0].get('frente', 'General') if not vehiculo_srv.empty else 'General'
+                tipologia = vehiculo_srv.iloc[0].get('tipologia', '') if not vehiculo_srv.empty else ''
 
-            # Generar ID de servicio
-            id_servicio = generar_id_servicio(nit_cliente_llanta)
+                # Generar ID de servicio
+                id_servicio = generar_id_servicio(nit_cliente_llanta)
 
-            nuevo_servicio = pd.DataFrame([{
-                'id_servicio': id_servicio,
-                'orden_trabajo': orden_trabajo,
-                'planilla': planilla,
-                'fecha': datetime.now().strftime("%d/%m/%Y"),
-                'id_llanta': id_llanta,
-                'placa_vehiculo': placa_actual,
-                'posicion': posicion_actual,
-                'vida': vida_actual,
-                'tipologia': tipologia,
-                'tipo_servicio': 'desmontaje',
-                'disponibilidad': nueva_disponibilidad,
-                'kilometraje': kilometraje,
-                'rotacion': 'No',
-                'posicion_nueva': '',
-                'profundidad_1': 0,
-                'profundidad_2': 0,
-                'profundidad_3': 0,
-                'balanceo': 'No',
-                'reparacion': 'No',
-                'despinche': 'No',
-                'regrabacion': 'No',
-                'torqueo': 'No',
-                'inspeccion': 'No',
-                'insumos': '',
-                'comentario_fvu': observaciones,
-                'operario': operario,
-                'usuario_registro': st.session_state['usuario'],
-                'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            }])
+                nuevo_servicio = pd.DataFrame([{
+                    'id_servicio': id_servicio,
+                    'orden_trabajo': orden_trabajo,
+                    'planilla': planilla,
+                    'fecha': datetime.now().strftime("%d/%m/%Y"),
+                    'id_llanta': id_llanta,
+                    'placa_vehiculo': placa_actual,
+                    'posicion': posicion_actual,
+                    'vida': vida_actual,
+                    'tipologia': tipologia,
+                    'tipo_servicio': 'desmontaje',
+                    'disponibilidad': nueva_disponibilidad,
+                    'kilometraje': kilometraje,
+                    'rotacion': 'No',
+                    'posicion_nueva': '',
+                    'profundidad_1': 0,
+                    'profundidad_2': 0,
+                    'profundidad_3': 0,
+                    'balanceo': 'No',
+                    'reparacion': 'No',
+                    'despinche': 'No',
+                    'regrabacion': 'No',
+                    'torqueo': 'No',
+                    'inspeccion': 'No',
+                    'insumos': '',
+                    'comentario_fvu': observaciones,
+                    'operario': operario,
+                    'usuario_registro': st.session_state['usuario'],
+                    'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                }])
 
-            df_servicios = pd.concat([df_servicios, nuevo_servicio], ignore_index=True)
-            escribir_hoja(SHEET_SERVICIOS, df_servicios)
+                agregar_filas(SHEET_SERVICIOS, nuevo_servicio)
 
-            st.success(mensaje)
-            st.info(f"📊 Km recorridos este período: **{km_recorridos:,.0f}** | Total acumulado: **{nuevo_total_km:,.0f}** km")
-            st.info(f"📋 Servicio de desmontaje registrado: {id_servicio}")
-            st.rerun()
+            if unidad.confirmada:
+                st.success(mensaje)
+                st.info(f"📊 Km recorridos este período: **{km_recorridos:,.0f}** | Total acumulado: **{nuevo_total_km:,.0f}** km")
+                st.info(f"📋 Servicio de desmontaje registrado: {id_servicio}")
+                st.rerun()
 
 # ============= FUNCIÓN: REGISTRAR ALINEACIÓN =============
 def registrar_alineacion(embedded=False):
@@ -2623,14 +4898,14 @@ def registrar_alineacion(embedded=False):
             placa_vehiculo = st.selectbox(
                 "Seleccionar Vehículo",
                 options=df_vehiculos['placa_vehiculo'].values,
-                format_func=lambda x: f"{x} - {df_vehiculos[df_vehiculos['placa_vehiculo']==x]['marca'].values[0]} {df_vehiculos[df_vehiculos['placa_vehiculo']==x]['linea'].values[0]}",
+                format_func=lambda x: f"{x} - {fila_por_clave(df_vehiculos, 'placa_vehiculo', x)['marca']} {fila_por_clave(df_vehiculos, 'placa_vehiculo', x)['linea']}",
                 key="alineacion_placa"
             )
 
             fecha_alineacion = st.date_input("Fecha del Servicio", value=datetime.now(), key="alineacion_fecha")
 
         # Información del vehículo seleccionado (recuadro azul)
-        vehiculo_info = df_vehiculos[df_vehiculos['placa_vehiculo'] == placa_vehiculo].iloc[0]
+        vehiculo_info = fila_por_clave(df_vehiculos, 'placa_vehiculo', placa_vehiculo)
         marca_alin = vehiculo_info.get('marca', '')
         linea_alin = vehiculo_info.get('linea', '')
         km_ini_alin = float(vehiculo_info.get('kilometraje_inicial', 0)) if pd.notna(vehiculo_info.get('kilometraje_inicial', 0)) else 0
@@ -2638,7 +4913,7 @@ def registrar_alineacion(embedded=False):
         st.info(f"🚛 Vehículo: **{placa_vehiculo}** | {marca_alin} {linea_alin} | Tipología: **{tipologia_alin}** | 📏 Km inicial: **{km_ini_alin:,.0f}**")
 
         with col2:
-            vehiculo_data = df_vehiculos[df_vehiculos['placa_vehiculo'] == placa_vehiculo].iloc[0]
+            vehiculo_data = fila_por_clave(df_vehiculos, 'placa_vehiculo', placa_vehiculo)
             km_inicial = float(vehiculo_data.get('kilometraje_inicial', 0)) if pd.notna(vehiculo_data.get('kilometraje_inicial', 0)) else 0
 
             kilometraje = st.number_input(
@@ -2661,8 +4936,6 @@ def registrar_alineacion(embedded=False):
             operario = st.text_input("👷 Operario", placeholder="No hay operarios asignados a este cliente", key="alineacion_operario_txt")
 
         if st.button("💾 Registrar Alineación", type="primary", key="btn_registrar_alineacion"):
-            df_alineaciones = leer_hoja(SHEET_ALINEACIONES)
-
             nit_cliente = vehiculo_data['nit_cliente']
 
             # Generar ID de alineación con formato id_cliente
@@ -2682,8 +4955,7 @@ def registrar_alineacion(embedded=False):
                 'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             }])
 
-            df_alineaciones = pd.concat([df_alineaciones, nueva_alineacion], ignore_index=True)
-            escribir_hoja(SHEET_ALINEACIONES, df_alineaciones)
+            agregar_filas(SHEET_ALINEACIONES, nueva_alineacion)
 
             st.success(f"✅ Alineación #{nuevo_id} registrada exitosamente para vehículo {placa_vehiculo}")
             st.balloons()
@@ -2751,12 +5023,12 @@ def rotacion_completa():
     placa_vehiculo = st.selectbox(
         "🚛 Seleccionar Vehículo",
         options=df_vehiculos_activos['placa_vehiculo'].values,
-        format_func=lambda x: f"{x} - {df_vehiculos_activos[df_vehiculos_activos['placa_vehiculo']==x]['marca'].values[0] if 'marca' in df_vehiculos_activos.columns else ''}",
+        format_func=lambda x: f"{x} - {fila_por_clave(df_vehiculos_activos, 'placa_vehiculo', x)['marca'] if 'marca' in df_vehiculos_activos.columns else ''}",
         key="rot_placa"
     )
 
     # Obtener datos del vehículo
-    vehiculo_data = df_vehiculos_activos[df_vehiculos_activos['placa_vehiculo'] == placa_vehiculo].iloc[0]
+    vehiculo_data = fila_por_clave(df_vehiculos_activos, 'placa_vehiculo', placa_vehiculo)
     nit_cliente = vehiculo_data['nit_cliente']
     marca_rot = vehiculo_data.get('marca', '')
     linea_rot = vehiculo_data.get('linea', '')
@@ -2852,90 +5124,94 @@ def rotacion_completa():
         if kilometraje <= 0:
             st.error("Debes ingresar el kilometraje actual del vehículo")
         else:
-            df_llantas_update = leer_hoja(SHEET_LLANTAS)
-            df_servicios = leer_hoja(SHEET_SERVICIOS)
-
-            frente = vehiculo_data.get('frente', 'General')
-            tipologia = vehiculo_data.get('tipologia', '')
-
-            llantas_rotadas = []
-            for id_ll, nueva_pos in nuevas_posiciones.items():
-                pos_anterior = posiciones_actuales[id_ll]
-                if nueva_pos != pos_anterior:
-                    # Actualizar posición en tabla de llantas
-                    df_llantas_update.loc[df_llantas_update['id_llanta'].astype(str) == id_ll, 'posicion_actual'] = nueva_pos
-                    df_llantas_update.loc[df_llantas_update['id_llanta'].astype(str) == id_ll, 'fecha_modificacion'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    llantas_rotadas.append({
-                        'id_llanta': id_ll,
-                        'pos_anterior': pos_anterior,
-                        'pos_nueva': nueva_pos
-                    })
-
-            escribir_hoja(SHEET_LLANTAS, df_llantas_update)
-
-            # Crear un registro de servicio por cada llanta rotada
-            for ll_rot in llantas_rotadas:
-                id_servicio = generar_id_servicio(nit_cliente)
-
-                # Obtener vida actual
-                llanta_row = df_llantas_update[df_llantas_update['id_llanta'].astype(str) == ll_rot['id_llanta']]
-                vida = int(llanta_row['vida_actual'].values[0]) if not llanta_row.empty and 'vida_actual' in llanta_row.columns and pd.notna(llanta_row['vida_actual'].values[0]) else 1
-
-                nuevo_servicio = pd.DataFrame([{
-                    'id_servicio': id_servicio,
-                    'orden_trabajo': orden_trabajo,
-                    'planilla': planilla,
-                    'fecha': datetime.now().strftime("%d/%m/%Y"),
-                    'id_llanta': ll_rot['id_llanta'],
-                    'placa_vehiculo': placa_vehiculo,
-                    'posicion': ll_rot['pos_anterior'],
-                    'vida': vida,
-                    'tipologia': tipologia,
-                    'tipo_servicio': 'rotacion',
-                    'disponibilidad': 'al_piso',
-                    'kilometraje': kilometraje,
-                    'rotacion': 'Sí',
-                    'posicion_nueva': ll_rot['pos_nueva'],
-                    'profundidad_1': 0,
-                    'profundidad_2': 0,
-                    'profundidad_3': 0,
-                    'balanceo': 'No',
-                    'reparacion': 'No',
-                    'despinche': 'No',
-                    'regrabacion': 'No',
-                    'torqueo': 'No',
-                    'inspeccion': 'No',
-                    'insumos': '',
-                    'comentario_fvu': '',
-                    'operario': operario,
-                    'usuario_registro': st.session_state['usuario'],
-                    'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                }])
-
-                df_servicios = pd.concat([df_servicios, nuevo_servicio], ignore_index=True)
-
-            escribir_hoja(SHEET_SERVICIOS, df_servicios)
+            with UnidadDeTrabajo() as unidad:
+                df_llantas_update = leer_hoja(SHEET_LLANTAS)
+
+                frente = vehiculo_data.get('frente', 'General')
+                tipologia = vehiculo_data.get('tipologia', '')
+
+                llantas_rotadas = []
+                for id_ll, nueva_pos in nuevas_posiciones.items():
+                    pos_anterior = posiciones_actuales[id_ll]
+                    if nueva_pos != pos_anterior:
+                        # Actualizar posición en tabla de llantas
+                        df_llantas_update.loc[df_llantas_update['id_llanta'].astype(str) == id_ll, 'posicion_actual'] = nueva_pos
+                        df_llantas_update.loc[df_llantas_update['id_llanta'].astype(str) == id_ll, 'fecha_modificacion'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                        llantas_rotadas.append({
+                            'id_llanta': id_ll,
+                            'pos_anterior': pos_anterior,
+                            'pos_nueva': nueva_pos
+                        })
+
+                escribir_hoja(SHEET_LLANTAS, df_llantas_update)
+
+                # Crear un registro de servicio por cada llanta rotada (IDs reservados en un solo bloque)
+                servicios_rotacion = []
+                ids_servicio = generar_ids_servicio(nit_cliente, len(llantas_rotadas))
+                for ll_rot, id_servicio in zip(llantas_rotadas, ids_servicio):
+
+                    # Obtener vida actual
+                    llanta_row = df_llantas_update[df_llantas_update['id_llanta'].astype(str) == ll_rot['id_llanta']]
+                    vida = int(llanta_row['vida_actual'].values[0]) if not llanta_row.empty and 'vida_actual' in llanta_row.columns and pd.notna(llanta_row['vida_actual'].values[0]) else 1
+
+                    nuevo_servicio = pd.DataFrame([{
+                        'id_servicio': id_servicio,
+                        'orden_trabajo': orden_trabajo,
+                        'planilla': planilla,
+                        'fecha': datetime.now().strftime("%d/%m/%Y"),
+                        'id_llanta': ll_rot['id_llanta'],
+                        'placa_vehiculo': placa_vehiculo,
+                        'posicion': ll_rot['pos_anterior'],
+                        'vida': vida,
+                        'tipologia': tipologia,
+                        'tipo_servicio': 'rotacion',
+                        'disponibilidad': 'al_piso',
+                        'kilometraje': kilometraje,
+                        'rotacion': 'Sí',
+                        'posicion_nueva': ll_rot['pos_nueva'],
+                        'profundidad_1': 0,
+                        'profundidad_2': 0,
+                        'profundidad_3': 0,
+                        'balanceo': 'No',
+                        'reparacion': 'No',
+                        'despinche': 'No',
+                        'regrabacion': 'No',
+                        'torqueo': 'No',
+                        'inspeccion': 'No',
+                        'insumos': '',
+                        'comentario_fvu': '',
+                        'operario': operario,
+                        'usuario_registro': st.session_state['usuario'],
+                        'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    }])
 
-            # Crear movimientos de rotación
-            for ll_rot in llantas_rotadas:
-                crear_movimiento(
-                    id_llanta=ll_rot['id_llanta'],
-                    tipo='rotacion',
-                    vida=1,
-                    placa_vehiculo=placa_vehiculo,
-                    posicion=ll_rot['pos_nueva'],
-                    kilometraje=kilometraje,
-                    observaciones=f"Rotación: {ll_rot['pos_anterior']} → {ll_rot['pos_nueva']}",
-                    orden_trabajo=orden_trabajo,
-                    planilla=planilla,
-                    operario=operario
-                )
+                    servicios_rotacion.append(nuevo_servicio)
+
+                agregar_filas(SHEET_SERVICIOS, pd.concat(servicios_rotacion, ignore_index=True))
+
+                # Crear movimientos de rotación
+                ids_movimiento = generar_ids_movimiento(nit_cliente, len(llantas_rotadas))
+                for ll_rot, id_movimiento in zip(llantas_rotadas, ids_movimiento):
+                    crear_movimiento(
+                        id_movimiento=id_movimiento,
+                        id_llanta=ll_rot['id_llanta'],
+                        tipo='rotacion',
+                        vida=1,
+                        placa_vehiculo=placa_vehiculo,
+                        posicion=ll_rot['pos_nueva'],
+                        kilometraje=kilometraje,
+                        observaciones=f"Rotación: {ll_rot['pos_anterior']} → {ll_rot['pos_nueva']}",
+                        orden_trabajo=orden_trabajo,
+                        planilla=planilla,
+                        operario=operario
+                    )
 
-            resumen = " | ".join([f"{ll['id_llanta']}: {ll['pos_anterior']}→{ll['pos_nueva']}" for ll in llantas_rotadas])
-            st.success(f"✅ Rotación completada: {len(llantas_rotadas)} llanta(s) rotadas")
-            st.info(f"📋 {resumen}")
-            st.balloons()
-            st.rerun()
+            if unidad.confirmada:
+                resumen = " | ".join([f"{ll['id_llanta']}: {ll['pos_anterior']}→{ll['pos_nueva']}" for ll in llantas_rotadas])
+                st.success(f"✅ Rotación completada: {len(llantas_rotadas)} llanta(s) rotadas")
+                st.info(f"📋 {resumen}")
+                st.balloons()
+                st.rerun()
 
 
 # ============= FUNCIÓN: SERVICIOS INTEGRADOS (WRAPPER CON TABS) =============
@@ -2948,6 +5224,10 @@ def servicios_integrados():
     if not verificar_permiso(3):
         return
 
+    # Las cinco pestañas se dibujan en cada rerun y leen las mismas hojas
+    precargar_hojas([SHEET_LLANTAS, SHEET_VEHICULOS, SHEET_SERVICIOS, SHEET_CLIENTES,
+                     SHEET_USUARIOS, SHEET_MOVIMIENTOS, SHEET_ALINEACIONES])
+
     tab_srv, tab_montaje, tab_desmontaje, tab_alineacion, tab_rotacion = st.tabs([
         "🛠️ Registro de Servicio",
         "🔧 Montaje",
@@ -2972,44 +5252,140 @@ def servicios_integrados():
         rotacion_completa()
 
 
+# ============= EXPORTACIÓN DE DATOS =============
+# Los archivos de la pestaña Exportar Datos se generan solo cuando se pulsa su botón de descarga
+# (download_button con una función en data) y se escriben por bloques de filas a un archivo
+# temporal en disco, en lugar de armar el CSV completo como texto y luego como bytes en memoria.
+# CSV y CSV comprimido salen con el formato de texto de las hojas; Parquet conserva los tipos.
+EXPORTACION_FILAS_POR_BLOQUE = 20000
+# Formato → (extensión, tipo MIME)
+FORMATOS_EXPORTACION = {
+    'CSV': ('csv', 'text/csv'),
+    'CSV comprimido (gzip)': ('csv.gz', 'application/gzip'),
+    'Parquet': ('parquet', 'application/vnd.apache.parquet'),
+}
+# Pestañas del libro de Excel de exportar_libro: hoja → título de la pestaña
+HOJAS_LIBRO = {
+    SHEET_LLANTAS: 'Llantas',
+    SHEET_SERVICIOS: 'Servicios',
+    SHEET_MOVIMIENTOS: 'Movimientos',
+    SHEET_ALINEACIONES: 'Alineaciones',
+}
+
+def _bloques_exportacion(df):
+    """Bloques consecutivos de EXPORTACION_FILAS_POR_BLOQUE filas (al menos uno, aunque df esté vacío)"""
+    for inicio in range(0, max(len(df), 1), EXPORTACION_FILAS_POR_BLOQUE):
+        yield df.iloc[inicio:inicio + EXPORTACION_FILAS_POR_BLOQUE]
+
+def _columnas_texto(df):
+    """
+    Copia de df con las columnas object como texto: el espejo y las hojas devuelven columnas
+    con tipos mezclados (ej: posicion con 1 y 'DI') que pyarrow no puede convertir a un solo tipo
+    """
+    columnas = df.select_dtypes(include='object').columns
+    return df.astype({col: 'string' for col in columnas}) if len(columnas) else df
+
+def exportar_hoja(nombre_hoja, df, formato):
+    """
+    Escribe df (filas de la hoja nombre_hoja) por bloques en un archivo temporal con el formato
+    de FORMATOS_EXPORTACION indicado. Retorna el archivo abierto y posicionado al inicio.
+    """
+    archivo = tempfile.TemporaryFile()
+    if formato == 'Parquet':
+        # Un solo esquema para todos los bloques (un bloque con una columna vacía no cambia su tipo)
+        esquema = pa.Schema.from_pandas(_columnas_texto(df.head(0)), preserve_index=False)
+        with pq.ParquetWriter(archivo, esquema, compression='zstd') as escritor:
+            for bloque in _bloques_exportacion(df):
+                escritor.write_table(pa.Table.from_pandas(_columnas_texto(bloque), schema=esquema, preserve_index=False))
+    else:
+        comprimido = gzip.GzipFile(fileobj=archivo, mode='wb') if formato == 'CSV comprimido (gzip)' else None
+        texto = io.TextIOWrapper(comprimido or archivo, encoding='utf-8', newline='')
+        for numero, bloque in enumerate(_bloques_exportacion(df)):
+            _serializar_hoja(nombre_hoja, bloque.copy()).to_csv(texto, index=False, header=numero == 0)
+        texto.flush()
+        texto.detach()
+        if comprimido is not None:
+            comprimido.close()
+    archivo.seek(0)
+    return archivo
+
+def exportar_libro(nits=None, desde=None, hasta=None):
+    """
+    Libro de Excel con una pestaña por hoja de HOJAS_LIBRO (filtros como en datos_exportacion).
+    openpyxl en modo write_only pasa cada fila a disco al agregarla, así el libro no queda en
+    memoria sin importar el tamaño del historial. Retorna el archivo temporal posicionado al inicio.
+    """
+    libro = Workbook(write_only=True)
+    for nombre_hoja, titulo in HOJAS_LIBRO.items():
+        pestana = libro.create_sheet(title=titulo)
+        df = datos_exportacion(nombre_hoja, nits, desde, hasta)
+        pestana.append([str(col) for col in df.columns])
+        for bloque in _bloques_exportacion(df):
+            bloque = _serializar_hoja(nombre_hoja, bloque)
+            for fila in bloque.astype(object).where(bloque.notna(), None).itertuples(index=False, name=None):
+                pestana.append(fila)
+    archivo = tempfile.TemporaryFile()
+    libro.save(archivo)
+    archivo.seek(0)
+    return archivo
+
+def datos_exportacion(nombre_hoja, nits=None, desde=None, hasta=None):
+    """
+    Filas a exportar de una hoja. desde/hasta (date) limitan por fecha las hojas particionadas y
+    nits (lista de NITs, None = sin filtro) limita a esos clientes; servicios y movimientos se
+    filtran por las llantas de esos clientes.
+    """
+    if nombre_hoja in HOJAS_PARTICIONADAS:
+        df = leer_historial(nombre_hoja, desde, hasta)
+    else:
+        df = leer_hoja(nombre_hoja)
+    if nits is None or df.empty:
+        return df
+    if nombre_hoja == SHEET_CLIENTES:
+        return filtrar_por_clientes(df, 'nit', nits)
+    if nombre_hoja in HOJAS_PARTICIONADAS:
+        llantas_cliente = filtrar_por_clientes(leer_hoja(SHEET_LLANTAS), 'nit_cliente', nits)
+        if llantas_cliente.empty:
+            return df.iloc[0:0]
+        return df[df['id_llanta'].isin(llantas_cliente['id_llanta'])]
+    return filtrar_por_clientes(df, 'nit_cliente', nits)
+
 def reportes():
     """Función para generar reportes y análisis"""
     
     st.image("https://elchorroco.wordpress.com/wp-content/uploads/2025/10/megallanta-logo.png", width=200)
     st.header("📊 Reportes y Análisis")
+
+    # Período de los reportes de servicios y movimientos: solo se leen las particiones de esos años
+    col_desde, col_hasta = st.columns(2)
+    with col_desde:
+        fecha_desde = st.date_input("Desde", value=(datetime.now() - pd.Timedelta(days=DIAS_HISTORIAL)).date(), key="reportes_desde")
+    with col_hasta:
+        fecha_hasta = st.date_input("Hasta", value=None, key="reportes_hasta")
+
+    precargar_hojas([SHEET_CLIENTES, SHEET_LLANTAS, SHEET_MOVIMIENTOS, SHEET_SERVICIOS, SHEET_VEHICULOS],
+                    desde=fecha_desde, hasta=fecha_hasta)
     
     tab1, tab2, tab3, tab4, tab5 = st.tabs(["📈 Desgaste de Llantas", "🛠️ Servicios por Llanta", "🚛 Servicios por Vehículo", "📊 Estado de Flota", "📥 Exportar Datos"])
     
     with tab1:
         st.subheader("Análisis de Desgaste")
         
-        df_servicios = leer_hoja(SHEET_SERVICIOS)
+        df_servicios = leer_historial(SHEET_SERVICIOS, fecha_desde, fecha_hasta)
         
         if df_servicios.empty:
             st.info("No hay datos de servicios para analizar")
         else:
             col1, col2 = st.columns(2)
             with col1:
-                filtro_llantas = st.multiselect(
-                    "Filtrar Llantas",
-                    options=['Todas'] + list(df_servicios['id_llanta'].unique()),
-                    default=['Todas']
-                )
-            
-            if 'Todas' in filtro_llantas:
-                id_llanta_filtro = st.selectbox(
-                    "Seleccionar Llanta para Análisis",
-                    options=df_servicios['id_llanta'].unique()
-                )
-            else:
-                id_llanta_filtro = st.selectbox(
-                    "Seleccionar Llanta para Análisis",
-                    options=filtro_llantas
+                id_llanta_filtro = selector_paginado(
+                    "Seleccionar Llanta para Análisis", df_servicios, 'id_llanta',
+                    key="analisis_llanta", columnas_busqueda=['placa_vehiculo']
                 )
             
             servicios_llanta = df_servicios[df_servicios['id_llanta'] == id_llanta_filtro].sort_values('timestamp')
             
-            if not servicios_llanta.empty:
+            if id_llanta_filtro is not None and not servicios_llanta.empty:
                 col1, col2 = st.columns(2)
                 
                 with col1:
@@ -3039,17 +5415,17 @@ def reportes():
     with tab2:
         st.subheader("Servicios por Llanta")
         
-        df_servicios = leer_hoja(SHEET_SERVICIOS)
+        df_servicios = leer_historial(SHEET_SERVICIOS, fecha_desde, fecha_hasta)
         
         if not df_servicios.empty:
             resumen = df_servicios.groupby('id_llanta').agg({
                 'id_servicio': 'count',
-                'rotacion': lambda x: (x == 'Sí').sum(),
-                'balanceo': lambda x: (x == 'Sí').sum(),
-                'reparacion': lambda x: (x == 'Sí').sum() if 'reparacion' in df_servicios.columns else 0,
-                'despinche': lambda x: (x == 'Sí').sum() if 'despinche' in df_servicios.columns else 0,
-                'regrabacion': lambda x: (x == 'Sí').sum(),
-                'torqueo': lambda x: (x == 'Sí').sum()
+                'rotacion': _contar_si,
+                'balanceo': _contar_si,
+                'reparacion': lambda x: _contar_si(x) if 'reparacion' in df_servicios.columns else 0,
+                'despinche': lambda x: _contar_si(x) if 'despinche' in df_servicios.columns else 0,
+                'regrabacion': _contar_si,
+                'torqueo': _contar_si
             }).reset_index()
 
             resumen.columns = ['ID Llanta', 'Total Servicios', 'Rotaciones', 'Balanceos', 'Reparaciones', 'Despinches', 'Regrabaciones', 'Torqueos']
@@ -3057,45 +5433,32 @@ def reportes():
             st.dataframe(resumen, use_container_width=True, hide_index=True)
             
             st.divider()
-            id_llanta_detalle = st.selectbox(
-                "Ver Detalle de Llanta",
-                options=df_servicios['id_llanta'].unique(),
-                key="detalle_servicios"
+            id_llanta_detalle = selector_paginado(
+                "Ver Detalle de Llanta", df_servicios, 'id_llanta',
+                key="detalle_servicios", columnas_busqueda=['placa_vehiculo']
             )
             
-            servicios_detalle = df_servicios[df_servicios['id_llanta'] == id_llanta_detalle].sort_values('timestamp', ascending=False)
-            st.dataframe(servicios_detalle, use_container_width=True, hide_index=True)
+            if id_llanta_detalle is not None:
+                servicios_detalle = df_servicios[df_servicios['id_llanta'] == id_llanta_detalle].sort_values('timestamp', ascending=False)
+                st.dataframe(servicios_detalle, use_container_width=True, hide_index=True)
         else:
             st.info("No hay servicios registrados")
     
     with tab3:
         st.subheader("Servicios por Vehículo")
         
-        df_servicios = leer_hoja(SHEET_SERVICIOS)
+        df_servicios = leer_historial(SHEET_SERVICIOS, fecha_desde, fecha_hasta)
         
         if not df_servicios.empty:
             col1, col2 = st.columns(2)
             with col1:
-                filtro_vehiculos = st.multiselect(
-                    "Filtrar Vehículos",
-                    options=['Todos'] + list(df_servicios['placa_vehiculo'].unique()),
-                    default=['Todos']
-                )
-            
-            if 'Todos' in filtro_vehiculos:
-                vehiculo_filtro = st.selectbox(
-                    "Seleccionar Vehículo",
-                    options=df_servicios['placa_vehiculo'].unique()
-                )
-            else:
-                vehiculo_filtro = st.selectbox(
-                    "Seleccionar Vehículo",
-                    options=filtro_vehiculos
+                vehiculo_filtro = selector_paginado(
+                    "Seleccionar Vehículo", df_servicios, 'placa_vehiculo', key="analisis_vehiculo"
                 )
             
             servicios_vehiculo = df_servicios[df_servicios['placa_vehiculo'] == vehiculo_filtro].sort_values('timestamp', ascending=False)
             
-            if not servicios_vehiculo.empty:
+            if vehiculo_filtro is not None and not servicios_vehiculo.empty:
                 st.metric("Total de Servicios en este Vehículo", len(servicios_vehiculo))
                 
                 st.divider()
@@ -3137,6 +5500,8 @@ def reportes():
             
             st.write("**Distribución por Estado**")
             estado_counts = df_llantas['disponibilidad'].value_counts()
+            # Las categorías sin llantas también aparecen en value_counts
+            estado_counts = estado_counts[estado_counts > 0]
             st.bar_chart(estado_counts)
             
             st.divider()
@@ -3153,78 +5518,66 @@ def reportes():
     with tab5:
         st.subheader("Exportar Datos")
 
-        st.write("Descarga los datos en formato CSV para análisis externo")
+        st.write("Descarga los datos para análisis externo")
 
         # Obtener clientes accesibles para filtrar exportaciones
         clientes_acceso_export = obtener_clientes_accesibles()
 
-        col1, col2, col3 = st.columns(3)
-
-        with col1:
-            if st.button("📥 Descargar Servicios", use_container_width=True):
-                df_servicios = leer_hoja(SHEET_SERVICIOS)
-                # Filtrar por cliente si no es admin
-                if st.session_state.get('nivel') != 1:
-                    df_llantas_temp = leer_hoja(SHEET_LLANTAS)
-                    llantas_cliente = df_llantas_temp[df_llantas_temp['nit_cliente'].isin(clientes_acceso_export)]['id_llanta'].tolist()
-                    df_servicios = df_servicios[df_servicios['id_llanta'].isin(llantas_cliente)]
-                csv = df_servicios.to_csv(index=False).encode('utf-8')
-                st.download_button(
-                    label="💾 Servicios.csv",
-                    data=csv,
-                    file_name=f"servicios_{datetime.now().strftime('%Y%m%d')}.csv",
-                    mime='text/csv'
-                )
-
-            if st.button("📥 Descargar Llantas", use_container_width=True):
-                df_llantas = leer_hoja(SHEET_LLANTAS)
-                df_llantas = filtrar_por_clientes(df_llantas, 'nit_cliente', clientes_acceso_export)
-                csv = df_llantas.to_csv(index=False).encode('utf-8')
-                st.download_button(
-                    label="💾 Llantas.csv",
-                    data=csv,
-                    file_name=f"llantas_{datetime.now().strftime('%Y%m%d')}.csv",
-                    mime='text/csv'
-                )
-
-        with col2:
-            if st.button("📥 Descargar Vehículos", use_container_width=True):
-                df_vehiculos = leer_hoja(SHEET_VEHICULOS)
-                df_vehiculos = filtrar_por_clientes(df_vehiculos, 'nit_cliente', clientes_acceso_export)
-                csv = df_vehiculos.to_csv(index=False).encode('utf-8')
-                st.download_button(
-                    label="💾 Vehiculos.csv",
-                    data=csv,
-                    file_name=f"vehiculos_{datetime.now().strftime('%Y%m%d')}.csv",
-                    mime='text/csv'
-                )
+        # Por defecto se exporta el historial completo, como antes de las particiones por año
+        periodo_export = st.radio("Servicios y movimientos", ["Todo el historial", "Período de arriba"],
+                                  horizontal=True, key="exportar_periodo")
+        if periodo_export == "Todo el historial":
+            desde_export, hasta_export = None, None
+        else:
+            desde_export, hasta_export = fecha_desde, fecha_hasta
+
+        col_formato, col_clientes = st.columns(2)
+        with col_formato:
+            formato_export = st.selectbox("Formato", list(FORMATOS_EXPORTACION.keys()), key="exportar_formato")
+        with col_clientes:
+            clientes_export = st.multiselect("Clientes (vacío = todos los accesibles)", options=clientes_acceso_export,
+                                             key="exportar_clientes")
+
+        # El admin sin clientes elegidos exporta todo; el resto siempre queda limitado a sus clientes
+        if clientes_export:
+            nits_export = clientes_export
+        elif st.session_state.get('nivel') == 1:
+            nits_export = None
+        else:
+            nits_export = clientes_acceso_export
 
-            if st.button("📥 Descargar Clientes", use_container_width=True):
-                df_clientes = leer_hoja(SHEET_CLIENTES)
-                df_clientes = filtrar_por_clientes(df_clientes, 'nit', clientes_acceso_export)
-                csv = df_clientes.to_csv(index=False).encode('utf-8')
+        extension, mime = FORMATOS_EXPORTACION[formato_export]
+        exportaciones = [
+            (SHEET_SERVICIOS, "Servicios"), (SHEET_LLANTAS, "Llantas"), (SHEET_VEHICULOS, "Vehículos"),
+            (SHEET_CLIENTES, "Clientes"), (SHEET_MOVIMIENTOS, "Movimientos"),
+        ]
+        columnas_export = st.columns(3)
+        for indice, (nombre_hoja, etiqueta) in enumerate(exportaciones):
+            # data es una función: el archivo se genera solo al pulsar el botón, en otro hilo
+            def generar(nombre_hoja=nombre_hoja):
+                df = datos_exportacion(nombre_hoja, nits_export, desde_export, hasta_export)
+                return exportar_hoja(nombre_hoja, df, formato_export)
+
+            with columnas_export[indice % 3]:
                 st.download_button(
-                    label="💾 Clientes.csv",
-                    data=csv,
-                    file_name=f"clientes_{datetime.now().strftime('%Y%m%d')}.csv",
-                    mime='text/csv'
+                    label=f"📥 Descargar {etiqueta}",
+                    data=generar,
+                    file_name=f"{nombre_hoja}_{datetime.now().strftime('%Y%m%d')}.{extension}",
+                    mime=mime,
+                    on_click="ignore",
+                    use_container_width=True,
+                    key=f"exportar_{nombre_hoja}"
                 )
 
-        with col3:
-            if st.button("📥 Descargar Movimientos", use_container_width=True):
-                df_movimientos = leer_hoja(SHEET_MOVIMIENTOS)
-                # Filtrar por cliente si no es admin
-                if st.session_state.get('nivel') != 1:
-                    df_llantas_temp = leer_hoja(SHEET_LLANTAS)
-                    llantas_cliente = df_llantas_temp[df_llantas_temp['nit_cliente'].isin(clientes_acceso_export)]['id_llanta'].tolist()
-                    df_movimientos = df_movimientos[df_movimientos['id_llanta'].isin(llantas_cliente)]
-                csv = df_movimientos.to_csv(index=False).encode('utf-8')
-                st.download_button(
-                    label="💾 Movimientos.csv",
-                    data=csv,
-                    file_name=f"movimientos_{datetime.now().strftime('%Y%m%d')}.csv",
-                    mime='text/csv'
-                )
+        st.download_button(
+            label="📗 Descargar libro de Excel (" + ", ".join(HOJAS_LIBRO.values()) + ")",
+            data=lambda: exportar_libro(nits_export, desde_export, hasta_export),
+            file_name=f"sill_{datetime.now().strftime('%Y%m%d')}.xlsx",
+            mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            on_click="ignore",
+            use_container_width=True,
+            key="exportar_libro"
+        )
 
 # ============= FUNCIÓN: MI PERFIL =============
 def mi_perfil():
@@ -3328,7 +5681,7 @@ def gestion_usuarios():
                 clientes_opciones = st.multiselect(
                     "Seleccionar Clientes",
                     options=df_clientes['nit'].values,
-                    format_func=lambda x: f"{df_clientes[df_clientes['nit']==x]['nombre_cliente'].values[0]} - {x}",
+                    format_func=lambda x: f"{fila_por_clave(df_clientes, 'nit', x)['nombre_cliente']} - {x}",
                     key="crear_clientes_asignados"
                 )
                 clientes_seleccionados = ','.join([str(c) for c in clientes_opciones])
@@ -3339,8 +5692,8 @@ def gestion_usuarios():
             elif nuevo_nivel in [2, 3, 4] and not clientes_seleccionados:
                 st.error(f"Debes asignar al menos un cliente para este nivel de usuario")
             else:
-                # Leer datos frescos SIN caché para verificar duplicados
-                df_usuarios = leer_hoja_fresco(SHEET_USUARIOS)
+                # La caché se actualiza en cada escritura: ya trae los últimos datos para verificar duplicados
+                df_usuarios = leer_hoja(SHEET_USUARIOS)
 
                 if existe_valor(df_usuarios, 'usuario', nuevo_usuario):
                     st.error("Este nombre de usuario ya existe")
@@ -3402,14 +5755,19 @@ def gestion_usuarios():
         df_clientes = leer_hoja(SHEET_CLIENTES)
 
         if not df_usuarios.empty:
+            def format_usuario(x):
+                usuario = fila_por_clave(df_usuarios, 'usuario', x)
+                id_usuario = usuario['id_usuario'] if 'id_usuario' in usuario.index and pd.notna(usuario['id_usuario']) else 'Sin ID'
+                return f"[{id_usuario}] {usuario['nombre']} ({x}) - Nivel {usuario['nivel']}"
+
             usuario_editar = st.selectbox(
                 "Seleccionar Usuario",
                 options=df_usuarios['usuario'].values,
-                format_func=lambda x: f"[{df_usuarios[df_usuarios['usuario']==x]['id_usuario'].values[0] if 'id_usuario' in df_usuarios.columns and pd.notna(df_usuarios[df_usuarios['usuario']==x]['id_usuario'].values[0]) else 'Sin ID'}] {df_usuarios[df_usuarios['usuario']==x]['nombre'].values[0]} ({x}) - Nivel {df_usuarios[df_usuarios['usuario']==x]['nivel'].values[0]}",
+                format_func=format_usuario,
                 key="select_usuario_editar"
             )
 
-            usuario_data = df_usuarios[df_usuarios['usuario'] == usuario_editar].iloc[0]
+            usuario_data = fila_por_clave(df_usuarios, 'usuario', usuario_editar)
 
             # No permitir editar el propio usuario admin que está logueado
             if usuario_editar == st.session_state.get('usuario'):
@@ -3456,7 +5814,7 @@ def gestion_usuarios():
                             "Seleccionar Clientes",
                             options=df_clientes['nit'].values,
                             default=[c for c in clientes_actuales if c in df_clientes['nit'].values],
-                            format_func=lambda x: f"{df_clientes[df_clientes['nit']==x]['nombre_cliente'].values[0]} - {x}",
+                            format_func=lambda x: f"{fila_por_clave(df_clientes, 'nit', x)['nombre_cliente']} - {x}",
                             key="edit_clientes_usuario"
                         )
                         edit_clientes = ','.join([str(c) for c in clientes_opciones_edit])
@@ -3507,6 +5865,11 @@ def gestion_usuarios():
 def main():
     """Función principal del sistema"""
     
+    # Las versiones base de la concurrencia optimista son las de esta ejecución del script
+    _versiones_leidas().clear()
+    iniciar_reconciliacion()
+    iniciar_refresco()
+    iniciar_diario()
     inicializar_datos()
     
     if 'logged_in' not in st.session_state:
@@ -3515,6 +5878,9 @@ def main():
     if not st.session_state['logged_in']:
         login()
         return
+
+    if 'conflicto_escritura' in st.session_state:
+        st.error(st.session_state.pop('conflicto_escritura'))
     
     with st.sidebar:
         st.image("https://elchorroco.wordpress.com/wp-content/uploads/2025/10/logo-sill.jpg", use_container_width=True)
@@ -3527,6 +5893,44 @@ def main():
         
         st.write(f"**Usuario:** {st.session_state['nombre']}")
         st.write(f"**Nivel:** {st.session_state['nivel']}")
+
+        pendientes, ultimo_error = estado_diario()
+        if pendientes:
+            st.warning(f"⏳ {pendientes} cambio(s) guardados localmente, pendientes de enviar a Google Sheets")
+            if ultimo_error:
+                st.caption(f"Último error: {ultimo_error}")
+
+        # Lotes que Google Sheets rechazó: sus hojas ya se recargaron, el administrador decide qué rehacer
+        if st.session_state['nivel'] == 1:
+            apartados = lotes_apartados()
+            if not apartados.empty:
+                st.error(f"❌ {len(apartados)} cambio(s) no se pudieron enviar a Google Sheets y se descartaron del envío")
+                with st.expander("Ver cambios no enviados"):
+                    for lote in apartados.itertuples(index=False):
+                        creado = datetime.fromtimestamp(lote.creado).strftime("%Y-%m-%d %H:%M:%S")
+                        st.caption(f"{creado} · {lote.hojas} · {lote.intentos} intento(s)")
+                        st.code(lote.ultimo_error or '', language=None)
+                        if st.button("Descartar aviso", key=f"descartar_apartado_{lote.id}"):
+                            descartar_lote_apartado(lote.id)
+                            st.rerun()
+
+            # Verificaciones del hilo del diario que encontraron diferencias con Google Sheets
+            avisos = list(avisos_diario())
+            if avisos:
+                for momento, mensaje in avisos:
+                    st.warning(f"{datetime.fromtimestamp(momento).strftime('%Y-%m-%d %H:%M:%S')} · {mensaje}")
+                if st.button("Limpiar avisos", key="limpiar_avisos_diario"):
+                    avisos_diario().clear()
+                    st.rerun()
+
+            # Historial guardado antes de las particiones por año: el administrador decide cuándo moverlo
+            if particiones_pendientes():
+                st.info("📦 El historial de servicios y movimientos aún no está repartido por año")
+                if st.button("Particionar historial por año", key="migrar_particiones"):
+                    with st.spinner("Moviendo el historial a las hojas por año..."):
+                        migrado = migrar_particiones()
+                    if migrado:
+                        st.rerun()
         
         st.divider()
         
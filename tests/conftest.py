@@ -0,0 +1,152 @@
+import os
+import sys
+
+import pytest
+import streamlit as st
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sill as _sill
+
+
+class Mensajes:
+    """Lo que la aplicación mostró con st.error / st.warning durante una prueba"""
+
+    def __init__(self):
+        self.errores = []
+        self.avisos = []
+
+
+@pytest.fixture
+def mensajes(monkeypatch):
+    capturados = Mensajes()
+    monkeypatch.setattr(st, 'error', lambda mensaje, *args, **kwargs: capturados.errores.append(mensaje))
+    monkeypatch.setattr(st, 'warning', lambda mensaje, *args, **kwargs: capturados.avisos.append(mensaje))
+    return capturados
+
+
+@pytest.fixture
+def sill(tmp_path, monkeypatch, mensajes):
+    """El módulo con un espejo local nuevo y AlmacenamientoMemoria como almacenamiento de todas las hojas"""
+    monkeypatch.setenv('SILL_ALMACENAMIENTO', 'memoria')
+    monkeypatch.setenv('SILL_RUTA_INSTANTANEA', str(tmp_path / 'sill_instantanea'))
+    monkeypatch.setattr(_sill, 'BD_LOCAL_PATH', str(tmp_path / 'sill_local.db'))
+    monkeypatch.setattr(_sill, 'VERIFICACION_MUESTREO', 0)
+    st.cache_resource.clear()
+    _sill._versiones_leidas().clear()
+    _sill._unidad_local.unidad = None
+    yield _sill
+    _sill._unidad_local.unidad = None
+    st.cache_resource.clear()
+
+
+@pytest.fixture
+def almacenamiento(sill):
+    """El AlmacenamientoMemoria que usan las hojas; almacenamiento.escribir siembra datos sin pasar por el espejo"""
+    return sill.get_almacenamiento(sill.SHEET_LLANTAS)
+
+
+class AlmacenamientoRemotoDePrueba:
+    """AlmacenamientoMemoria que se comporta como uno remoto (pasa por el diario) y puede fallar a pedido"""
+
+    def __init__(self, sill):
+        self.base = sill.AlmacenamientoMemoria()
+        self.remoto = True
+        self.fallas = []
+        self.enviados = []
+
+    def __getattr__(self, nombre):
+        return getattr(self.base, nombre)
+
+    def aplicar(self, lote):
+        if self.fallas:
+            raise self.fallas.pop(0)
+        self.enviados.append([cambio['hoja'] for cambio in lote])
+        return self.base.aplicar(lote)
+
+    def escribir(self, nombre_hoja, df, df_anterior=None):
+        self.aplicar([{'hoja': nombre_hoja, 'anterior': df_anterior, 'df': df, 'agregar': None}])
+        return True
+
+    def agregar(self, nombre_hoja, df_nuevas):
+        self.aplicar([{'hoja': nombre_hoja, 'anterior': None, 'df': None, 'agregar': df_nuevas}])
+
+
+@pytest.fixture
+def remoto(sill, monkeypatch):
+    almacenamiento = AlmacenamientoRemotoDePrueba(sill)
+    monkeypatch.setattr(sill, 'get_almacenamiento', lambda nombre_hoja: almacenamiento)
+    return almacenamiento
+
+
+class HojaDeCalculoDePrueba:
+    """Spreadsheet de gspread en memoria: values_batch_get y las peticiones de batchUpdate que usa AlmacenamientoSheets"""
+
+    class Hoja:
+        def __init__(self, title, id):
+            self.title = title
+            self.id = id
+
+    def __init__(self):
+        # {hoja: filas}, con el encabezado en la fila 0 y [] para las filas en blanco
+        self.valores = {}
+        self.lecturas = []
+
+    def _titulo(self, id_hoja):
+        return list(self.valores)[id_hoja]
+
+    def worksheets(self):
+        return [self.Hoja(titulo, id_hoja) for id_hoja, titulo in enumerate(self.valores)]
+
+    def values_batch_get(self, rangos, params=None):
+        self.lecturas.append(list(rangos))
+        respuesta = []
+        for rango in rangos:
+            titulo, _, celdas = rango.rpartition('!') if '!' in rango else (rango, '', '')
+            filas = self.valores[titulo.strip("'").replace("''", "'")]
+            if celdas:
+                inicio, _, fin = celdas.partition(':')
+                numero = int(''.join(c for c in inicio if c.isdigit()) or 1)
+                ultima = int(''.join(c for c in fin if c.isdigit()) or len(filas))
+                ancho = sum(26 ** i * (ord(c) - 64) for i, c in enumerate(reversed(fin.rstrip('0123456789')))) or None
+                filas = [fila[:ancho] for fila in filas[numero - 1:ultima]]
+            respuesta.append({'values': [list(fila) for fila in filas]})
+        return {'valueRanges': respuesta}
+
+    def batch_update(self, cuerpo):
+        for peticion in cuerpo['requests']:
+            tipo, datos = next(iter(peticion.items()))
+            if tipo == 'addSheet':
+                self.valores[datos['properties']['title']] = []
+            elif tipo == 'appendCells':
+                filas = self.valores[self._titulo(datos['sheetId'])]
+                while filas and not any(v not in (None, '') for v in filas[-1]):
+                    filas.pop()
+                filas += [[self._valor(celda) for celda in fila['values']] for fila in datos['rows']]
+            elif tipo == 'updateCells' and 'rows' not in datos:
+                self.valores[self._titulo(datos['range']['sheetId'])] = []
+            elif tipo == 'updateCells':
+                rango = datos.get('range') or {'sheetId': datos['start']['sheetId'], 'startRowIndex': datos['start']['rowIndex'],
+                                               'startColumnIndex': datos['start']['columnIndex']}
+                filas = self.valores[self._titulo(rango['sheetId'])]
+                for desplazamiento, fila in enumerate(datos['rows']):
+                    numero = rango['startRowIndex'] + desplazamiento
+                    while len(filas) <= numero:
+                        filas.append([])
+                    for j, celda in enumerate(fila['values'], start=rango['startColumnIndex']):
+                        while len(filas[numero]) <= j:
+                            filas[numero].append('')
+                        filas[numero][j] = self._valor(celda)
+        return {}
+
+    @staticmethod
+    def _valor(celda):
+        return next(iter(celda['userEnteredValue'].values())) if celda else ''
+
+
+@pytest.fixture
+def hoja_de_calculo(sill, monkeypatch):
+    """AlmacenamientoSheets sobre una HojaDeCalculoDePrueba: hoja_de_calculo.valores siembra y muestra la hoja"""
+    falsa = HojaDeCalculoDePrueba()
+    monkeypatch.setattr(sill, 'get_spreadsheet', lambda: falsa)
+    return falsa
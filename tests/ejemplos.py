@@ -0,0 +1,20 @@
+import pandas as pd
+
+
+def clientes_de_prueba(n=20):
+    """Hoja de clientes con n filas y NIT como clave"""
+    return pd.DataFrame({'nit': [f'900{i:03d}' for i in range(n)], 'nombre': [f'Cliente {i}' for i in range(n)]})
+
+
+def servicios_de_prueba():
+    """Servicios de tres llantas en 2023, 2024 y una fila sin fecha"""
+    return pd.DataFrame({
+        'id_servicio': [f'TR01_S{i:04d}' for i in range(1, 7)],
+        'id_llanta': ['L1', 'L1', 'L1', 'L2', 'L2', 'L3'],
+        'fecha': ['01/01/2023', '01/06/2023', '02/01/2024', '03/01/2024', '', '05/01/2024'],
+        'vida': [1, 1, 2, 1, 1, 1],
+        'kilometraje': [0, 1000, 1000, 50, 550, 10],
+        'profundidad_1': [16, 12, 15, 14, 11, 9],
+        'timestamp': ['2023-01-01 08:00:00', '2023-06-01 08:00:00', '2024-01-02 08:00:00',
+                      '2024-01-03 08:00:00', '2024-01-04 08:00:00', '2024-01-05 08:00:00'],
+    })
@@ -0,0 +1,26 @@
+import pytest
+
+
+@pytest.mark.parametrize('encabezado', [
+    ['id_servicio', 'fecha', 'kilometraje'],
+    ['fecha', 'id_servicio'],
+    ['id_servicio'],
+])
+def test_cola_con_columnas_cambiadas_en_la_hoja_pide_lectura_completa(sill, hoja_de_calculo, encabezado):
+    filas = [[f'TR01_S{i:04d}', '01/01/2024', 100 * i][:len(encabezado)] for i in range(1, 6)]
+    hoja_de_calculo.valores[sill.SHEET_SERVICIOS] = [encabezado] + filas
+    columnas = ['id_servicio', 'fecha']
+    pedido = (4, columnas, 'id_servicio', 'TR01_S0003', 0)
+
+    cola = sill.AlmacenamientoSheets().leer_colas({sill.SHEET_SERVICIOS: pedido[:2]})[sill.SHEET_SERVICIOS]
+    assert len(hoja_de_calculo.lecturas) == 1
+    assert list(cola.columns) != columnas
+    assert sill._espejo_completar(sill.SHEET_SERVICIOS, pedido, cola, None) is False
+
+
+def test_cola_con_las_mismas_columnas_usa_el_encabezado_de_la_hoja(sill, hoja_de_calculo):
+    hoja_de_calculo.valores[sill.SHEET_SERVICIOS] = [['id_servicio', 'fecha']] + [[f'TR01_S{i:04d}', '01/01/2024'] for i in range(1, 6)]
+
+    cola = sill.AlmacenamientoSheets().leer_colas({sill.SHEET_SERVICIOS: (4, ['id_servicio', 'fecha'])})[sill.SHEET_SERVICIOS]
+    assert list(cola.columns) == ['id_servicio', 'fecha']
+    assert list(cola['id_servicio']) == ['TR01_S0003', 'TR01_S0004', 'TR01_S0005']
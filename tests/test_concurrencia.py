@@ -0,0 +1,51 @@
+import pandas as pd
+import pytest
+
+from ejemplos import clientes_de_prueba
+
+
+def test_escrituras_de_filas_distintas_se_fusionan(sill, almacenamiento):
+    almacenamiento.escribir(sill.SHEET_CLIENTES, clientes_de_prueba())
+    sesion_a = sill.leer_hoja(sill.SHEET_CLIENTES)
+    sesion_b = sill.leer_hoja(sill.SHEET_CLIENTES)
+
+    sesion_a.loc[1, 'nombre'] = 'Cambio A'
+    assert sill.escribir_hoja(sill.SHEET_CLIENTES, sesion_a) is not None
+    sesion_b.loc[2, 'nombre'] = 'Cambio B'
+    sesion_b = sesion_b[sesion_b['nit'] != '900005']
+    assert sill.escribir_hoja(sill.SHEET_CLIENTES, sesion_b) is not None
+
+    final = almacenamiento.leer(sill.SHEET_CLIENTES).set_index('nit')['nombre']
+    assert final['900001'] == 'Cambio A'
+    assert final['900002'] == 'Cambio B'
+    assert '900005' not in final.index
+    assert len(final) == 19
+
+
+def test_escrituras_de_la_misma_fila_son_un_conflicto(sill, almacenamiento, mensajes):
+    almacenamiento.escribir(sill.SHEET_CLIENTES, clientes_de_prueba())
+    sesion_a = sill.leer_hoja(sill.SHEET_CLIENTES)
+    sesion_b = sill.leer_hoja(sill.SHEET_CLIENTES)
+
+    sesion_a.loc[1, 'nombre'] = 'Cambio A'
+    sill.escribir_hoja(sill.SHEET_CLIENTES, sesion_a)
+    sesion_b.loc[1, 'nombre'] = 'Cambio B'
+    assert sill.escribir_hoja(sill.SHEET_CLIENTES, sesion_b) is None
+
+    assert any('900001' in mensaje for mensaje in mensajes.errores)
+    assert almacenamiento.leer(sill.SHEET_CLIENTES).loc[1, 'nombre'] == 'Cambio A'
+
+
+def test_dataframe_sin_version_usa_la_primera_lectura_de_la_ejecucion(sill, almacenamiento):
+    almacenamiento.escribir(sill.SHEET_CLIENTES, clientes_de_prueba(5))
+    leido = sill.leer_hoja(sill.SHEET_CLIENTES)
+    sill.escribir_hoja(sill.SHEET_CLIENTES, leido[leido['nit'] != '900002'])
+
+    # Armado con la lectura anterior a la escritura; pd.concat pierde attrs['version']
+    otro = pd.concat([leido.iloc[:1].assign(nombre='Editado'), leido.iloc[1:]])
+    otro.attrs = {}
+    assert sill.escribir_hoja(sill.SHEET_CLIENTES, otro) is not None
+
+    final = almacenamiento.leer(sill.SHEET_CLIENTES)
+    assert '900002' not in final['nit'].tolist()
+    assert final.loc[final['nit'] == '900000', 'nombre'].item() == 'Editado'
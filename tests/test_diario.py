@@ -0,0 +1,107 @@
+import pickle
+
+import pandas as pd
+import pytest
+
+from conftest import AlmacenamientoRemotoDePrueba
+from ejemplos import clientes_de_prueba
+
+
+def test_diario_envia_en_orden_y_reintenta_errores_transitorios(sill, remoto):
+    remoto.base.escribir(sill.SHEET_CLIENTES, clientes_de_prueba())
+    df = sill.leer_hoja(sill.SHEET_CLIENTES)
+    df.loc[0, 'nombre'] = 'Primero'
+    sill.escribir_hoja(sill.SHEET_CLIENTES, df)
+    sill.agregar_filas(sill.SHEET_USUARIOS, pd.DataFrame([{'id_usuario': 'U1', 'usuario': 'u', 'nivel': 3}]))
+    df = sill.leer_hoja(sill.SHEET_CLIENTES)
+    df.loc[0, 'nombre'] = 'Segundo'
+    sill.escribir_hoja(sill.SHEET_CLIENTES, df)
+    # Las escrituras ya se ven localmente aunque no se hayan enviado
+    assert sill.leer_hoja(sill.SHEET_CLIENTES).loc[0, 'nombre'] == 'Segundo'
+    assert sill.estado_diario()[0] == 3
+
+    remoto.fallas = [ConnectionError("sin red"), ConnectionError("sin red")]
+    assert sill.vaciar_diario() == sill.DIARIO_ESPERA_BASE
+    assert sill.vaciar_diario() == sill.DIARIO_ESPERA_BASE * 2
+    assert sill.estado_diario() == (3, "sin red")
+    assert remoto.enviados == []
+
+    assert sill.vaciar_diario() is None
+    assert sill.estado_diario() == (0, None)
+    assert remoto.enviados == [[sill.SHEET_CLIENTES], [sill.SHEET_USUARIOS], [sill.SHEET_CLIENTES]]
+    assert remoto.base.leer(sill.SHEET_CLIENTES).loc[0, 'nombre'] == 'Segundo'
+
+
+def test_diario_aparta_un_lote_con_error_permanente_y_sigue(sill, remoto):
+    remoto.base.escribir(sill.SHEET_CLIENTES, clientes_de_prueba())
+    df = sill.leer_hoja(sill.SHEET_CLIENTES)
+    df.loc[0, 'nombre'] = 'Rechazado'
+    sill.escribir_hoja(sill.SHEET_CLIENTES, df)
+    sill.agregar_filas(sill.SHEET_USUARIOS, pd.DataFrame([{'id_usuario': 'U1', 'usuario': 'u', 'nivel': 3}]))
+
+    remoto.fallas = [ValueError("400 Invalid requests")]
+    assert sill.vaciar_diario() is None
+    assert remoto.enviados == [[sill.SHEET_USUARIOS]]
+    apartados = sill.lotes_apartados()
+    assert apartados['hojas'].tolist() == [sill.SHEET_CLIENTES]
+    assert apartados['ultimo_error'].tolist() == ["400 Invalid requests"]
+    # La hoja del lote apartado vuelve a leerse del almacenamiento
+    assert sill.leer_hoja(sill.SHEET_CLIENTES).loc[0, 'nombre'] == 'Cliente 0'
+
+    sill.descartar_lote_apartado(int(apartados['id'].iloc[0]))
+    assert sill.lotes_apartados().empty
+
+
+def test_diario_aparta_un_lote_que_agota_los_reintentos(sill, remoto, monkeypatch):
+    monkeypatch.setattr(sill, 'DIARIO_MAX_INTENTOS', 2)
+    remoto.base.escribir(sill.SHEET_CLIENTES, clientes_de_prueba())
+    df = sill.leer_hoja(sill.SHEET_CLIENTES)
+    df.loc[0, 'nombre'] = 'Nunca llega'
+    sill.escribir_hoja(sill.SHEET_CLIENTES, df)
+
+    remoto.fallas = [TimeoutError("lento"), TimeoutError("lento")]
+    assert sill.vaciar_diario() is not None
+    assert sill.vaciar_diario() is None
+    assert sill.estado_diario()[0] == 0
+    assert sill.lotes_apartados()['intentos'].tolist() == [2]
+
+
+def test_diario_guarda_el_parche_y_no_las_hojas_completas(sill, remoto):
+    remoto.base.escribir(sill.SHEET_CLIENTES, clientes_de_prueba(200))
+    df = sill.leer_hoja(sill.SHEET_CLIENTES)
+    df.loc[7, 'nombre'] = 'Editado'
+    sill.escribir_hoja(sill.SHEET_CLIENTES, df)
+
+    conexion, _ = sill.get_espejo_local()
+    lote = pickle.loads(conexion.execute("SELECT lote FROM _diario").fetchone()[0])
+    assert lote[0]['df'] is None and lote[0]['anterior'] is None
+    assert lote[0]['parche']['celdas'] == [(7, 1, ['Editado'])]
+
+    assert sill.vaciar_diario() is None
+    enviado = remoto.base.leer(sill.SHEET_CLIENTES)
+    assert enviado.loc[7, 'nombre'] == 'Editado'
+    assert len(enviado) == 200
+
+
+def test_diario_envia_cada_cambio_de_un_lote_mixto_a_su_almacenamiento(sill, monkeypatch):
+    clientes, usuarios = AlmacenamientoRemotoDePrueba(sill), AlmacenamientoRemotoDePrueba(sill)
+    monkeypatch.setattr(sill, 'get_almacenamiento',
+                        lambda nombre_hoja: usuarios if nombre_hoja == sill.SHEET_USUARIOS else clientes)
+    usuarios.fallas = [ConnectionError("sin red")]
+    sill._espejo_aplicar([
+        {'hoja': sill.SHEET_CLIENTES, 'anterior': None, 'df': clientes_de_prueba(3), 'agregar': None},
+        {'hoja': sill.SHEET_USUARIOS, 'anterior': None, 'df': None,
+         'agregar': pd.DataFrame([{'id_usuario': 'U1', 'usuario': 'u', 'nivel': 3}])},
+    ], en_diario=True)
+
+    assert sill.vaciar_diario() == sill.DIARIO_ESPERA_BASE
+    assert clientes.enviados == [[sill.SHEET_CLIENTES]]
+    assert sill.estado_diario() == (1, "sin red")
+
+    # El reintento solo envía lo que faltaba
+    assert sill.vaciar_diario() is None
+    assert clientes.enviados == [[sill.SHEET_CLIENTES]]
+    assert usuarios.enviados == [[sill.SHEET_USUARIOS]]
+    assert len(clientes.base.leer(sill.SHEET_CLIENTES)) == 3
+    assert list(usuarios.base.leer(sill.SHEET_USUARIOS)['id_usuario']) == ['U1']
+    assert clientes.base.leer(sill.SHEET_USUARIOS).empty
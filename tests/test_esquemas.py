@@ -0,0 +1,24 @@
+import pandas as pd
+import pytest
+
+
+def test_esquema_ida_y_vuelta_con_decimales_vacios(sill, almacenamiento):
+    almacenamiento.escribir(sill.SHEET_LLANTAS, pd.DataFrame({
+        'id_llanta': ['L1', 'L2', 'L3'], 'vida_actual': ['1', '', '2'],
+        'kilometros_totales': ['1500.5', '', '30'], 'precio_vida1': ['1200000', '', '0'],
+        'disponibilidad': ['al_piso', '', 'llanta_nueva'],
+    }))
+    df = sill.leer_hoja(sill.SHEET_LLANTAS)
+    assert df['kilometros_totales'].iloc[0] == pytest.approx(1500.5)
+    assert pd.isna(df['kilometros_totales'].iloc[1])
+    assert pd.isna(df['vida_actual'].iloc[1])
+
+    df.loc[0, 'vida_actual'] = 3
+    assert sill.escribir_hoja(sill.SHEET_LLANTAS, df) is not None
+    escrito = almacenamiento.leer(sill.SHEET_LLANTAS)
+    assert escrito['vida_actual'].tolist()[0] in ('3', 3)
+    # Las celdas vacías siguen vacías y las demás no cambian de texto
+    assert sill._texto_comparable(escrito['kilometros_totales']).tolist() == sill._texto_comparable(
+        pd.Series(['1500.5', '', '30'])).tolist()
+    assert sill._serializar_hoja(sill.SHEET_LLANTAS, sill.leer_hoja(sill.SHEET_LLANTAS)).equals(
+        sill._serializar_hoja(sill.SHEET_LLANTAS, df))
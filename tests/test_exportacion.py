@@ -0,0 +1,10 @@
+import pandas as pd
+import pyarrow.parquet as pq
+
+
+def test_parquet_exporta_columnas_con_tipos_mezclados(sill):
+    df = pd.DataFrame({'id_llanta': ['L1', 'L2', 'L3'], 'posicion': [1, 'DI', None], 'kilometraje': [100.0, 200.0, 300.0]})
+    archivo = sill.exportar_hoja(sill.SHEET_LLANTAS, df, 'Parquet')
+    tabla = pq.read_table(archivo)
+    assert tabla.column('posicion').to_pylist() == ['1', 'DI', None]
+    assert tabla.column('kilometraje').to_pylist() == [100.0, 200.0, 300.0]
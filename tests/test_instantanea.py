@@ -0,0 +1,27 @@
+import os
+
+import pandas as pd
+import streamlit as st
+
+from ejemplos import clientes_de_prueba
+
+
+def test_instantanea_sirve_tras_reiniciar_con_el_espejo_en_el_mismo_volumen(sill, tmp_path, monkeypatch):
+    volumen = tmp_path / 'volumen'
+    monkeypatch.setenv('SILL_RUTA_ESPEJO', str(volumen / 'sill_local.db'))
+    monkeypatch.setenv('SILL_RUTA_INSTANTANEA', str(volumen / 'sill_instantanea'))
+    st.cache_resource.clear()
+    almacenamiento = sill.get_almacenamiento(sill.SHEET_CLIENTES)
+    almacenamiento.escribir(sill.SHEET_CLIENTES, clientes_de_prueba())
+    esperado = sill.leer_hoja(sill.SHEET_CLIENTES)
+    sill.guardar_instantanea()
+    assert os.path.exists(volumen / 'sill_local.db')
+
+    # Nuevo proceso: cachés vacías, mismo volumen
+    st.cache_resource.clear()
+    leidas = []
+    instantanea_leer = sill._instantanea_leer
+    monkeypatch.setattr(sill, '_instantanea_leer', lambda *args: leidas.append(instantanea_leer(*args)) or leidas[-1])
+    df = sill.leer_hoja(sill.SHEET_CLIENTES)
+    assert leidas and leidas[0] is not None
+    pd.testing.assert_frame_equal(df.reset_index(drop=True), esperado.reset_index(drop=True))
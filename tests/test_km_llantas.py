@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ejemplos import servicios_de_prueba
+
+
+def _resumen_ordenado(df):
+    df = df.sort_values(['id_llanta', 'vida']).reset_index(drop=True)
+    df['timestamp'] = df['timestamp'].fillna('')
+    return df.astype({'km_min': float, 'km_max': float, 'servicios': int,
+                      'profundidad_1': float, 'profundidad_2': float, 'profundidad_3': float})
+
+
+def _comparar_resumen_completo(sill):
+    incremental = _resumen_ordenado(sill.resumen_km_llantas())
+    # Entre hojas físicas el último servicio de cada llanta y vida es el de timestamp más reciente
+    historial = sill.leer_hoja(sill.SHEET_SERVICIOS).sort_values('timestamp', kind='stable', na_position='first')
+    completo = _resumen_ordenado(sill._resumen_km(historial))
+    pd.testing.assert_frame_equal(incremental, completo, check_dtype=False)
+
+
+def test_resumen_km_incremental_igual_al_recalculo_completo(sill, almacenamiento):
+    almacenamiento.escribir(sill.SHEET_SERVICIOS, servicios_de_prueba())
+    sill.migrar_particiones()
+    _comparar_resumen_completo(sill)
+
+    nuevo = servicios_de_prueba().iloc[:1].assign(id_servicio='TR01_S0010', kilometraje=4000, fecha='01/03/2024',
+                                         profundidad_1=7, timestamp='2024-03-01 08:00:00')
+    sill.agregar_filas(sill.SHEET_SERVICIOS, nuevo)
+    _comparar_resumen_completo(sill)
+
+    df = sill.leer_hoja(sill.SHEET_SERVICIOS)
+    df.loc[df['id_servicio'] == 'TR01_S0002', 'kilometraje'] = 2500
+    sill.escribir_hoja(sill.SHEET_SERVICIOS, df[df['id_servicio'] != 'TR01_S0006'])
+    _comparar_resumen_completo(sill)
+
+    # Un proceso con un espejo anterior a la tabla la llena desde las hojas
+    conexion, _ = sill.get_espejo_local()
+    conexion.execute("DROP TABLE _km_llantas")
+    conexion.commit()
+    sill.get_espejo_local.clear()
+    _comparar_resumen_completo(sill)
+
+
+def test_recalcular_costos_km_usa_el_resumen_de_todo_el_historial(sill, almacenamiento):
+    almacenamiento.escribir(sill.SHEET_LLANTAS, pd.DataFrame({
+        'id_llanta': ['L1', 'L2', 'L3'], 'nit_cliente': ['900000'] * 3, 'vida_actual': [2, 1, 1],
+        'precio_vida1': [1000, 500, 300], 'precio_vida2': [200, '', ''],
+    }))
+    almacenamiento.escribir(sill.SHEET_SERVICIOS, servicios_de_prueba())
+    sill.migrar_particiones()
+
+    assert sill.recalcular_costos_km() == 3
+    esperado = sill.calcular_costos_km(sill.leer_hoja(sill.SHEET_LLANTAS), sill._resumen_km(sill.leer_hoja(sill.SHEET_SERVICIOS)))
+    guardado = sill.leer_hoja(sill.SHEET_LLANTAS).set_index('id_llanta')
+    for vida in sill.VIDAS_COSTO:
+        columna = f'costo_km_vida{vida}'
+        valores = esperado[columna].reindex(guardado.index).astype(float)
+        # Una columna sin ningún costo calculado no se agrega a la hoja
+        if columna not in guardado.columns:
+            assert valores.isna().all()
+            continue
+        np.testing.assert_allclose(guardado[columna].astype(float), valores)
+    # L1 vida 1: 1000 / (1000 - 0) km
+    assert guardado.loc['L1', 'costo_km_vida1'] == pytest.approx(1.0)
@@ -0,0 +1,40 @@
+def test_parche_ubica_las_filas_de_una_hoja_con_filas_en_blanco_intermedias(sill, hoja_de_calculo):
+    hoja_de_calculo.valores[sill.SHEET_CLIENTES] = [
+        ['nit', 'nombre'],
+        ['900000', 'Cliente 0'],
+        [],
+        ['900001', 'Cliente 1'],
+        ['900002', 'Cliente 2'],
+    ]
+    almacenamiento = sill.AlmacenamientoSheets()
+    anterior = almacenamiento.leer_varias([sill.SHEET_CLIENTES])[sill.SHEET_CLIENTES].reset_index(drop=True)
+    nuevo = anterior.copy()
+    nuevo.loc[2, 'nombre'] = 'Editado'
+
+    assert almacenamiento.escribir(sill.SHEET_CLIENTES, nuevo, anterior) is False
+    assert hoja_de_calculo.valores[sill.SHEET_CLIENTES][4] == ['900002', 'Editado']
+    assert hoja_de_calculo.valores[sill.SHEET_CLIENTES][3] == ['900001', 'Cliente 1']
+
+
+def test_parche_del_diario_ubica_las_filas_de_una_hoja_con_filas_en_blanco_intermedias(sill, hoja_de_calculo):
+    hoja_de_calculo.valores[sill.SHEET_CLIENTES] = [['nit', 'nombre'], [], ['900000', 'Cliente 0'], ['900001', 'Cliente 1']]
+    almacenamiento = sill.AlmacenamientoSheets()
+    anterior = almacenamiento.leer_varias([sill.SHEET_CLIENTES])[sill.SHEET_CLIENTES].reset_index(drop=True)
+    nuevo = anterior.copy()
+    nuevo.loc[0, 'nombre'] = 'Editado'
+    parche = sill._parche(anterior, nuevo)
+
+    almacenamiento.aplicar([{'hoja': sill.SHEET_CLIENTES, 'anterior': None, 'df': None, 'agregar': None, 'parche': parche}])
+    assert hoja_de_calculo.valores[sill.SHEET_CLIENTES][1] == []
+    assert hoja_de_calculo.valores[sill.SHEET_CLIENTES][2] == ['900000', 'Editado']
+
+
+def test_reescritura_quita_los_huecos(sill, hoja_de_calculo):
+    hoja_de_calculo.valores[sill.SHEET_CLIENTES] = [['nit', 'nombre'], ['900000', 'Cliente 0'], [], ['900001', 'Cliente 1']]
+    almacenamiento = sill.AlmacenamientoSheets()
+    df = almacenamiento.leer_varias([sill.SHEET_CLIENTES])[sill.SHEET_CLIENTES].reset_index(drop=True)
+    assert sill._huecos_tiene(sill.SHEET_CLIENTES)
+
+    almacenamiento.aplicar([{'hoja': sill.SHEET_CLIENTES, 'anterior': None, 'df': df, 'agregar': None}])
+    assert [fila[1] for fila in hoja_de_calculo.valores[sill.SHEET_CLIENTES]] == ['nombre', 'Cliente 0', 'Cliente 1']
+    assert not sill._huecos_tiene(sill.SHEET_CLIENTES)
@@ -0,0 +1,68 @@
+import pandas as pd
+import pytest
+
+from ejemplos import servicios_de_prueba
+
+
+def test_migrar_particiones_reparte_por_anio(sill, almacenamiento):
+    almacenamiento.escribir(sill.SHEET_SERVICIOS, servicios_de_prueba())
+    assert not sill.particiones_activas()
+    assert sill.particiones_pendientes()
+
+    assert sill.migrar_particiones()
+    assert not sill.particiones_pendientes()
+    ids = lambda hoja: almacenamiento.leer(hoja)['id_servicio'].tolist()
+    assert ids('servicios_2023') == ['TR01_S0001', 'TR01_S0002']
+    assert ids('servicios_2024') == ['TR01_S0003', 'TR01_S0004', 'TR01_S0006']
+    # Las filas sin fecha se quedan en la hoja original
+    assert ids(sill.SHEET_SERVICIOS) == ['TR01_S0005']
+    assert sorted(sill.leer_hoja(sill.SHEET_SERVICIOS)['id_servicio']) == sorted(servicios_de_prueba()['id_servicio'])
+
+    # Repetirla no cambia nada
+    assert sill.migrar_particiones()
+    assert ids('servicios_2024') == ['TR01_S0003', 'TR01_S0004', 'TR01_S0006']
+
+
+def test_sin_migrar_las_hojas_particionadas_se_usan_completas(sill, almacenamiento):
+    almacenamiento.escribir(sill.SHEET_SERVICIOS, servicios_de_prueba())
+    sill.inicializar_datos()
+    sill.agregar_filas(sill.SHEET_SERVICIOS, servicios_de_prueba().iloc[:1].assign(id_servicio='TR01_S0009', fecha='01/01/2025'))
+    assert not sill.particiones_activas()
+    assert sill.SHEET_PARTICIONES not in almacenamiento.hojas()
+    assert almacenamiento.leer(sill.SHEET_SERVICIOS)['id_servicio'].iloc[-1] == 'TR01_S0009'
+
+
+def test_leer_historial_solo_lee_las_particiones_del_rango(sill, almacenamiento, monkeypatch):
+    almacenamiento.escribir(sill.SHEET_SERVICIOS, servicios_de_prueba())
+    sill.migrar_particiones()
+    sill.agregar_filas(sill.SHEET_SERVICIOS, servicios_de_prueba().iloc[:1].assign(id_servicio='TR01_S0007', fecha='10/02/2025'))
+    assert almacenamiento.leer('servicios_2025')['id_servicio'].tolist() == ['TR01_S0007']
+
+    leidas = []
+    leer_fisica = sill._leer_hoja_fisica
+    monkeypatch.setattr(sill, '_leer_hoja_fisica', lambda hoja: leidas.append(hoja) or leer_fisica(hoja))
+    desde, hasta = pd.Timestamp('2024-01-03').date(), pd.Timestamp('2024-12-31').date()
+    df = sill.leer_historial(sill.SHEET_SERVICIOS, desde, hasta)
+
+    assert df['id_servicio'].tolist() == ['TR01_S0004', 'TR01_S0006']
+    assert 'servicios_2023' not in leidas and 'servicios_2025' not in leidas
+
+
+def test_particion_nueva_de_una_unidad_fallida_no_queda_en_el_espejo(sill, almacenamiento):
+    almacenamiento.escribir(sill.SHEET_SERVICIOS, servicios_de_prueba())
+    sill.migrar_particiones()
+    nueva = servicios_de_prueba().iloc[:1].assign(id_servicio='TR01_S0007', fecha='10/02/2025')
+
+    with pytest.raises(RuntimeError):
+        with sill.UnidadDeTrabajo():
+            sill.agregar_filas(sill.SHEET_SERVICIOS, nueva)
+            assert 'TR01_S0007' in sill.leer_hoja(sill.SHEET_SERVICIOS)['id_servicio'].tolist()
+            raise RuntimeError("falla después de preparar la partición")
+    assert sill._espejo_estado('servicios_2025') == (None, None)
+    assert 'servicios_2025' not in almacenamiento.hojas()
+    assert 'servicios_2025' not in sill.leer_hoja(sill.SHEET_PARTICIONES)['particion'].tolist()
+
+    # Confirmada, la partición se crea con sus filas
+    assert sill.agregar_filas(sill.SHEET_SERVICIOS, nueva)
+    assert almacenamiento.leer('servicios_2025')['id_servicio'].tolist() == ['TR01_S0007']
+    assert sill._leer_hoja_fisica('servicios_2025')['id_servicio'].tolist() == ['TR01_S0007']
@@ -0,0 +1,22 @@
+import logging
+
+import pytest
+
+
+def test_precarga_registra_las_fallas_esperables(sill, almacenamiento, monkeypatch, caplog):
+    def sin_red(nombres_hojas):
+        raise ConnectionError("sin red")
+    monkeypatch.setattr(almacenamiento, 'leer_varias', sin_red)
+
+    with caplog.at_level(logging.WARNING, logger='sill'):
+        sill.precargar_hojas([sill.SHEET_CLIENTES, sill.SHEET_LLANTAS])
+    assert sill.SHEET_CLIENTES in caplog.text and 'sin red' in caplog.text
+
+
+def test_precarga_no_oculta_errores_inesperados(sill, almacenamiento, monkeypatch):
+    def defectuosa(nombres_hojas):
+        raise TypeError("error de programación")
+    monkeypatch.setattr(almacenamiento, 'leer_varias', defectuosa)
+
+    with pytest.raises(TypeError):
+        sill.precargar_hojas([sill.SHEET_CLIENTES])
@@ -0,0 +1,30 @@
+import threading
+
+import pandas as pd
+import pytest
+
+from ejemplos import servicios_de_prueba
+
+
+def test_asignar_consecutivos_no_repite_numeros(sill, almacenamiento):
+    almacenamiento.escribir(sill.SHEET_SERVICIOS, servicios_de_prueba())
+    asignados = []
+
+    def asignar():
+        for _ in range(25):
+            asignados.extend(sill.asignar_consecutivos(sill.SHEET_SERVICIOS, 'TR01_S', 2))
+    hilos = [threading.Thread(target=asignar) for _ in range(4)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    # Parten del mayor ID de la hoja y no se repiten entre hilos
+    assert sorted(asignados) == list(range(7, 207))
+
+
+def test_asignar_consecutivos_sigue_a_ids_escritos(sill, almacenamiento):
+    almacenamiento.escribir(sill.SHEET_SERVICIOS, servicios_de_prueba())
+    assert sill.asignar_consecutivos(sill.SHEET_SERVICIOS, 'TR01_S', 1) == [7]
+    sill.agregar_filas(sill.SHEET_SERVICIOS, servicios_de_prueba().iloc[:1].assign(id_servicio='TR01_S0050'))
+    assert sill.asignar_consecutivos(sill.SHEET_SERVICIOS, 'TR01_S', 3) == [51, 52, 53]
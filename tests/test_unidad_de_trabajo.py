@@ -0,0 +1,53 @@
+import pandas as pd
+import pytest
+
+from ejemplos import clientes_de_prueba
+
+
+def test_unidad_confirma_todos_los_cambios_juntos(sill, almacenamiento):
+    almacenamiento.escribir(sill.SHEET_CLIENTES, clientes_de_prueba())
+    with sill.UnidadDeTrabajo() as unidad:
+        df = sill.leer_hoja(sill.SHEET_CLIENTES)
+        df.loc[0, 'nombre'] = 'Editado'
+        sill.escribir_hoja(sill.SHEET_CLIENTES, df)
+        sill.agregar_filas(sill.SHEET_USUARIOS, pd.DataFrame([{'id_usuario': 'U1', 'usuario': 'u', 'nivel': 3}]))
+        # Antes de confirmar solo la vista de la unidad tiene los cambios
+        assert sill.leer_hoja(sill.SHEET_CLIENTES).loc[0, 'nombre'] == 'Editado'
+        assert almacenamiento.leer(sill.SHEET_CLIENTES).loc[0, 'nombre'] == 'Cliente 0'
+    assert unidad.confirmada
+    assert almacenamiento.leer(sill.SHEET_CLIENTES).loc[0, 'nombre'] == 'Editado'
+    assert almacenamiento.leer(sill.SHEET_USUARIOS)['id_usuario'].tolist() == ['U1']
+
+
+def test_unidad_no_envia_nada_si_el_bloque_falla(sill, almacenamiento):
+    almacenamiento.escribir(sill.SHEET_CLIENTES, clientes_de_prueba())
+    with pytest.raises(RuntimeError):
+        with sill.UnidadDeTrabajo():
+            df = sill.leer_hoja(sill.SHEET_CLIENTES)
+            df.loc[0, 'nombre'] = 'Editado'
+            sill.escribir_hoja(sill.SHEET_CLIENTES, df)
+            raise RuntimeError("falla a mitad de la operación")
+    assert almacenamiento.leer(sill.SHEET_CLIENTES).loc[0, 'nombre'] == 'Cliente 0'
+    assert sill.leer_hoja(sill.SHEET_CLIENTES).loc[0, 'nombre'] == 'Cliente 0'
+
+
+def test_unidad_revierte_todo_si_falla_el_envio(sill, almacenamiento, mensajes, monkeypatch):
+    almacenamiento.escribir(sill.SHEET_CLIENTES, clientes_de_prueba())
+    almacenamiento.escribir(sill.SHEET_USUARIOS, pd.DataFrame([{'id_usuario': 'U0', 'usuario': 'a', 'nivel': 1}]))
+    sill.leer_hoja(sill.SHEET_USUARIOS)
+
+    def aplicar_fallido(lote):
+        raise ValueError("el almacenamiento rechazó el lote")
+    monkeypatch.setattr(almacenamiento, 'aplicar', aplicar_fallido)
+
+    with sill.UnidadDeTrabajo() as unidad:
+        df = sill.leer_hoja(sill.SHEET_CLIENTES)
+        df.loc[0, 'nombre'] = 'Editado'
+        sill.escribir_hoja(sill.SHEET_CLIENTES, df)
+        sill.agregar_filas(sill.SHEET_USUARIOS, pd.DataFrame([{'id_usuario': 'U1', 'usuario': 'u', 'nivel': 3}]))
+    assert not unidad.confirmada
+    assert mensajes.errores
+    # Ni el almacenamiento ni el espejo quedaron con una parte del lote
+    assert almacenamiento.leer(sill.SHEET_CLIENTES).loc[0, 'nombre'] == 'Cliente 0'
+    assert sill.leer_hoja(sill.SHEET_CLIENTES).loc[0, 'nombre'] == 'Cliente 0'
+    assert sill.leer_hoja(sill.SHEET_USUARIOS)['id_usuario'].tolist() == ['U0']